@@ -1,13 +1,22 @@
 #待機フェーズ＆落下フェーズ
 import os
 import time
-import cv2
 import sys
 import math
-import numpy as np
 import datetime
+from collections import deque
+
+# 起動ごとに import の時間を記録する（startup.py）。フェーズ1に要るものだけをここで読み込む
+import startup
+startup.install()
+
 import RPi.GPIO as GPIO
 import ijochi
+from mission import Mission, Phase
+import checkpoint
+import heartbeat
+import profiler
+import altitude_filter
 
 # ★ make_csvをインポート (安全な読み込みとダミークラスの作成)
 try:
@@ -25,6 +34,63 @@ except ImportError:
 LED_PIN = 5
 NICHROME_PIN = 16  # ニクロム線のピンも定義しておく
 
+# ==========================================
+# カメラ・AIモデル設定
+# ==========================================
+MODEL_PATH = "./my_custom_model.pt"
+HSV_PROFILE_PATH = "./hsv_profile.json"  # hsv_tuner.py の出力（無ければ既定のしきい値）
+MODEL_PRELOAD_DISTANCE = 30.0  # ゴールまでこの距離[m]を切ったらYOLOの事前読み込みを開始
+
+# 画像ログ設定（保存は別スレッドで行う）
+IMAGE_SAVE_INTERVAL = 1.0   # 定期保存の間隔 [s]
+IMAGE_JPEG_QUALITY = 80
+IMAGE_SAVE_SCALE = 1.0      # 0.5にすると320x240で保存
+IMAGE_PRE_FRAMES = 10       # イベント(ゴール/ロスト/スタック)前に残すフレーム数
+IMAGE_POST_FRAMES = 5       # イベント後に残すフレーム数
+
+# カメラ誘導（フェーズ4）の連続操舵設定
+VISUAL_SERVO = True         # False にすると従来の「旋回3秒→前進2.5秒」の段階制御
+SERVO_MAX_POWER = 0.7       # 遠い（赤が小さい）ときの前進パワー
+SERVO_MIN_POWER = 0.35      # ゴール直前の前進パワー
+SERVO_GOAL_RED_PERCENT = 0.3  # Camera が order=4 を出す赤の割合（ここに向けて減速する）
+SERVO_KP = 0.8              # 横ずれ(target_x_percent)に対する左右差のゲイン
+SERVO_KD = 0.1              # 横ずれの変化率に対するゲイン（振れ止め）
+SERVO_MAX_TURN = 0.35       # 左右差の上限 [モーター値]
+SERVO_COAST_FRAMES = 3      # 見失ってもこのフレーム数は直進を続ける（一瞬の見落としで止まらない）
+
+# GPS誘導（フェーズ3）の連続走行設定
+GPS_CONTINUOUS = True       # False にすると従来の Stop & Go（15秒前進→停止→測位→旋回）
+HANDOVER_DISTANCE = 10.0    # 近距離フェーズへ引き渡す距離 [m]
+GPS_PURSUIT_TIMEOUT = 60.0  # 測位がこの時間途切れたら近距離フェーズへ [s]
+GPS_STALL_TIME = 20.0       # この時間で GPS_STALL_DISTANCE 進んでいなければスタックとみなす [s]
+GPS_STALL_DISTANCE = 1.0    # [m]
+GPS_PURSUIT_LOG_PERIOD = 5.0  # 距離・方位ズレをCSVに記録する周期 [s]
+GPS_PURSUIT_MIN_RUN = 1.0   # 走行指令がこれより早くスタック無しで終わったら、走れていないとみなす [s]
+GPS_PURSUIT_MAX_FAILS = 3   # 続けてこの回数走れなかったら Stop & Go に切り替える
+
+# 処理時間の計測（profiler.py）
+PROFILE = False             # True にするとセンサー読み取り・GPS・カメラ・CSV書き込み・move() の時間を計る
+PROFILE_LOG_PERIOD = 60.0   # 全フェーズ合計の集計をCSVに記録する周期 [s]（フェーズを抜けるときはそのフェーズ分も記録）
+
+# 高度の推定（altitude_filter.py: 気圧と上下方向の加速度のカルマンフィルタ）
+ALT_FILTER_PERIOD = 0.05      # フェーズ1・2で気圧と加速度を読む周期 [s]
+ALT_LOG_PERIOD = 1.0          # 推定値をCSVに記録する周期 [s]
+
+# センサーとカメラを別プロセスで動かす（sensor_proc.py / vision_proc.py。共有メモリのリングでやり取りする）
+# True にすると I2C の読み取りと YOLO がメインの制御ループと GIL を取り合わない。fm_sim.py は False のまま使う
+MULTIPROCESS = False
+SENSOR_PROCESS_CHECK_PERIOD = 1.0  # センサープロセスが死んでいないか見る周期 [s]
+
+# supervisor.py の心拍の猶予 [s]（センサーのリトライ・カメラの起動はこれくらいかかりうる）
+SETUP_HEARTBEAT_EXPECT = 30.0
+CAMERA_HEARTBEAT_EXPECT = 10.0
+
+# 再起動からの復帰（checkpoint.py）
+CHECKPOINT_PATH = '/home/sc28/SC-28/5_log/checkpoint.json'
+CHECKPOINT_PERIOD = 2.0       # フェーズ中の保存周期 [s]（フェーズが変わるたびにも保存する）
+CHECKPOINT_MAX_AGE = 6 * 3600  # これより古いチェックポイントからは再開しない [s]
+RESUME_FIX_TOLERANCE = 5.0    # 再開後の最初の測位が保存した測位からこの距離[m]以内なら、保存した進行方向ベクトルを使う
+
 # ==========================================
 # --- ディレクトリ設定 (画像保存用) ---
 # ==========================================
@@ -40,147 +106,254 @@ SESSION_SAVE_DIR = os.path.join(PIC_DIR, f"run_{session_time}")
 # ==========================================
 # モジュール読み込み
 # ==========================================
+# フェーズ1（気圧の監視）に要るセンサーだけを起動時に読み込む
 try:
-    from camera import Camera
     from bno055 import BNO055
     from bme280 import BME280Sensor
-    from gps import idokeido, calculate_distance_and_angle
-    import motordrive as md
 except ImportError as e:
     print(f"【警告】モジュール読み込みエラー: {e}")
     make_csv.print("error", f"モジュール読み込みエラー: {e}")
     print("一部の機能が制限されますが、続行します。")
     make_csv.print("warning", "一部の機能が制限されますが、続行します。")
-    time.sleep(2)
+
+# 重いモジュール（numpy / gpiozero / pyproj / cv2 / picamera2）は最初に使うときに読み込む
+# main() の先頭で先読みスレッドを起こすので、センサーのセットアップ中に読み込みが進む
+md = startup.lazy("motordrive")
+gps = startup.lazy("gps")
+guidance = startup.lazy("guidance")
+camera = startup.lazy("camera")
+image_logger = startup.lazy("image_logger")
+cv2 = startup.lazy("cv2")
+sensor_proc = startup.lazy("sensor_proc")
+vision_proc = startup.lazy("vision_proc")
+PRELOAD_MODULES = ["motordrive", "gps", "guidance", "camera", "image_logger"]
+IMPORT_REPORT_TOP = 8       # CSVに記録する遅い import の数（全体は importtime_*.txt に書く）
 
 # ==========================================
 # ヘルパー関数
 # ==========================================
-def save_frame_if_needed(frame, last_save_time, interval=1.0, save_dir=SESSION_SAVE_DIR):
+def turn_by_angle(bno, md, initial_angle_diff, is_inverted, motor_ok):
     """
-    指定した間隔(interval)で画像を、今回の実行用サブフォルダに保存する。
-    戻り値: 更新された last_save_time
+    現在の向いている方向から、指定した角度(initial_angle_diff)だけ旋回する。
+    BNO055のYawを見ながら1回の連続動作で旋回する（Yawが読めなければ学習済みの旋回速度で時間旋回）
     """
-    current_time = time.time()
-    # 前回保存時から interval 秒以上経過していたら保存
-    if (current_time - last_save_time) >= interval:
-        # フォルダが存在しなければ作成（起動後最初の1回目に作られます）
-        if not os.path.exists(save_dir):
-            try:
-                os.makedirs(save_dir)
-            except Exception as e:
-                print(f"フォルダ作成エラー: {e}")
-                make_csv.print("error", f"フォルダ作成エラー: {e}")
-                return current_time # 保存失敗でも保存時間を更新することで負荷対策
-
-        # ファイル名（例: img_1684300000.jpg）を作成して保存
-        filename = os.path.join(save_dir, f"img_{int(current_time)}.jpg")
-        try:
-            cv2.imwrite(filename, frame)
-        except Exception as e:
-            print(f"画像保存エラー: {e}")
-            make_csv.print("error", f"画像保存エラー: {e}")
-            
-        return current_time # 保存時間を更新して返す
-        
-    return last_save_time
+    if not motor_ok:
+        return
 
+    print(f"🔄 フィードバック旋回開始: {initial_angle_diff:.1f}度")
+    make_csv.print("msg", f"フィードバック旋回開始: {initial_angle_diff:.1f}度")
 
-def turn_by_angle(bno, md, initial_angle_diff, is_inverted, motor_ok):
+    remaining = md.turn(initial_angle_diff, power=0.7, is_inverted=is_inverted, tolerance=5.0)
+    if remaining is not None:
+        print(f"✅ 旋回完了 (最終誤差: {remaining:.1f}度)")
+        make_csv.print("msg", f"旋回完了 (最終誤差: {remaining:.1f}度)")
+
+
+class VisualServo:
     """
-    現在の向いている方向から、指定した角度(initial_angle_diff)だけ旋回する。
+    フェーズ4の連続操舵: カメラ1フレームごとに左右差と速度を更新し、止まらずに前進しながらコーンへ寄せる
+    - 左右差: target_x_percent のPD制御
+    - 速度: 赤の面積が order=4 のしきい値に近づくほど下げる
     """
-    OMEGA_DEG_PER_SEC = 90.0/20 #20秒で90°
-    MIN_DURATION = 0.3        
-    MAX_ATTEMPTS = 3          
-
-    if not bno or not motor_ok:
-        turn_time = min(abs(initial_angle_diff) / OMEGA_DEG_PER_SEC, 5.0)
-        cmd = 'd' if initial_angle_diff > 0 else 'a'
-        md.move(cmd, power=0.7, duration=turn_time, is_inverted=is_inverted, enable_stack_check=False)
-        return
+    def __init__(self):
+        self.ctrl = None
+        self.future = None
+        self.prev_x = None
+        self.prev_t = None
+        self.lost_frames = 0
+        self.start_time = None
+        self.sign_changes = 0   # 左右差の符号が入れ替わった回数（振動の目安）
+        self.prev_sign = 0
+
+    @property
+    def active(self):
+        return self.future is not None and not self.future.done()
+
+    def update(self, order, x_pct, area, frame_shape, is_inverted):
+        """
+        1フレーム分の操舵を行う
+        Return:
+            True: 連続操舵中, False: 操舵できない（見失いが続いた/ゴール）→ 呼び出し側の処理に任せる
+        """
+        if order == 4:
+            return False
+        if self.future is not None and self.ctrl.stacked.is_set():
+            return True  # スタック検知で減速中（take_stacked() で回収する）
+        if order == 0:
+            self.lost_frames += 1
+            if self.active and self.lost_frames <= SERVO_COAST_FRAMES:
+                return True
+            self.stop()
+            return False
+        self.lost_frames = 0
+
+        now = time.monotonic()
+        dx = 0.0
+        if self.prev_x is not None and now > self.prev_t:
+            dx = (x_pct - self.prev_x) / (now - self.prev_t)
+        self.prev_x, self.prev_t = x_pct, now
+
+        turn = SERVO_KP * x_pct + SERVO_KD * dx
+        turn = max(-SERVO_MAX_TURN, min(SERVO_MAX_TURN, turn))
+        sign = (turn > 0.02) - (turn < -0.02)
+        if sign and self.prev_sign and sign != self.prev_sign:
+            self.sign_changes += 1
+        if sign:
+            self.prev_sign = sign
+
+        red_percent = area / float(frame_shape[0] * frame_shape[1])
+        closeness = min(1.0, max(0.0, red_percent / SERVO_GOAL_RED_PERCENT))
+        power = SERVO_MAX_POWER - (SERVO_MAX_POWER - SERVO_MIN_POWER) * closeness
+
+        if self.ctrl is None:
+            self.ctrl = md.get_controller()
+        if not self.active:
+            self.start_time = self.start_time or now
+            print("連続操舵を開始します。")
+            make_csv.print("msg", "連続操舵を開始します。")
+        self.future = self.ctrl.steer(power, turn, is_inverted=is_inverted)
+        return True
+
+    def take_stacked(self):
+        """コントローラーがスタックを検知していれば、停止を待って 1 を返す"""
+        if self.ctrl is None or self.future is None or not self.ctrl.stacked.is_set():
+            return 0
+        try:
+            is_stacked = self.future.result(timeout=3.0)
+        except Exception:
+            is_stacked = 1
+        self.future = None
+        self.prev_x = None
+        return is_stacked
+
+    def stop(self):
+        """減速停止を待つ（この後に md.move() 等を使えるようにする）"""
+        if self.ctrl is not None and self.active:
+            try:
+                self.ctrl.stop().result(timeout=3.0)
+            except Exception:
+                pass
+        self.future = None
+        self.prev_x = None
 
-    euler = ijochi.abnormal_check("euler", bno.euler, ERROR_FLAG=False)
-    if euler is None:
-        return
-    
-    # 【修正①】初期角度の取得時に逆さ補正を入れる
-    start_yaw = euler[0]
-    if is_inverted:
-        start_yaw = (360.0 - start_yaw) % 360.0 # 回転方向を地面基準に合わせる
-    
-    target_yaw = (start_yaw + initial_angle_diff) % 360.0
-    print(f"🔄 フィードバック旋回開始: 現在Yaw={start_yaw:.1f}度, 目標Yaw={target_yaw:.1f}度")
-    make_csv.print("msg", f"フィードバック旋回開始: 現在Yaw={start_yaw:.1f}度, 目標Yaw={target_yaw:.1f}度")
-
-    for attempt in range(MAX_ATTEMPTS):
-        curr_euler = ijochi.abnormal_check("euler", bno.euler, ERROR_FLAG=False)
-        if curr_euler is None:
-            break
-            
-        # 【修正②】現在の角度の取得時にも逆さ補正を入れる
-        curr_yaw = curr_euler[0]
-        if is_inverted:
-            curr_yaw = (360.0 - curr_yaw) % 360.0
-        
-        diff = (target_yaw - curr_yaw + 180) % 360 - 180
-        
-        if abs(diff) < 15.0:
-            print(f"✅ 旋回完了 (最終誤差: {diff:.1f}度)")
-            make_csv.print("msg", f"旋回完了 (最終誤差: {diff:.1f}度)")
-            break
-            
-        turn_time = abs(diff) / OMEGA_DEG_PER_SEC
-        if turn_time < MIN_DURATION:
-            turn_time = MIN_DURATION
-        turn_time = min(turn_time, 4.0)
-        
-        cmd = 'd' if diff > 0 else 'a'
-        print(f"   -> 補正 {attempt+1}/{MAX_ATTEMPTS}: 残り {diff:.1f}度, {turn_time:.2f}秒駆動")
-        make_csv.print("msg", f"補正 {attempt+1}/{MAX_ATTEMPTS}: 残り {diff:.1f}度, {turn_time:.2f}秒駆動")
-        
-        # ここはis_invertedを渡して物理的なモーター反転を任せる
-        md.move(cmd, power=0.7, duration=turn_time, is_inverted=is_inverted, enable_stack_check=False)
-        time.sleep(0.5)
+    def report(self):
+        """ゴール時の記録（接近時間と左右の振れ）"""
+        if self.start_time is None:
+            return
+        msg = f"連続操舵: 接近時間 {time.monotonic() - self.start_time:.1f}s, 左右の切り返し {self.sign_changes}回"
+        print(msg)
+        make_csv.print("msg", msg)
 
 
 # ==========================================
 # セットアップ
 # ==========================================
-def setup_sensors():
-    """カメラ以外の基本センサーとハードウェアのセットアップ"""
-    # --- BNO055 ---
-    print("bnoセットアップ開始")
-    make_csv.print("msg", "bnoセットアップ開始")
-    bno = None
-    for attempt in range(10):
-        try:
-            temp_bno = BNO055()
-            if temp_bno.begin():
-                bno = temp_bno
-                print(f"  -> BNO055: Setup Success (試行回数: {attempt + 1})")
-                make_csv.print("msg", f"BNO055: Setup Success (試行回数: {attempt + 1})")
-                break
-            else:
-                print(f"  -> BNO055: Init Failed (試行回数: {attempt + 1}/10)")
-                make_csv.print("warning", f"BNO055: Init Failed (試行回数: {attempt + 1}/10)")
-        except Exception as e:
-            print(f"  -> BNO055 Setup Error: {e} (試行回数: {attempt + 1}/10)")
-            make_csv.print("error", f"BNO055 Setup Error: {e}")
-        time.sleep(0.5)
+# MULTIPROCESS のときの子プロセス（最初に要るときに起こす）
+sensor_process = None
+vision_process = None
+
+
+def _sensor_process():
+    global sensor_process
+    if sensor_process is None:
+        heartbeat.beat(expect=sensor_proc.START_TIMEOUT)
+        sensor_process = sensor_proc.SensorProcess()
+        bno_ok, bme_ok = sensor_process.start()
+        make_csv.print("msg", f"センサープロセス起動: BNO055={bno_ok}, BME280={bme_ok}")
+    return sensor_process
+
+
+def _new_bme():
+    if MULTIPROCESS:
+        return sensor_proc.SharedBME(_sensor_process())
+    return BME280Sensor(debug=False)
+
+
+def _new_bno():
+    if MULTIPROCESS:
+        return sensor_proc.SharedBNO(_sensor_process())
+    return BNO055()
+
+
+def check_sensor_process():
+    """センサープロセスが落ちていたら起こし直す（定期タスク）"""
+    if sensor_process is None or sensor_process.alive:
+        return
+    msg = f"センサープロセスが停止していたため再起動します（{sensor_process.restarts + 1}回目）"
+    print(msg)
+    make_csv.print("warning", msg)
+    heartbeat.beat(expect=sensor_proc.START_TIMEOUT)
+    sensor_process.restart()
+
+
+def spawn_vision_process():
+    """カメラのプロセスを起こす（YOLO の読み込みが別のコアで進む）。新しく起こしたら True"""
+    global vision_process
+    if vision_process is not None and not vision_process.closed:
+        return False
+    vision_process = vision_proc.VisionProcess(MODEL_PATH, HSV_PROFILE_PATH)
+    vision_process.spawn()
+    return True
+
+
+def _remote_camera():
+    """別プロセスのカメラ。カメラが開けなければプロセスを閉じて None"""
+    global vision_process
+    spawn_vision_process()
+    cam = vision_proc.RemoteCamera(vision_process)
+    if cam.ready():
+        return cam
+    cam.close()
+    vision_process = None
+    return None
+
+
+def close_processes():
+    global sensor_process, vision_process
+    for p in (sensor_process, vision_process):
+        if p is not None:
+            try: p.close()
+            except Exception: pass
+    sensor_process = vision_process = None
+
+
+def setup_sensors(qnh=None):
+    """
+    カメラ以外の基本センサーとハードウェアのセットアップ
+    フェーズ1に要る順（ニクロム線OFF → 気圧 → 姿勢 → モーター）に行い、最初の気圧サンプルまでを短くする
+    qnh: 再開時に保存していた基準気圧（指定すると基準の取り直しをしない）
+    """
+    # --- GPIO (LED, ニクロム線) ---
+    print("GPIOセットアップ開始")
+    make_csv.print("msg", "GPIOセットアップ開始")
+    gpio_ok = False
+    try:
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(LED_PIN, GPIO.OUT)
+        GPIO.setup(NICHROME_PIN, GPIO.OUT)
+
+        # 【超重要】起動直後は絶対にOFFにする（安全対策）
+        GPIO.output(LED_PIN, 0)
+        GPIO.output(NICHROME_PIN, 0)
+        gpio_ok = True
+    except Exception as e:
+        print(f"GPIO Setup Error: {e}")
+        make_csv.print("error", f"GPIO Setup Error: {e}")
 
     # --- BME280 ---
     print("bmeセットアップ開始")
     make_csv.print("msg", "bmeセットアップ開始")
     bme = None
+    saved_qnh = qnh
     qnh = 1013.25
     
     # 最大10回リトライする
     for attempt in range(10):
         try:
-            temp_bme = BME280Sensor(debug=False)
+            temp_bme = _new_bme()
             if temp_bme.calib_ok:
-                qnh = temp_bme.baseline()
+                startup.milestone("first pressure sample")
+                qnh = saved_qnh if saved_qnh is not None else temp_bme.baseline()
                 bme = temp_bme  # 成功したら正式に代入
                 print(f"BME280: Setup Success (試行回数: {attempt + 1})")
                 make_csv.print("msg", f"BME280: Setup Success (試行回数: {attempt + 1})")
@@ -193,35 +366,44 @@ def setup_sensors():
             make_csv.print("error", f"BME280 Setup Error: {e}")
         
         time.sleep(0.5)  # 失敗した場合、0.5秒待ってから再試行
+    if bme:
+        make_csv.print("alt_base_press", qnh)  # 高度の基準気圧（高度フィルタの入力）
+
+    # --- BNO055 ---
+    print("bnoセットアップ開始")
+    make_csv.print("msg", "bnoセットアップ開始")
+    bno = None
+    for attempt in range(10):
+        try:
+            temp_bno = _new_bno()
+            if temp_bno.begin():
+                bno = temp_bno
+                print(f"  -> BNO055: Setup Success (試行回数: {attempt + 1})")
+                make_csv.print("msg", f"BNO055: Setup Success (試行回数: {attempt + 1})")
+                break
+            else:
+                print(f"  -> BNO055: Init Failed (試行回数: {attempt + 1}/10)")
+                make_csv.print("warning", f"BNO055: Init Failed (試行回数: {attempt + 1}/10)")
+        except Exception as e:
+            print(f"  -> BNO055 Setup Error: {e} (試行回数: {attempt + 1}/10)")
+            make_csv.print("error", f"BNO055 Setup Error: {e}")
+        time.sleep(0.5)
 
     # --- Motor ---
     print("モータセットアップ開始")
     make_csv.print("msg", "モータセットアップ開始")
     motor_ok = False
     try:
+        md.attach_bno(bno)  # 姿勢センサーはモーター側と共有する（2回 begin() すると融合がリセットされる）
         md.setup_motors()
-        motor_ok = True
+        motor_ok = md.motors_ready()
+        if not motor_ok:
+            print("Motor Setup Error: motors not initialized")
+            make_csv.print("error", "Motor Setup Error: motors not initialized")
     except Exception as e:
         print(f"Motor Setup Error: {e}")
         make_csv.print("error", f"Motor Setup Error: {e}")
 
-    # --- GPIO (LED, ニクロム線) ---
-    print("GPIOセットアップ開始")
-    make_csv.print("msg", "GPIOセットアップ開始")
-    gpio_ok = False
-    try:
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(LED_PIN, GPIO.OUT)
-        GPIO.setup(NICHROME_PIN, GPIO.OUT)
-
-        # 【超重要】起動直後は絶対にOFFにする（安全対策）
-        GPIO.output(LED_PIN, 0)
-        GPIO.output(NICHROME_PIN, 0)
-        gpio_ok = True
-    except Exception as e:
-        print(f"GPIO Setup Error: {e}")
-        make_csv.print("error", f"GPIO Setup Error: {e}")
-
     return bno, bme, qnh, motor_ok, gpio_ok
 
 def setup_camera():
@@ -229,8 +411,12 @@ def setup_camera():
     print("cameraセットアップ開始")
     make_csv.print("msg", "cameraセットアップ開始")
     cam = None
+    heartbeat.beat(expect=CAMERA_HEARTBEAT_EXPECT)
     try:
-        cam = Camera(model_path="./my_custom_model.pt", debug=True)
+        if MULTIPROCESS:
+            cam = _remote_camera()
+        else:
+            cam = camera.Camera(model_path=MODEL_PATH, debug=True, keep_raw=True, hsv_profile=HSV_PROFILE_PATH)
     except Exception as e:
         print(f"Camera Setup Error: {e}")
         make_csv.print("error", f"Camera Setup Error: {e}")
@@ -251,24 +437,919 @@ def close_camera(cam):
 
 
 
+# ==========================================
+# ミッション（フェーズごとのクラス）
+# ==========================================
+class MissionContext:
+    """フェーズ間で共有する機体の状態とセンサー"""
+    def __init__(self, bno, bme, qnh, motor_ok, gpio_ok, goal_lat, goal_lon):
+        self.bno = bno
+        self.bme = bme
+        self.qnh = qnh
+        self.motor_ok = motor_ok
+        self.gpio_ok = gpio_ok
+        self.goal_lat = goal_lat
+        self.goal_lon = goal_lon
+
+        self.cam = None
+        self.img_logger = None
+        self.is_inverted = False
+        self.nichrome_on = False
+        self.goal_reason = None     # ゴール判定の根拠（"camera" / "gps"）
+        self.alt_filter = altitude_filter.AltitudeFilter()
+
+        # チェックポイントに残す状態
+        self.phase = None
+        self.start_phase = 1        # 再開するときは保存したフェーズ
+        self.nichrome_fired = False  # ニクロム線に通電した（＝着地を判定済み）
+        self.last_fix = None        # 最後に取れた測位 (lat, lon)
+        self.heading_vector = None  # Stop & Go の進行方向ベクトル (前回の lat, lon, 今回の lat, lon)
+        self.resumed = False
+
+    def update_inverted(self):
+        """重力の向きで裏返りを判定する（BNO055が無ければ前回の値のまま）"""
+        if self.bno:
+            gravity = ijochi.abnormal_check("grav", self.bno.gravity, ERROR_FLAG=False)
+            self.is_inverted = (gravity is not None and gravity[2] < -2.0)
+        return self.is_inverted
+
+    def read_fix(self, max_retries=10, retry_delay=1):
+        """GPSで現在地 (lat, lon) を取る（取れなければ None）。取れたら最後の測位として覚えておく"""
+        gps_data = ijochi.abnormal_check(["lat", "lon"], gps.idokeido, ERROR_FLAG=False,
+                                         max_retries=max_retries, retry_delay=retry_delay)
+        if gps_data is not None:
+            self.last_fix = tuple(gps_data)
+        return gps_data
+
+    def goal_distance(self, max_retries=10):
+        """GPSで現在地を取り、ゴールまでの距離[m]を返す（取れなければ None）"""
+        gps_data = self.read_fix(max_retries=max_retries)
+        if gps_data is None:
+            return None
+        curr_lat, curr_lon = gps_data
+        # 距離だけ使うので方位計算用の過去座標は現在地をダミーで入れる
+        d, _ = gps.calculate_distance_and_angle(curr_lat, curr_lon, curr_lat, curr_lon, self.goal_lat, self.goal_lon)
+        print(f"📍 ゴールまでの距離: {d:.2f}m")
+        make_csv.print("msg", f"ゴールまでの距離: {d:.2f}m")
+        return d
+
+    def update_altitude(self):
+        """気圧と上下方向の加速度を1回読んで高度フィルタに入れる（フェーズ1・2の定期タスク）"""
+        if not self.bme:
+            return
+        # 20 Hz で読むので ijochi は通さない（リトライ待ちを避ける）。範囲だけ同じ表で確かめる
+        # フィルタに入れた値（気圧・上向きの加速度）は毎回CSVに残す（fm_replay で同じ推定を再現できるように）
+        try:
+            p = self.bme.pressure()
+        except Exception:
+            p = None
+        limit = ijochi.abnormal_value_table["press"]
+        if p is None or not (limit["min"] <= p <= limit["max"]):
+            return
+        accel = None
+        if self.bno:
+            try:
+                accel = altitude_filter.vertical_accel(self.bno.linear_acceleration(), self.bno.gravity())
+            except Exception:
+                accel = None
+        self.alt_filter.update(time.monotonic(), self.bme.altitude(p, qnh=self.qnh), accel)
+        make_csv.print("press", p)
+        if accel is not None:
+            make_csv.print("accel_up", accel)
+
+    def log_altitude(self):
+        """高度フィルタの推定値を記録する（入力の気圧・加速度は update_altitude() が毎回記録している）"""
+        f = self.alt_filter
+        if not f.ready:
+            return
+        make_csv.print("alt", f.altitude)
+        make_csv.print("climb_rate", f.climb_rate)
+        make_csv.print("alt_conf", f.confidence)
+
+    def log_temp(self):
+        """機体の熱暴走監視のため温度を記録する"""
+        if self.bme:
+            ijochi.abnormal_check("temp", self.bme.temperature, ERROR_FLAG=False)
+
+    # ----------------------------
+    # チェックポイント
+    # ----------------------------
+    def save_checkpoint(self, phase=None):
+        """今の状態を保存する（フェーズに入るたびと、フェーズ中は CHECKPOINT_PERIOD ごと）"""
+        if phase is not None:
+            self.phase = phase
+        if self.phase is None:
+            return
+        checkpoint.save(CHECKPOINT_PATH, {
+            "phase": self.phase,
+            "qnh": self.qnh if self.bme else None,
+            "goal": [self.goal_lat, self.goal_lon],
+            "is_inverted": self.is_inverted,
+            "heading_vector": list(self.heading_vector) if self.heading_vector else None,
+            "last_fix": list(self.last_fix) if self.last_fix else None,
+            "nichrome_fired": self.nichrome_fired,
+            "goal_reason": self.goal_reason,
+        })
+
+    def restore(self, state):
+        """保存した状態から再開する"""
+        self.resumed = True
+        self.start_phase = state["phase"]
+        self.is_inverted = bool(state.get("is_inverted"))
+        self.nichrome_fired = bool(state.get("nichrome_fired"))
+        self.goal_reason = state.get("goal_reason")
+        # Pi ごと再起動していたら、止まっていた間に動いたかもしれないので位置に関わる値は使わない
+        if state.get("same_boot", True):
+            if state.get("last_fix"):
+                self.last_fix = tuple(state["last_fix"])
+            if state.get("heading_vector"):
+                self.heading_vector = tuple(state["heading_vector"])
+        msg = (f"チェックポイントから再開: phase={self.start_phase}, qnh={state.get('qnh')}, "
+               f"nichrome_fired={self.nichrome_fired}, last_fix={self.last_fix} ({state['age']:.0f}s前に保存, "
+               f"same_boot={state.get('same_boot')})")
+        print(msg)
+        make_csv.print("msg", msg)
+
+    def preload_model_if_near(self, d):
+        """ゴールが近づいたらYOLOをバックグラウンドで読み込み＆ウォームアップしておく"""
+        if d > MODEL_PRELOAD_DISTANCE:
+            return
+        try:
+            started = spawn_vision_process() if MULTIPROCESS else camera.preload_model(MODEL_PATH) is not None
+            if started:
+                print(f"🧠 ゴールまで{d:.1f}m。YOLOモデルの事前読み込みを開始します。")
+                make_csv.print("msg", f"ゴールまで{d:.1f}m。YOLOモデルの事前読み込みを開始します。")
+        except Exception as e:
+            print(f"Model Preload Error: {e}")
+            make_csv.print("error", f"Model Preload Error: {e}")
+
+
+class WaitPhase(Phase):
+    """フェーズ1: 打ち上げ待機（推定高度が10m以上の状態が1秒続いたら落下フェーズへ）"""
+    number = 1
+    name = "wait"
+    period = 0.2
+
+    LAUNCH_ALT = 10.0     # 推定高度 - 2σ がこの高度[m]以上の状態が
+    LAUNCH_HOLD = 1.0     # この時間[s]続いたら打ち上げとみなす
+    CONF_MIN = 0.8        # 高度フィルタの confidence がこれ未満なら判定しない
+
+    def enter(self):
+        self.launch_since = None
+
+    def tick(self):
+        ctx = self.ctx
+        if not ctx.bme:
+            return 2
+
+        f = ctx.alt_filter
+        if not f.ready:
+            return None
+        if not self.timer_running("log"):
+            self.start_timer("log", ALT_LOG_PERIOD)
+            ctx.log_altitude()
+            msg = f"[待機] alt={f.altitude:.3f} m, vz={f.climb_rate:+.2f} m/s, conf={f.confidence:.2f}"
+            print(msg)
+            make_csv.print("msg", msg)
+
+        if f.confidence >= self.CONF_MIN and f.altitude - 2.0 * f.alt_sigma >= self.LAUNCH_ALT:
+            if self.launch_since is None:
+                self.launch_since = self.now()
+            if self.now() - self.launch_since >= self.LAUNCH_HOLD:
+                msg = (f"{self.LAUNCH_HOLD:g}秒続けて{self.LAUNCH_ALT:g}m以上を検知しました "
+                       f"(alt={f.altitude:.2f} m, vz={f.climb_rate:+.2f} m/s)。Go to falling phase")
+                print(msg)
+                make_csv.print("msg", msg)
+                return 2
+        else:
+            self.launch_since = None
+        return None
+
+    def on_error(self, e):
+        print(f"Error in wait phase: {e}")
+        make_csv.print("error", f"Error in wait phase: {e}")
+        self.mission.sleep(1)
+
+
+class FallPhase(Phase):
+    """フェーズ2: 落下・着地判定（推定高度が低く、上昇率がほぼ0の状態が続いたら着地） → ニクロム線でパラシュート分離"""
+    number = 2
+    name = "fall"
+    period = 0.2
+
+    LAND_ALT = 7.0        # 推定高度がこれ[m]以下で
+    LAND_VZ = 0.5         # 上昇率の大きさがこれ[m/s]以下の状態が
+    LAND_HOLD = 2.0       # この時間[s]続いたら着地とみなす
+    CONF_MIN = 0.8        # 高度フィルタの confidence がこれ未満なら判定しない
+    NICHROME_SEC = 15.0
+
+    def enter(self):
+        self.land_since = None
+        self.started = False
+        if self.ctx.nichrome_fired and self.ctx.gpio_ok:
+            # 通電中に再起動した: 着地は判定済みなので、そのまま通電をやり直す（切れた線には電流は流れない）
+            print("再開: 着地判定済みのためニクロム線の通電をやり直します")
+            make_csv.print("msg", "再開: 着地判定済みのためニクロム線の通電をやり直します")
+            self._nichrome_on()
+
+    def tick(self):
+        ctx = self.ctx
+        # ニクロム線作動中（止めずに時間で切る）
+        # 再開時は BME280 が無くても通電しているので、センサーの確認より先に見る
+        if self.timer_running("nichrome"):
+            return None
+        if self.timer_expired("nichrome"):
+            self._nichrome_off()
+            print("finish nichrome wire")
+            make_csv.print("msg", "finish nichrome wire")
+            return 3
+
+        if not ctx.bme:
+            print("BME280が使えないため落下フェーズをスキップします")
+            make_csv.print("error", "BME280が使えないため落下フェーズをスキップします")
+            return 3
+        if not ctx.gpio_ok:
+            print("GPIOが使えないためニクロム線を安全に駆動できません")
+            make_csv.print("error", "GPIOが使えないためニクロム線を安全に駆動できません")
+            return 3
+
+        f = ctx.alt_filter
+        if not f.ready:
+            return None
+        if not self.started:
+            self.started = True
+            print(f"fall start alt={f.altitude:.3f} m")
+            make_csv.print("msg", f"fall start alt={f.altitude:.3f} m")
+
+        if not self.timer_running("log"):
+            self.start_timer("log", ALT_LOG_PERIOD)
+            ctx.log_altitude()
+            held = 0.0 if self.land_since is None else self.now() - self.land_since
+            print(f"alt={f.altitude:.3f} m, vz={f.climb_rate:+.2f} m/s, conf={f.confidence:.2f} "
+                  f"({held:.1f}/{self.LAND_HOLD:g}s)")
+            make_csv.print("msg", f"vz:{f.climb_rate:.3f}, conf:{f.confidence:.2f}, hold:{held:.1f}")
+            if ctx.bno:
+                euler = ijochi.abnormal_check("euler", ctx.bno.euler, ERROR_FLAG=False)
+                if euler is not None:
+                    make_csv.print("euler", euler)
+
+        if (f.confidence >= self.CONF_MIN and f.altitude <= self.LAND_ALT
+                and abs(f.climb_rate) <= self.LAND_VZ):
+            if self.land_since is None:
+                self.land_since = self.now()
+        else:
+            self.land_since = None
+
+        if self.land_since is not None and self.now() - self.land_since >= self.LAND_HOLD:
+            print("Landing detected")
+            make_csv.print("msg", f"Landing detected (alt={f.altitude:.2f} m, vz={f.climb_rate:+.2f} m/s)")
+            # ニクロム線作動（パラシュート分離）
+            self._nichrome_on()
+        return None
+
+    def _nichrome_on(self):
+        ctx = self.ctx
+        print("start nichrome wire")
+        make_csv.print("msg", "start nichrome wire")
+        ctx.nichrome_fired = True
+        ctx.save_checkpoint()
+        GPIO.output(NICHROME_PIN, 1)
+        ctx.nichrome_on = True
+        self.start_timer("nichrome", self.NICHROME_SEC)
+
+    def _nichrome_off(self):
+        GPIO.output(NICHROME_PIN, 0)
+        self.ctx.nichrome_on = False
+
+    def exit(self):
+        # どんな抜け方でもニクロム線は必ず切る
+        if self.ctx.nichrome_on:
+            self._nichrome_off()
+
+    def on_error(self, e):
+        print(f"Error in falling phase: {e}")
+        make_csv.print("error", f"Error in falling phase: {e}")
+        self.mission.sleep(1)
+
+
+class GpsPhase(Phase):
+    """
+    フェーズ3: 遠距離フェーズ（GPS誘導）
+    Yawが読めれば連続誘導（PurePursuit）、読めなければ従来の Stop & Go
+    """
+    number = 3
+    name = "gps"
+    period = 0.2
+
+    FIRST_FIX_TIMEOUT = 50.0   # 最初の測位を待つ時間 [s]
+    LEG_DURATION = 15.0        # Stop & Go の1区間の前進時間 [s]
+
+    def enter(self):
+        print("\n--- フェーズ3: 遠距離フェーズ（GPS誘導） ---")
+        make_csv.print("msg", "--- フェーズ3: 遠距離フェーズ（GPS誘導） ---")
+
+        # --- 【準備】機体の上下判定 ---
+        self.ctx.is_inverted = False
+        if self.ctx.update_inverted():
+            print("🔄 機体が逆さまです！反転モードで走行します。")
+            make_csv.print("msg", "機体が逆さまです！反転モードで走行します。")
+
+        self.step = "first_fix"
+        self.prev_lat = self.prev_lon = None
+        self.gps_fail_count = 0
+        self.ctrl = None
+        self.future = None
+
+    def tick(self):
+        if self.step == "first_fix":
+            return self._first_fix()
+        if self.step == "pursuit":
+            return self._pursuit_tick()
+        if self.step == "initial":
+            self._initial_forward()
+            self.step = "leg"
+            return None
+        return self._leg_tick()
+
+    def exit(self):
+        if self.ctrl is not None:
+            try:
+                self.ctrl.stop().result(timeout=5.0)
+            except Exception:
+                pass
+            self.ctrl = None
+
+    # ----------------------------
+    # ① 最初のGPS取得（走り出す前。取れるまで tick ごとに読み直す）
+    # ----------------------------
+    def _first_fix(self):
+        ctx = self.ctx
+        gps_data = ctx.read_fix(max_retries=0)
+        if gps_data is None:
+            if self.elapsed < self.FIRST_FIX_TIMEOUT:
+                return None
+            print("❌ 最初のGPS取得に失敗しました。近距離フェーズ(4)へ移行します。")
+            make_csv.print("error", "最初のGPS取得に失敗しました。近距離フェーズ(4)へ移行します。")
+            make_csv.print("msg", "サブキャリア脱出のために前進します")
+            print("サブキャリア脱出のために前進")
+            if ctx.motor_ok:
+                md.move('w', power=0.7, duration=10.0, is_inverted=ctx.is_inverted, enable_stack_check=False)
+            return 4
+
+        self.prev_lat, self.prev_lon = gps_data
+        if GPS_CONTINUOUS and ctx.motor_ok and ctx.bno:
+            self._start_pursuit()
+            self.step = "pursuit"
+        elif self._resume_vector(gps_data):
+            self.step = "leg"
+        else:
+            self.step = "initial"
+        return None
+
+    def _resume_vector(self, fix):
+        """再開時: 止まった位置から動いていなければ、保存した進行方向ベクトルを使って初期前進を省く"""
+        vec = self.ctx.heading_vector
+        if not (self.ctx.resumed and vec):
+            return False
+        if guidance.distance_m(vec[2], vec[3], fix[0], fix[1]) > RESUME_FIX_TOLERANCE:
+            return False
+        self.prev_lat, self.prev_lon = vec[0], vec[1]
+        print("🔁 保存した進行方向ベクトルで再開します（初期前進を省略）")
+        make_csv.print("msg", "保存した進行方向ベクトルで再開します（初期前進を省略）")
+        return True
+
+    # ----------------------------
+    # 連続誘導（測位の合間はYawで方位を保つ）
+    # ----------------------------
+    def _start_pursuit(self):
+        ctx = self.ctx
+        self.ctrl = md.get_controller()
+        self.pursuit = guidance.PurePursuit(md.ground_yaw, ctx.goal_lat, ctx.goal_lon, handover=HANDOVER_DISTANCE)
+        self.pursuit.is_inverted = ctx.is_inverted
+        self.last_fix = self.now()
+        self.last_log = 0.0
+        self.track = deque()   # (時刻, 緯度, 経度): GPSで見た進み具合の確認用
+        self.drive_fails = 0   # 走行指令がすぐ終わった（モーターが動いていない）回数
+
+        print("🚀 GPS連続誘導を開始します。")
+        make_csv.print("msg", "GPS連続誘導を開始します。")
+        self._steer()
+
+    def _steer(self):
+        self.steer_at = self.now()
+        self.future = self.ctrl.steer(self.pursuit.power(), 0.0, is_inverted=self.pursuit.is_inverted,
+                                      guide=self.pursuit)
+
+    def _recover(self, reason):
+        print(f"💥 {reason}。自動リカバリー行動を開始します。")
+        make_csv.print("warning", f"{reason}。自動リカバリー行動を開始します。")
+        self.ctrl.stop().result(timeout=5.0)
+        md.check_stuck(1, is_inverted=self.pursuit.is_inverted)
+        self.pursuit.reset_heading()   # 脱出で向きが変わっているので方位を取り直す
+        self.track.clear()
+        self._steer()
+
+    def _pursuit_tick(self):
+        ctx = self.ctx
+
+        # 姿勢更新（ひっくり返ったら走り方と方位の基準が変わる）
+        inv = ctx.update_inverted()
+        if inv != self.pursuit.is_inverted:
+            self.pursuit.is_inverted = inv
+            self.pursuit.reset_heading()
+            self._steer()
+
+        # IMUのスタック検知。すぐ終わった指令はモーターが動いていない（未初期化など）
+        if self.future.done():
+            if self.future.result():
+                self.drive_fails = 0
+                self._recover("スタック検知(ジャイロ)")
+            elif self.now() - self.steer_at < GPS_PURSUIT_MIN_RUN or not md.motors_ready():
+                self.drive_fails += 1
+                if self.drive_fails >= GPS_PURSUIT_MAX_FAILS:
+                    return self._abort_pursuit()
+                self._steer()
+            else:
+                self.drive_fails = 0
+                self._steer()
+
+        # 測位（走行は別スレッドで続いているので、リトライで待たずに次の tick で読み直す）
+        gps_data = ctx.read_fix(max_retries=0)
+        now = self.now()
+        if gps_data is None:
+            if now - self.last_fix > GPS_PURSUIT_TIMEOUT:
+                print("❌ GPSタイムアウト。近距離フェーズへ強制移行します。")
+                make_csv.print("error", "GPSタイムアウト。近距離フェーズへ強制移行します。")
+                return 4
+            return None
+        self.last_fix = now
+        lat, lon = gps_data
+
+        d, angle = self.pursuit.add_fix(lat, lon)
+        if now - self.last_log >= GPS_PURSUIT_LOG_PERIOD:
+            self.last_log = now
+            ang_str = f"{angle:.1f}度" if angle is not None else "計算中"
+            print(f"📍 GPS: ゴールまで残り {d:.2f}m / 角度のズレ {ang_str} / パワー {self.pursuit.power():.2f}")
+            make_csv.print("msg", f"GPS: ゴールまで残り {d:.2f}m / 角度のズレ {ang_str}")
+
+        ctx.preload_model_if_near(d)
+
+        if d <= HANDOVER_DISTANCE:
+            msg = f"ゴール{HANDOVER_DISTANCE:.0f}m圏内に到達！（フェーズ3 {self.elapsed:.0f}秒）近距離フェーズへ移行します。"
+            print(f"🎯 {msg}")
+            make_csv.print("msg", msg)
+            return 4
+
+        # GPSで見て進んでいなければスタック（IMUで検知できない空転など）
+        self.track.append((now, lat, lon))
+        while len(self.track) > 1 and now - self.track[1][0] >= GPS_STALL_TIME:
+            self.track.popleft()
+        t0, lat0, lon0 = self.track[0]
+        if now - t0 >= GPS_STALL_TIME:
+            moved = guidance.distance_m(lat0, lon0, lat, lon)
+            if moved < GPS_STALL_DISTANCE:
+                self._recover(f"{GPS_STALL_TIME:.0f}秒で{moved:.1f}mしか進んでいません")
+        return None
+
+    def _abort_pursuit(self):
+        """連続誘導の走行指令が通らない: モーターが無ければ近距離フェーズへ、あれば Stop & Go に切り替える"""
+        try:
+            self.ctrl.stop().result(timeout=5.0)
+        except Exception:
+            pass
+        self.ctrl = None
+        if not md.motors_ready():
+            print("❌ モーターが使えないため連続誘導を中止し、近距離フェーズへ移行します。")
+            make_csv.print("error", "モーターが使えないため連続誘導を中止し、近距離フェーズへ移行します。")
+            return 4
+        print("❌ 走行指令がすぐ終わるため連続誘導を中止し、Stop & Go に切り替えます。")
+        make_csv.print("error", "走行指令がすぐ終わるため連続誘導を中止し、Stop & Go に切り替えます。")
+        self.step = "initial"
+        return None
+
+    # ----------------------------
+    # Stop & Go（1 tick = 1区間。走行中は tick が止まる）
+    # ----------------------------
+    def _forward_and_settle(self):
+        """方位を整えるための前進(LEG_DURATION)→停止してGPSの安定を待つ"""
+        if self.ctx.motor_ok:
+            md.move('w', power=0.7, duration=self.LEG_DURATION, is_inverted=self.ctx.is_inverted,
+                    enable_stack_check=False, heading_hold=True)
+            print("⏹️ 停止してGPSの安定を待ちます...")
+            make_csv.print("msg", "停止してGPSの安定を待ちます...")
+            self.mission.sleep(1.0)
+
+    def _initial_forward(self):
+        # --- ② 方位把握のための初期前進 (ベクトル構築) ---
+        print(f"🚀 方位計算のため、初期前進 ({self.LEG_DURATION:.1f}s) を行います。")
+        make_csv.print("msg", f"方位計算のため、初期前進 ({self.LEG_DURATION:.1f}s) を行います。")
+        self._forward_and_settle()
+
+    def _reset_vector(self):
+        """リカバリー後: 現在地を基準に取り直して初期前進をやり直す"""
+        print("🔄 リカバリー完了。ベクトルを整えるため現在地をリセットし、初期前進をやり直します。")
+        make_csv.print("msg", "リカバリー完了。ベクトルを整えるため現在地をリセットし、初期前進をやり直します。")
+        recov_data = self.ctx.read_fix()
+        if recov_data is not None:
+            self.prev_lat, self.prev_lon = recov_data
+        self._forward_and_settle()
+
+    def _leg_tick(self):
+        ctx = self.ctx
+        is_inverted = ctx.update_inverted()
+
+        # --- ④ GPS取得とフェイルセーフ処理 ---
+        gps_data = ctx.read_fix()
+        if gps_data is None:
+            self.gps_fail_count += 1
+            print(f"⚠️ GPS取得失敗 ({self.gps_fail_count}/6)")
+            make_csv.print("warning", f"GPS取得失敗 ({self.gps_fail_count}/6)")
+
+            if self.gps_fail_count >= 6:
+                print("❌ GPSタイムアウト。近距離フェーズへ強制移行します。")
+                make_csv.print("error", "GPSタイムアウト。近距離フェーズへ強制移行します。")
+                return 4
+            elif self.gps_fail_count == 3:
+                print("🔄 環境を変えるため少し前進します。")
+                make_csv.print("msg", "環境を変えるため少し前進します。")
+                if ctx.motor_ok:
+                    md.move('w', power=0.7, duration=2.0, is_inverted=is_inverted, enable_stack_check=False)
+            self.mission.sleep(1)
+            return None
+
+        self.gps_fail_count = 0
+        curr_lat, curr_lon = gps_data
+
+        # --- ⑤ ゴールとの距離と方位ズレ計算 ---
+        d, ang_rad = gps.calculate_distance_and_angle(
+            curr_lat, curr_lon, self.prev_lat, self.prev_lon, ctx.goal_lat, ctx.goal_lon
+        )
+
+        # ★ここを変更: 異常値(実質的なスタック)の処理
+        if d > 1000000:
+            print("⚠️ GPS方位計算エラー (移動距離不足)。スタックと判断してリカバリー行動を開始します。")
+            make_csv.print("warning", "GPS方位計算エラー (移動距離不足)。スタックと判断してリカバリー行動を開始します。")
+            if ctx.motor_ok:
+                # 強制的に is_stacked=1 としてスタック脱出動作を呼び出す
+                md.check_stuck(1, is_inverted=is_inverted)
+            self._reset_vector()
+            return None
+
+        ctx.heading_vector = (self.prev_lat, self.prev_lon, curr_lat, curr_lon)
+        deg_diff = math.degrees(ang_rad)
+        print(f"📍 GPS: ゴールまで残り {d:.2f}m / 角度のズレ {deg_diff:.1f}度")
+        make_csv.print("msg", f"GPS: ゴールまで残り {d:.2f}m / 角度のズレ {deg_diff:.1f}度")
+
+        ctx.preload_model_if_near(d)
+
+        # --- ⑥ ゴール判定 ---
+        if d <= HANDOVER_DISTANCE:
+            print("🎯 ゴール10m圏内に到達！近距離フェーズへ移行します。")
+            make_csv.print("msg", "ゴール10m圏内に到達！近距離フェーズへ移行します。")
+            return 4
+
+        # --- ⑦ BNO055フィードバック旋回 ---
+        if abs(deg_diff) > 15.0:
+            print(f"↪️ 目標角度へ向けて旋回します (ズレ: {deg_diff:.1f}度)")
+            make_csv.print("msg", f"目標角度へ向けて旋回します (ズレ: {deg_diff:.1f}度)")
+            turn_by_angle(ctx.bno, md, deg_diff, is_inverted, ctx.motor_ok)
+
+        # --- ⑧ Stop & Go方式による前進 ---
+        print(f"⬆️ Stop & Go: {self.LEG_DURATION:g}秒前進します")
+        make_csv.print("msg", f"Stop & Go: {self.LEG_DURATION:g}秒前進します")
+        is_stacked = False
+        if ctx.motor_ok:
+            is_stacked = md.move('w', power=0.7, duration=self.LEG_DURATION, is_inverted=is_inverted, enable_stack_check=True, heading_hold=True)
+            print("⏹️ 停止して待機中...")
+            make_csv.print("msg", "停止して待機中...")
+            self.mission.sleep(1.0)
+
+        # --- ⑨ ジャイロセンサによるスタック検知とリカバリー ---
+        if is_stacked:
+            print("💥 スタック検知(ジャイロ)！自動リカバリー行動を開始します。")
+            make_csv.print("warning", "スタック検知(ジャイロ)！自動リカバリー行動を開始します。")
+            md.check_stuck(is_stacked, is_inverted=is_inverted)
+            self._reset_vector()
+            return None
+
+        # --- ⑩ 次のループの計算のために保存 ---
+        self.prev_lat, self.prev_lon = curr_lat, curr_lon
+        return None
+
+
+class CameraPhase(Phase):
+    """フェーズ4: 近距離フェーズ（カメラ誘導）。1 tick = カメラ1フレーム"""
+    number = 4
+    name = "camera"
+    period = 0.1
+
+    MAX_CAMERA_RETRIES = 5
+
+    def enter(self):
+        print("\n--- フェーズ4: 近距離フェーズ（カメラ誘導） ---")
+        make_csv.print("msg", "--- フェーズ4: 近距離フェーズ（カメラ誘導） ---")
+        self.ctx.is_inverted = False
+        self.lost_count = 0 #ターゲットを見失った連続回数をカウントする変数
+        self.servo = None
+        self.ready = False
+
+    def exit(self):
+        if self.servo is not None:
+            self.servo.stop()
+
+    def tick(self):
+        ctx = self.ctx
+        if not self.ready:
+            if not ctx.cam:
+                ctx.cam = self._setup_camera()
+            if not ctx.cam:
+                return self._camera_failed()
+
+            # ★ 画像ログ用スレッドを起動（imwriteでループを止めない）
+            if ctx.img_logger is None:
+                ctx.img_logger = image_logger.ImageLogger(
+                    SESSION_SAVE_DIR,
+                    interval=IMAGE_SAVE_INTERVAL,
+                    quality=IMAGE_JPEG_QUALITY,
+                    scale=IMAGE_SAVE_SCALE,
+                    pre_frames=IMAGE_PRE_FRAMES,
+                    post_frames=IMAGE_POST_FRAMES,
+                )
+                ctx.img_logger.start()
+            self.servo = VisualServo() if (VISUAL_SERVO and ctx.motor_ok) else None
+            self.ready = True
+
+        try:
+            return self._frame()
+        except Exception as e:
+            return self._frame_error(e)
+
+    # ----------------------------
+    # カメラの準備と故障時の判断
+    # ----------------------------
+    def _setup_camera(self):
+        print("カメラのセットアップ開始")
+        make_csv.print("msg", "カメラのセットアップ開始")
+
+        # ★統合版：カメラセットアップのリトライ処理
+        for attempt in range(self.MAX_CAMERA_RETRIES):
+            cam = setup_camera()
+            if cam:
+                print(f"✅ カメラのセットアップ完了 (試行回数: {attempt + 1})")
+                make_csv.print("msg", f"カメラのセットアップ完了 (試行回数: {attempt + 1})")
+                return cam
+            print(f"⚠️ カメラセットアップ失敗。再試行します... ({attempt + 1}/{self.MAX_CAMERA_RETRIES})")
+            make_csv.print("warning", f"カメラセットアップ失敗。再試行します... ({attempt + 1}/{self.MAX_CAMERA_RETRIES})")
+            self.mission.sleep(2.0)  # OSにデバイス認識の猶予を与える
+        return None
+
+    def _camera_failed(self):
+        """カメラが完全に死んだ場合、現在のGPS状況を確認して運命を決める"""
+        ctx = self.ctx
+        print("❌ 規定回数試行しましたが、カメラが認識されません。現在のGPS状況を確認します。")
+        make_csv.print("error", "規定回数試行しましたが、カメラが認識されません。現在のGPS状況を確認します。")
+
+        d = ctx.goal_distance()
+        if d is not None:
+            if d <= HANDOVER_DISTANCE:
+                print("🌟 カメラは故障していますが、GPSで10m圏内であることが確認できました。ゴールと判定します！")
+                make_csv.print("msg", "カメラは故障していますが、GPSで10m圏内であることが確認できました。ゴールと判定します！")
+                ctx.goal_reason = "gps"
+                return 5
+            print("⚠️ 10m圏外のため、GPS誘導（フェーズ3）に戻ります。")
+            make_csv.print("warning", "10m圏外のため、GPS誘導（フェーズ3）に戻ります。")
+            return 3
+
+        # GPSも取れない場合（GPSロストでフェーズ4に来た場合など）
+        print("❌ GPSも取得できません。環境を変えるためブラインド前進を行い、フェーズ3へ戻ります。")
+        make_csv.print("error", "GPSも取得できません。環境を変えるためブラインド前進を行い、フェーズ3へ戻ります。")
+        if ctx.motor_ok:
+            md.move('w', power=0.7, duration=5.0, is_inverted=ctx.update_inverted(), enable_stack_check=True)
+        return 3
+
+    # ----------------------------
+    # 1フレーム分の誘導
+    # ----------------------------
+    def _capture_post_frames(self, is_inverted):
+        """イベント後に保存する post_frames 枚を、このフェーズのうちに撮って画像ログに渡す"""
+        cam = self.ctx.cam
+        img_logger = self.ctx.img_logger
+        while img_logger.post_remaining > 0:
+            frame, _, _, _ = cam.capture_and_detect(is_inverted=is_inverted)
+            img_logger.log(frame, raw=cam.last_raw)
+
+    def _frame(self):
+        ctx = self.ctx
+        cam = ctx.cam
+        img_logger = ctx.img_logger
+        servo = self.servo
+        is_inverted = ctx.update_inverted()
+
+        #カメラで画像取得＆推論
+        frame, x_pct, order, area = cam.capture_and_detect(is_inverted=is_inverted)
+        is_stacked = 0
+
+        # ★追加：取得した画像をログとして保存する（別スレッドで書き込み）
+        img_logger.log(frame, raw=cam.last_raw)
+
+        # 連続操舵（見失いが続いたら下の探索処理に任せる）
+        servo_on = servo is not None and servo.update(order, x_pct, area, frame.shape, is_inverted)
+        self.period = 0.0 if servo_on else CameraPhase.period  # 連続操舵中は次のフレームをすぐ撮る
+
+        #YOLOの指令に基づく行動
+        if order == 4:
+            print(f"ターゲットに超接近（面積: {area}）。ゴールと判定します！")
+            make_csv.print("msg", f"ターゲットに超接近（面積: {area}）。ゴールと判定します！")
+            img_logger.trigger("goal")
+            if servo is not None:
+                servo.stop()
+                servo.report()
+            if ctx.motor_ok:
+                md.stop()
+            # フェーズ5ではカメラを回さないので、ゴール後の画像はここで撮り切る
+            self._capture_post_frames(is_inverted)
+            ctx.goal_reason = "camera"
+            return 5
+
+        elif servo_on:
+            is_stacked = servo.take_stacked()
+
+        elif order == 0:
+            print("ターゲットを見失いました。探索のため右回転します。")
+            make_csv.print("msg", "ターゲットを見失いました。探索のため右回転します。")
+            if self.lost_count == 0:
+                img_logger.trigger("lost")
+            self.lost_count += 1
+            if ctx.motor_ok:
+                md.move('e', power=0.7, duration=3, is_inverted=is_inverted, enable_stack_check=False)
+                md.move("w", power=0.7, duration=2.5, is_inverted=is_inverted, enable_stack_check=False)
+
+            #10回連続（約5秒間）見失ったら、GPSで現在地を確認する
+            if self.lost_count >= 10:
+                print("長時間ターゲットが見つかりません。現在地をGPSで確認します...")
+                make_csv.print("warning", "長時間ターゲットが見つかりません。現在地をGPSで確認します...")
+                if ctx.motor_ok:
+                    md.stop()
+
+                d = ctx.goal_distance()
+                if d is None:
+                    print("GPS取得失敗。安全のため探索を継続します。")
+                    make_csv.print("error", "GPS取得失敗。安全のため探索を継続します。")
+                    self.lost_count = 0 # 取得できなかった場合はとりあえず探索継続
+                elif d <= HANDOVER_DISTANCE:
+                    print("10m圏内を維持しています。カウントをリセットし、探索を継続します。")
+                    make_csv.print("msg", "10m圏内を維持しています。カウントをリセットし、探索を継続します。")
+                    self.lost_count = 0 # まだ近くにいるので、もう一度探してみる
+                else:
+                    print("10m圏外に出てしまいました。遠距離フェーズ(3)に戻ります。")
+                    make_csv.print("warning", "10m圏外に出てしまいました。遠距離フェーズ(3)に戻ります。")
+                    return 3
+
+        elif order == 1:
+            print("ターゲットは正面です。直進します。")
+            make_csv.print("msg", "ターゲットは正面です。直進します。")
+            if ctx.motor_ok:
+                is_stacked = md.move('w', power=0.7, duration=2.0, is_inverted=is_inverted, enable_stack_check=True)
+
+        elif order == 2:
+            print("ターゲットが右です。右に旋回してから前進します。")
+            make_csv.print("msg", "ターゲットが右です。右に旋回してから前進します。")
+            if ctx.motor_ok:
+                md.move('e', power=0.7, duration=3, is_inverted=is_inverted, enable_stack_check=False)
+                is_stacked = md.move('w', power=0.7, duration=2.5, is_inverted=is_inverted, enable_stack_check=True)
+
+        elif order == 3:
+            print("ターゲットが左です。左に旋回してから前進します。")
+            make_csv.print("msg", "ターゲットが左です。左に旋回してから前進します。")
+            if ctx.motor_ok:
+                md.move('q', power=0.7, duration=3, is_inverted=is_inverted, enable_stack_check=False)
+                is_stacked = md.move('w', power=0.7, duration=2.5, is_inverted=is_inverted, enable_stack_check=True)
+
+        # ④ スタック判定とリカバリー（motordriveにお任せ）
+        if ctx.motor_ok and is_stacked:
+            print("スタックを検知しました。リカバリー行動を開始します。")
+            make_csv.print("warning", "スタックを検知しました。リカバリー行動を開始します。")
+            img_logger.trigger("stack")
+            md.check_stuck(is_stacked, is_inverted=is_inverted)
+        return None
+
+    def _frame_error(self, e):
+        """カメラ等のエラー時: 一旦止めて、GPSで10m圏内かを確認する"""
+        ctx = self.ctx
+        print(f"カメラ等でエラー発生: {e}")
+        make_csv.print("error", f"カメラ等でエラー発生: {e}")
+        if self.servo is not None:
+            self.servo.stop()
+        if ctx.motor_ok:
+            md.stop() # 暴走防止のため一旦停止
+        self.period = CameraPhase.period
+
+        print("GPSで現在地を確認し、10m圏内かチェックします。")
+        d = ctx.goal_distance()
+        if d is None:
+            print("GPSの取得にも失敗しました。安全のため近距離フェーズを維持してリトライします。")
+            make_csv.print("error", "GPSの取得にも失敗しました。安全のため近距離フェーズを維持してリトライします。")
+            return None
+        if d <= HANDOVER_DISTANCE:
+            print("10m圏内を維持しています。近距離フェーズを継続します。")
+            make_csv.print("msg", "10m圏内を維持しています。近距離フェーズを継続します。")
+            return None
+        print("10m圏外に出てしまいました。遠距離フェーズ(3)に戻ります。")
+        make_csv.print("warning", "10m圏外に出てしまいました。遠距離フェーズ(3)に戻ります。")
+        return 3
+
+
+class GoalPhase(Phase):
+    """フェーズ5: ゴール完了（LEDを1秒ごとに点滅させて待機）"""
+    number = 5
+    name = "goal"
+    period = 1.0
+
+    def enter(self):
+        print("--- フェーズ5 (ゴール完了) ---")
+        make_csv.print("msg", f"--- フェーズ5 (ゴール完了) --- [{self.ctx.goal_reason}]")
+        print("LEDを点滅させて待機します。終了するには Ctrl+C を押してください。")
+        make_csv.print("msg", "LEDを点滅させて待機します。終了するには Ctrl+C を押してください。")
+        self.led = 0
+
+    def tick(self):
+        self.led ^= 1
+        GPIO.output(LED_PIN, self.led)
+        return None
+
+    def exit(self):
+        GPIO.output(LED_PIN, 0)
+
+
+def build_mission(ctx, clock=time.monotonic, sleep=time.sleep):
+    """フェーズ・遷移ガード・定期タスクを組み立てる"""
+    mission = Mission(
+        [WaitPhase(ctx), FallPhase(ctx), GpsPhase(ctx), CameraPhase(ctx), GoalPhase(ctx)],
+        initial=ctx.start_phase, clock=clock, sleep=sleep,
+    )
+    # 再起動に備えて、フェーズに入るたびと定期的に状態を保存する
+    mission.on_enter(ctx.save_checkpoint)
+    mission.every(CHECKPOINT_PERIOD, ctx.save_checkpoint, name="checkpoint")
+    # 分離が終わる（ニクロム線が切れる）までは走り出さない
+    mission.guard(3, lambda c: not c.nichrome_on, from_phase=2, reason="nichrome wire still on")
+    # ゴールはカメラかGPSで根拠があるときだけ
+    mission.guard(5, lambda c: c.goal_reason is not None, reason="no goal evidence")
+    # 温度は待機〜GPS誘導中ずっと記録する（機体の熱暴走監視）
+    mission.every(1.0, ctx.log_temp, phases=(1, 2, 3), name="temp")
+    # 打ち上げ・着地の判定に使う高度を、tick より細かい周期で推定し続ける
+    mission.every(ALT_FILTER_PERIOD, ctx.update_altitude, phases=(1, 2), name="altitude")
+    if MULTIPROCESS:
+        mission.every(SENSOR_PROCESS_CHECK_PERIOD, check_sensor_process, name="sensor process")
+    if profiler.enabled():
+        mission.every(PROFILE_LOG_PERIOD, profiler.dump, name="profile")
+    return mission
+
+
 # ==========================================
 # メイン処理
 # ==========================================
+def _report_imports(errors):
+    """先読みが終わったら import の記録を止めて、起動ごとのレポートを書く（先読みスレッドで呼ばれる）"""
+    startup.uninstall()
+    startup.milestone("preload done")
+    for line in startup.report(top=IMPORT_REPORT_TOP):
+        make_csv.print("msg", line)
+    csv_path = getattr(make_csv, "filename", None)
+    if csv_path:
+        name = os.path.basename(csv_path).replace("log_", "importtime_", 1)
+        name = os.path.splitext(name)[0] + ".txt"
+        startup.write_report(os.path.join(os.path.dirname(csv_path), name))
+
+
 def main():
+    profiler.enable(PROFILE)
+    startup.milestone("main")
+    startup.preload(PRELOAD_MODULES, on_done=_report_imports)
+
+    restart = heartbeat.restart_cause()
+    if restart:
+        msg = f"supervisor により再起動されました（{restart[1]}回目）: {restart[0]}"
+        print(msg)
+        make_csv.print("warning", msg)
 
     # --- 設定 ---
     #本番ゴール地点30.3742606, 130.9599502
     GOAL_LAT = 30.3742606
     GOAL_LON = 130.9599502
 
-    bno, bme, qnh, motor_ok, gpio_ok = setup_sensors()
-    cam = None
-    
+    # チェックポイントがあれば続きから再開する（気圧の基準は取り直さない）
+    # supervisor による再起動でも、電源断・ウォッチドッグによる Pi の再起動でも同じ。消すのはゴールか手で止めたときだけ
+    state = checkpoint.load(CHECKPOINT_PATH, max_age=CHECKPOINT_MAX_AGE, goal=(GOAL_LAT, GOAL_LON))
+    heartbeat.beat(expect=SETUP_HEARTBEAT_EXPECT)
+    bno, bme, qnh, motor_ok, gpio_ok = setup_sensors(qnh=state.get("qnh") if state else None)
+    ctx = MissionContext(bno, bme, qnh, motor_ok, gpio_ok, GOAL_LAT, GOAL_LON)
+    if state:
+        ctx.restore(state)
 
     print("\n=== デバイス接続状況 ===")
     make_csv.print("msg", "=== デバイス接続状況 ===")
     msg_bno = f"* BNO055 : {'OK' if bno else 'Skip'}"
-    msg_cam = f"* Camera : {'OK' if cam else 'Skip'}"
+    msg_cam = f"* Camera : {'OK' if ctx.cam else 'Skip'}"
     msg_bme = f"* BME280 : {'OK' if bme else 'Skip'}"
     msg_mot = f"* Motors : {'OK' if motor_ok else 'Skip'}"
     print(msg_bno)
@@ -277,602 +1358,48 @@ def main():
     print(msg_mot)
     make_csv.print("msg", f"{msg_bno}, {msg_cam}, {msg_bme}, {msg_mot}")
     print("========================\n")
-    
+
     # ★追加: ゴール座標を記録しておく
     make_csv.print("goal_lat", GOAL_LAT)
     make_csv.print("goal_lon", GOAL_LON)
 
-    prev_lat, prev_lon = None, None
-
-    first_data_fetched = False
-    last_gps_error_time = 0
-
-    last_image_save_time = 0
-
-    phase = 1
-    make_csv.print("msg","start phase1")
-    make_csv.print("phase","1")
-
-    launch_count = 0
+    mission = build_mission(ctx)
+    make_csv.print("msg", f"start phase{ctx.start_phase}")
+    startup.milestone(f"phase{ctx.start_phase} start")
 
+    finished = False
     try:
-        while True:
-            try:
-                if phase == 1:
-                    try:
-                        if not bme:
-                            phase = 2
-                            make_csv.print("phase","2")
-                            continue
-
-                        # ★追加: 温度もついでにログに残しておく（機体の熱暴走監視）
-                        ijochi.abnormal_check("temp", bme.temperature, ERROR_FLAG=False)
-
-                        # ★ 1. ijochiで気圧だけを安全に取得（異常値チェック＆自動CSV保存）
-                        p = ijochi.abnormal_check("press", bme.pressure, ERROR_FLAG=False)
-                        if p is None:
-                            time.sleep(0.5)
-                            continue
-
-                        # ★ 2. 正常な気圧データをもとに、高度を計算
-                        alt = bme.altitude(p, qnh=qnh)
-                        if alt is None:
-                            time.sleep(0.5)
-                            continue
-                        
-                        # ★ 3. 高度はijochiを通らないため手動でCSV保存
-                        make_csv.print("alt", alt)
-
-                        print(f"[待機] alt={alt:.3f} m")
-                        make_csv.print("msg", f"[待機] alt={alt:.3f} m")
-
-                        if alt >= 10.0:
-                            launch_count += 1
-                            if launch_count >= 5:
-                                print("5回連続で10m以上を検知しました。Go to falling phase")
-                                make_csv.print("msg","5回連続で10m以上を検知しました。Go to falling phase")
-                                make_csv.print("phase","2")
-                                phase = 2
-                            else:
-                                time.sleep(1.0)
-
-                        else:
-                            launch_count = 0
-                            time.sleep(1.0)
-
-                    except Exception as e:
-                        print(f"Error in wait phase: {e}")
-                        make_csv.print("error",f"Error in wait phase: {e}")
-                        time.sleep(1)
-
-                elif phase == 2:
-                    try:
-                        if not bme:
-                            print("BME280が使えないため落下フェーズをスキップします")
-                            make_csv.print("error","BME280が使えないため落下フェーズをスキップします")
-                            phase = 3
-                            continue
-                        if not gpio_ok:
-                            print("GPIOが使えないためニクロム線を安全に駆動できません")
-                            make_csv.print("error","GPIOが使えないためニクロム線を安全に駆動できません")
-                            phase = 3
-                            continue
-
-                        FALL_TIMEOUT_SEC = 180.0
-                        fall_start_time = time.time()
-
-                        consecutive_count = 0
-                        REQUIRED_COUNT = 5  
-                        D_ALT_THRESH = 0.5  
-
-                        # --- 初期気圧・高度の取得 ---
-                        p = ijochi.abnormal_check("press", bme.pressure, ERROR_FLAG=False)
-                        if p is None:
-                            print("初期気圧の取得に失敗しました。再試行します。")
-                            make_csv.print("warning","初期気圧の取得に失敗しました。再試行します。")
-                            time.sleep(0.5)
-                            continue
-
-                        alt_prev = bme.altitude(p, qnh=qnh)
-                        if alt_prev is None:
-                            print("初期高度の計算に失敗しました。再試行します。")
-                            make_csv.print("warning","初期高度の計算に失敗しました。再試行します。")
-                            time.sleep(0.5)
-                            continue
-
-                        make_csv.print("alt", alt_prev)
-                        print(f"fall start alt={alt_prev:.3f} m")
-                        make_csv.print("msg", f"fall start alt={alt_prev:.3f} m")
-
-                        # --- 落下判定ループ ---
-                        while True:
-                            #投下試験用に削除
-                            #if time.time() - fall_start_time >= FALL_TIMEOUT_SEC:
-                            #    print("3分経過 → 強制分離")
-                            #    break
-
-                            time.sleep(1.0)
-
-                            # ★追加: 落下中も温度を記録
-                            if bme:
-                                ijochi.abnormal_check("temp", bme.temperature, ERROR_FLAG=False)
-
-                            # 落下中もijochiで気圧を取得
-                            p = ijochi.abnormal_check("press", bme.pressure, ERROR_FLAG=False)
-                            if p is None:
-                                print("BME280: 気圧の取得失敗(ijochi)。スキップします。")
-                                make_csv.print("warning", "BME280: 気圧の取得失敗(ijochi)。スキップします。")
-                                continue
-
-                            alt_now = bme.altitude(p, qnh=qnh)
-                            if alt_now is None:
-                                print("BME280: 高度の計算失敗。スキップします。")
-                                make_csv.print("warning", "BME280: 高度の計算失敗。スキップします。")
-                                continue
-
-                            make_csv.print("alt", alt_now)
-                            d_alt = abs(alt_now - alt_prev)
-
-                            print(
-                                f"alt={alt_now:.3f} m, "
-                                f"Δalt(1s)={d_alt:.3f} m "
-                                f"({consecutive_count}/{REQUIRED_COUNT})"
-                            )
-                            make_csv.print("msg", f"d_alt:{d_alt:.3f}, count:{consecutive_count}")
-
-                            if bno:
-                                euler = ijochi.abnormal_check("euler", bno.euler, ERROR_FLAG=False)
-                                if euler is not None:
-                                    make_csv.print("euler", euler)
-
-                            if alt_now <= 7.0 and d_alt <= D_ALT_THRESH:
-                                consecutive_count += 1
-                            else:
-                                consecutive_count = 0
-
-                            if consecutive_count >= REQUIRED_COUNT:
-                                print("Landing detected")
-                                make_csv.print("msg","Landing detected")
-                                break
-
-                            alt_prev = alt_now
-
-                        # ニクロム線作動（パラシュート分離）
-                        print("start nichrome wire")
-                        make_csv.print("msg","start nichrome wire")
-                        GPIO.output(NICHROME_PIN, 1)
-                        time.sleep(15)
-                        GPIO.output(NICHROME_PIN, 0)
-                        print("finish nichrome wire")
-                        make_csv.print("msg","finish nichrome wire")
-
-                        phase = 3
-                        make_csv.print("phase","3")
-
-                    except Exception as e:
-                        print(f"Error in falling phase: {e}")
-                        make_csv.print("error", f"Error in falling phase: {e}")
-                        time.sleep(1)
-                elif phase == 3:
-                    
-                    print("\n--- フェーズ3: 遠距離フェーズ（GPS誘導） ---")
-                    make_csv.print("msg", "--- フェーズ3: 遠距離フェーズ（GPS誘導） ---")
-
-                    
-                    # --- 【準備】機体の上下判定 ---
-                    is_inverted = False
-                    if bno:
-                        gravity = ijochi.abnormal_check("grav", bno.gravity, ERROR_FLAG=False)
-                        if gravity is not None and gravity[2] < -2.0:
-                            is_inverted = True
-                            print("🔄 機体が逆さまです！反転モードで走行します。")
-                            make_csv.print("msg", "機体が逆さまです！反転モードで走行します。")
-
-                    # --- ① 最初のGPS取得 ---
-                    gps_data = ijochi.abnormal_check(["lat", "lon"], idokeido, ERROR_FLAG=False, max_retries=50, retry_delay=1)
-                    if gps_data is not None:
-                        curr_lat, curr_lon = gps_data
-                    else:
-                        curr_lat, curr_lon = None, None
-
-                    if curr_lat is None or curr_lon is None:
-                        print("❌ 最初のGPS取得に失敗しました。近距離フェーズ(4)へ移行します。")
-                        make_csv.print("error", "最初のGPS取得に失敗しました。近距離フェーズ(4)へ移行します。")
-                        make_csv.print("msg","サブキャリア脱出のために前進します")
-                        print("サブキャリア脱出のために前進")
-                        if motor_ok:
-                            md.move('w', power=0.7, duration=10.0, is_inverted=is_inverted, enable_stack_check=False)
-                        phase = 4
-                        make_csv.print("phase", "4") # ★追加
-                        continue
-                    
-                    prev_lat, prev_lon = curr_lat, curr_lon
-
-                    # --- ② 方位把握のための初期前進 (ベクトル構築) ---
-                    print("🚀 方位計算のため、初期前進 (15.0s) を行います。")
-                    make_csv.print("msg", "方位計算のため、初期前進 (15.0s) を行います。")
-                    if motor_ok:
-                        md.move('w', power=0.7, duration=15.0, is_inverted=is_inverted, enable_stack_check=False)
-                        print("⏹️ 停止してGPSの安定を待ちます...")
-                        make_csv.print("msg", "停止してGPSの安定を待ちます...")
-                        time.sleep(1.0) 
-
-                    # ==========================================
-                    # ③ ゴールに向かうメインループ
-                    # ==========================================
-                    gps_fail_count = 0
-                    while phase == 3:
-                        # ★追加: 走行中も定期的に温度を記録
-                        if bme:
-                            ijochi.abnormal_check("temp", bme.temperature, ERROR_FLAG=False)
-
-                        # 姿勢更新
-                        if bno:
-                            gravity = ijochi.abnormal_check("grav", bno.gravity, ERROR_FLAG=False)
-                            is_inverted = (gravity is not None and gravity[2] < -2.0)
-
-                        # --- ④ GPS取得とフェイルセーフ処理 ---
-                        gps_data = ijochi.abnormal_check(["lat", "lon"], idokeido, ERROR_FLAG=False, max_retries=10, retry_delay=1)
-                        if gps_data is not None:
-                            curr_lat, curr_lon = gps_data
-                        else:
-                            curr_lat, curr_lon = None, None
-
-                        if curr_lat is None or curr_lon is None:
-                            gps_fail_count += 1
-                            print(f"⚠️ GPS取得失敗 ({gps_fail_count}/6)")
-                            make_csv.print("warning", f"GPS取得失敗 ({gps_fail_count}/6)")
-                            
-                            if gps_fail_count >= 6:
-                                print("❌ GPSタイムアウト。近距離フェーズへ強制移行します。")
-                                make_csv.print("error", "GPSタイムアウト。近距離フェーズへ強制移行します。")
-                                phase = 4
-                                make_csv.print("phase", "4") # ★追加
-                                break
-                            elif gps_fail_count == 3:
-                                print("🔄 環境を変えるため少し前進します。")
-                                make_csv.print("msg", "環境を変えるため少し前進します。")
-                                if motor_ok:
-                                    md.move('w', power=0.7, duration=2.0, is_inverted=is_inverted, enable_stack_check=False)
-                            
-                            time.sleep(1)
-                            continue
-                        
-                        gps_fail_count = 0 
-
-                        # --- ⑤ ゴールとの距離と方位ズレ計算 ---
-                        d, ang_rad = calculate_distance_and_angle(
-                            curr_lat, curr_lon, prev_lat, prev_lon, GOAL_LAT, GOAL_LON
-                        )
-                        
-                        # ★ここを変更: 異常値(実質的なスタック)の処理
-                        if d > 1000000:
-                            print("⚠️ GPS方位計算エラー (移動距離不足)。スタックと判断してリカバリー行動を開始します。")
-                            make_csv.print("warning", "GPS方位計算エラー (移動距離不足)。スタックと判断してリカバリー行動を開始します。")
-                            if motor_ok:
-                                # 強制的に is_stacked=1 としてスタック脱出動作を呼び出す
-                                md.check_stuck(1, is_inverted=is_inverted)
-                            
-                            print("🔄 リカバリー完了。ベクトルを整えるため現在地をリセットし、初期前進をやり直します。")
-                            make_csv.print("msg", "リカバリー完了。ベクトルを整えるため現在地をリセットし、初期前進をやり直します。")
-                            recov_data = ijochi.abnormal_check(["lat", "lon"], idokeido, ERROR_FLAG=False, max_retries=10, retry_delay=1)
-                            if recov_data is not None:
-                                recov_lat, recov_lon = recov_data
-                            else:
-                                recov_lat, recov_lon = None, None
-
-                            if recov_lat is not None and recov_lon is not None:
-                                prev_lat, prev_lon = recov_lat, recov_lon
-                                
-                            if motor_ok:
-                                md.move('w', power=0.7, duration=15.0, is_inverted=is_inverted, enable_stack_check=False)
-                                print("⏹️ 停止してGPSの安定を待ちます...")
-                                make_csv.print("msg", "停止してGPSの安定を待ちます...")
-                                time.sleep(1.0)
-                            
-                            # ループ先頭に戻って新しいcurrを取得し直す
-                            continue
-
-                        deg_diff = math.degrees(ang_rad)
-                        print(f"📍 GPS: ゴールまで残り {d:.2f}m / 角度のズレ {deg_diff:.1f}度")
-                        make_csv.print("msg", f"GPS: ゴールまで残り {d:.2f}m / 角度のズレ {deg_diff:.1f}度")
-
-                        # --- ⑥ ゴール判定 ---
-                        if d <= 10.0:
-                            print("🎯 ゴール10m圏内に到達！近距離フェーズへ移行します。")
-                            make_csv.print("msg", "ゴール10m圏内に到達！近距離フェーズへ移行します。")
-                            phase = 4
-                            make_csv.print("phase", "4") # ★追加
-                            break
-
-                        # --- ⑦ BNO055フィードバック旋回 ---
-                        if abs(deg_diff) > 15.0:
-                            print(f"↪️ 目標角度へ向けて旋回します (ズレ: {deg_diff:.1f}度)")
-                            make_csv.print("msg", f"目標角度へ向けて旋回します (ズレ: {deg_diff:.1f}度)")
-                            turn_by_angle(bno, md, deg_diff, is_inverted, motor_ok)
-
-                        # --- ⑧ Stop & Go方式による前進 ---
-                        print("⬆️ Stop & Go: 15秒前進します")
-                        make_csv.print("msg", "Stop & Go: 15秒前進します")
-                        is_stacked = False
-                        if motor_ok:
-                            is_stacked = md.move('w', power=0.7, duration=15.0, is_inverted=is_inverted, enable_stack_check=True)
-                            print("⏹️ 停止して待機中...")
-                            make_csv.print("msg", "停止して待機中...")
-                            time.sleep(1.0) 
-
-                        # --- ⑨ ジャイロセンサによるスタック検知とリカバリー ---
-                        if is_stacked:
-                            print("💥 スタック検知(ジャイロ)！自動リカバリー行動を開始します。")
-                            make_csv.print("warning", "スタック検知(ジャイロ)！自動リカバリー行動を開始します。")
-                            md.check_stuck(is_stacked, is_inverted=is_inverted)
-                            
-                            print("🔄 リカバリー完了。ベクトルを整えるため現在地をリセットし、初期前進をやり直します。")
-                            make_csv.print("msg", "リカバリー完了。ベクトルを整えるため現在地をリセットし、初期前進をやり直します。")
-                            recov_data = ijochi.abnormal_check(["lat", "lon"], idokeido, ERROR_FLAG=False, max_retries=10, retry_delay=1)
-                            if recov_data is not None:
-                                recov_lat, recov_lon = recov_data
-                            else:
-                                recov_lat, recov_lon = None, None
-
-                            if recov_lat is not None and recov_lon is not None:
-                                prev_lat, prev_lon = recov_lat, recov_lon
-                                
-                            if motor_ok:
-                                md.move('w', power=0.7, duration=15.0, is_inverted=is_inverted, enable_stack_check=False)
-                                print("⏹️ 停止してGPSの安定を待ちます...")
-                                make_csv.print("msg", "停止してGPSの安定を待ちます...")
-                                time.sleep(1.0)
-                            
-                            continue
-                        
-                        # --- ⑩ 次のループの計算のために保存 ---
-                        if curr_lat is not None:
-                            prev_lat, prev_lon = curr_lat, curr_lon
-                            
-                        time.sleep(0.1)
-
-                elif phase == 4:
-                    
-                    #ここに近距離フェーズの処理
-                    print("\n--- フェーズ4: 近距離フェーズ（カメラ誘導） ---")
-                    make_csv.print("msg", "--- フェーズ4: 近距離フェーズ（カメラ誘導） ---")
-                    
-                    if not cam:
-                        print("カメラのセットアップ開始")
-                        make_csv.print("msg", "カメラのセットアップ開始")
-                        
-                        # ★統合版：カメラセットアップのリトライ処理
-                        MAX_CAMERA_RETRIES = 5
-                        for attempt in range(MAX_CAMERA_RETRIES):
-                            cam = setup_camera()
-                            if cam:
-                                print(f"✅ カメラのセットアップ完了 (試行回数: {attempt + 1})")
-                                make_csv.print("msg", f"カメラのセットアップ完了 (試行回数: {attempt + 1})")
-                                break
-                            else:
-                                print(f"⚠️ カメラセットアップ失敗。再試行します... ({attempt + 1}/{MAX_CAMERA_RETRIES})")
-                                make_csv.print("warning", f"カメラセットアップ失敗。再試行します... ({attempt + 1}/{MAX_CAMERA_RETRIES})")
-                                time.sleep(2.0)  # OSにデバイス認識の猶予を与える
-
-                    if not cam:
-                        # ★統合版：カメラが完全に死んだ場合、現在のGPS状況を確認して運命を決める
-                        print("❌ 規定回数試行しましたが、カメラが認識されません。現在のGPS状況を確認します。")
-                        make_csv.print("error", "規定回数試行しましたが、カメラが認識されません。現在のGPS状況を確認します。")
-                        
-                        gps_data = ijochi.abnormal_check(["lat", "lon"], idokeido, ERROR_FLAG=False, max_retries=10, retry_delay=1)
-                        if gps_data is not None:
-                            curr_lat, curr_lon = gps_data
-                        else:
-                            curr_lat, curr_lon = None, None
-
-                        if curr_lat is not None and curr_lon is not None:
-                            # GPSが取れた場合、ゴールまでの距離を計算
-                            d, _ = calculate_distance_and_angle(curr_lat, curr_lon, curr_lat, curr_lon, GOAL_LAT, GOAL_LON)
-                            print(f"📍 GPS取得成功。ゴールまでの距離: {d:.2f}m")
-                            make_csv.print("msg", f"GPS取得成功。ゴールまでの距離: {d:.2f}m")
-                            
-                            if d <= 10.0:
-                                print("🌟 カメラは故障していますが、GPSで10m圏内であることが確認できました。ゴールと判定します！")
-                                make_csv.print("msg", "カメラは故障していますが、GPSで10m圏内であることが確認できました。ゴールと判定します！")
-                                phase = 5
-                                make_csv.print("phase", "5")
-                                continue
-                            else:
-                                print("⚠️ 10m圏外のため、GPS誘導（フェーズ3）に戻ります。")
-                                make_csv.print("warning", "10m圏外のため、GPS誘導（フェーズ3）に戻ります。")
-                                phase = 3
-                                make_csv.print("phase", "3")
-                                continue
-                        else:
-                            # GPSも取れない場合（GPSロストでフェーズ4に来た場合など）
-                            print("❌ GPSも取得できません。環境を変えるためブラインド前進を行い、フェーズ3へ戻ります。")
-                            make_csv.print("error", "GPSも取得できません。環境を変えるためブラインド前進を行い、フェーズ3へ戻ります。")
-                            if motor_ok:
-                                is_inverted = False
-                                if bno:
-                                    gravity = ijochi.abnormal_check("grav", bno.gravity, ERROR_FLAG=False)
-                                    is_inverted = (gravity is not None and gravity[2] < -2.0)
-                                md.move('w', power=0.7, duration=5.0, is_inverted=is_inverted, enable_stack_check=True)
-                            
-                            phase = 3
-                            make_csv.print("phase", "3")
-                            continue
-                    else:
-                        is_inverted = False
-                        lost_count = 0 #ターゲットを見失った連続回数をカウントする変数
-                        while phase == 4:
-                            try:
-                                #裏返り判定
-                                if bno:
-                                    gravity = ijochi.abnormal_check("grav", bno.gravity, ERROR_FLAG=False)
-                                    is_inverted = (gravity is not None and gravity[2] < -2.0)
-    
-                                #カメラで画像取得＆推論
-                                frame, x_pct, order, area = cam.capture_and_detect(is_inverted=is_inverted)
-                                is_stacked = 0
-
-                                # ★追加：取得した画像をログとして保存する
-                                last_image_save_time = save_frame_if_needed(frame, last_image_save_time)
-    
-                                #YOLOの指令に基づく行動
-                                if order == 4:
-                                    print(f"ターゲットに超接近（面積: {area}）。ゴールと判定します！")
-                                    make_csv.print("msg", f"ターゲットに超接近（面積: {area}）。ゴールと判定します！")
-                                    if motor_ok:
-                                        md.stop()
-                                    phase = 5
-                                    make_csv.print("phase", "5") # ★追加
-                                    break 
-                                    
-                                elif order == 0:
-                                    print("ターゲットを見失いました。探索のため右回転します。")
-                                    make_csv.print("msg", "ターゲットを見失いました。探索のため右回転します。")
-                                    lost_count += 1
-                                    if motor_ok:
-                                        md.move('e', power=0.7, duration=3, is_inverted=is_inverted, enable_stack_check=False)
-                                        md.move("w", power=0.7, duration=2.5, is_inverted=is_inverted, enable_stack_check=False)
-
-                                    #10回連続（約5秒間）見失ったら、GPSで現在地を確認する
-                                    if lost_count >= 10:
-                                        print("長時間ターゲットが見つかりません。現在地をGPSで確認します...")
-                                        make_csv.print("warning", "長時間ターゲットが見つかりません。現在地をGPSで確認します...")
-                                        if motor_ok:
-                                           md.stop()
-                                                                
-                                        gps_data = ijochi.abnormal_check(["lat", "lon"], idokeido, ERROR_FLAG=False, max_retries=10, retry_delay=1)
-                                        if gps_data is not None:
-                                            curr_lat, curr_lon = gps_data
-                                        else:
-                                            curr_lat, curr_lon = None, None
-
-                                        if curr_lat is not None and curr_lon is not None:
-                                            d, _ = calculate_distance_and_angle(
-                                                curr_lat, curr_lon, curr_lat, curr_lon, GOAL_LAT, GOAL_LON
-                                            )
-                                            print(f"ゴールまでの距離: {d:.2f}m")
-                                            make_csv.print("msg", f"ゴールまでの距離: {d:.2f}m")
-                                                                
-                                            if d <= 10.0:
-                                                print("10m圏内を維持しています。カウントをリセットし、探索を継続します。")
-                                                make_csv.print("msg", "10m圏内を維持しています。カウントをリセットし、探索を継続します。")
-                                                lost_count = 0 # まだ近くにいるので、もう一度探してみる
-                                            else:
-                                                print("10m圏外に出てしまいました。遠距離フェーズ(3)に戻ります。")
-                                                make_csv.print("warning", "10m圏外に出てしまいました。遠距離フェーズ(3)に戻ります。")
-                                                phase = 3
-                                                break
-                                        else:
-                                            print("GPS取得失敗。安全のため探索を継続します。")
-                                            make_csv.print("error", "GPS取得失敗。安全のため探索を継続します。")
-                                            lost_count = 0 # 取得できなかった場合はとりあえず探索継続  
-                                        
-                                elif order == 1:
-                                    print("ターゲットは正面です。直進します。")
-                                    make_csv.print("msg", "ターゲットは正面です。直進します。")
-                                    if motor_ok:
-                                        is_stacked = md.move('w', power=0.7, duration=2.0, is_inverted=is_inverted, enable_stack_check=True)
-                                        
-                                elif order == 2:
-                                    print("ターゲットが右です。右に旋回してから前進します。")
-                                    make_csv.print("msg", "ターゲットが右です。右に旋回してから前進します。")
-                                    if motor_ok:
-                                        md.move('e', power=0.7, duration=3, is_inverted=is_inverted, enable_stack_check=False)
-                                        is_stacked = md.move('w', power=0.7, duration=2.5, is_inverted=is_inverted, enable_stack_check=True)
-                                        
-                                elif order == 3:
-                                    print("ターゲットが左です。左に旋回してから前進します。")
-                                    make_csv.print("msg", "ターゲットが左です。左に旋回してから前進します。")
-                                    if motor_ok:
-                                        md.move('q', power=0.7, duration=3, is_inverted=is_inverted, enable_stack_check=False)
-                                        is_stacked = md.move('w', power=0.7, duration=2.5, is_inverted=is_inverted, enable_stack_check=True)
-    
-                                # ④ スタック判定とリカバリー（motordriveにお任せ）
-                                if motor_ok and is_stacked:
-                                    print("スタックを検知しました。リカバリー行動を開始します。")
-                                    make_csv.print("warning", "スタックを検知しました。リカバリー行動を開始します。")
-                                    md.check_stuck(is_stacked, is_inverted=is_inverted)
-                                    
-                                time.sleep(0.1)
-    
-                            except Exception as e:
-                                # ＝＝＝ ここからが追加したGPS安全装置 ＝＝＝
-                                print(f"カメラ等でエラー発生: {e}")
-                                make_csv.print("error", f"カメラ等でエラー発生: {e}")
-                                if motor_ok:
-                                    md.stop() # 暴走防止のため一旦停止
-    
-                                print("GPSで現在地を確認し、10m圏内かチェックします。")
-                                gps_data = ijochi.abnormal_check(["lat", "lon"], idokeido, ERROR_FLAG=False, max_retries=10, retry_delay=1)
-                                if gps_data is not None:
-                                    curr_lat, curr_lon = gps_data
-                                else:
-                                    curr_lat, curr_lon = None, None
-    
-                                if curr_lat is not None and curr_lon is not None:
-                                    # 距離を計算（方位計算用の過去座標は不要なので現在地をダミーで入れています）
-                                    d, _ = calculate_distance_and_angle(
-                                        curr_lat, curr_lon, curr_lat, curr_lon, GOAL_LAT, GOAL_LON
-                                    )
-                                    print(f"ゴールまでの距離: {d:.2f}m")
-                                    make_csv.print("msg", f"ゴールまでの距離: {d:.2f}m")
-    
-                                    if d <= 10.0:
-                                        print("10m圏内を維持しています。近距離フェーズを継続します。")
-                                        make_csv.print("msg", "10m圏内を維持しています。近距離フェーズを継続します。")
-                                        time.sleep(0.1)
-                                        continue # ループの先頭に戻ってカメラ再取得
-                                    else:
-                                        print("10m圏外に出てしまいました。遠距離フェーズ(3)に戻ります。")
-                                        make_csv.print("warning", "10m圏外に出てしまいました。遠距離フェーズ(3)に戻ります。")
-                                        phase = 3
-                                        break # 近距離のループを抜けて、フェーズ3へ戻る
-                                else:
-                                    print("GPSの取得にも失敗しました。安全のため近距離フェーズを維持してリトライします。")
-                                    make_csv.print("error", "GPSの取得にも失敗しました。安全のため近距離フェーズを維持してリトライします。")
-                                    time.sleep(0.1)
-                                    continue
-                elif phase == 5:
-                    #ここにゴールフェーズの処理
-                    print("--- フェーズ5 (ゴール完了) ---")
-                    make_csv.print("msg", "--- フェーズ5 (ゴール完了) ---")
-                    print("LEDを点滅させて待機します。終了するには Ctrl+C を押してください。")
-                    make_csv.print("msg", "LEDを点滅させて待機します。終了するには Ctrl+C を押してください。")
-                    while True:
-                        GPIO.output(LED_PIN, 1) # LEDオン
-                        time.sleep(1)         # 1秒待つ
-                        GPIO.output(LED_PIN, 0) # LEDオフ
-                        time.sleep(1)         # 1秒待つ
-
-                time.sleep(0.1)
-
-
-
-            except Exception as e:
-                print(f"\n予期せぬエラーが発生しました: {e}")
-                make_csv.print("serious_error", f"予期せぬエラーが発生しました: {e}")
-                time.sleep(2.0)
-
-
-
+        mission.run()
+        finished = ctx.goal_reason is not None
     except KeyboardInterrupt:
         print("\n中断されました。")
         make_csv.print("msg", "中断されました。")
+        finished = True  # 手で止めたときは次の起動をフェーズ1からにする
     except Exception as e:
         print(f"\n予期せぬエラーが発生しました: {e}")
         make_csv.print("serious_error", f"予期せぬエラーが発生しました: {e}")
     finally:
         print("\n終了処理中... (Motors, Camera, Sensors)")
         make_csv.print("msg", "終了処理中... (Motors, Camera, Sensors)")
-        if cam: 
-            try: cam.close()
+        try: mission.shutdown()
+        except: pass
+        try: profiler.dump()
+        except: pass
+        if finished:
+            checkpoint.clear(CHECKPOINT_PATH)
+        if ctx.cam:
+            try: ctx.cam.close()
+            except: pass
+        if ctx.img_logger:
+            try: ctx.img_logger.close()
             except: pass
-        if bno: 
+        if bno:
             try: bno.close()
             except: pass
-        if bme: 
+        if bme:
             try: bme.close()
             except: pass
+        close_processes()
         if motor_ok:
             try: md.cleanup()
             except: pass
@@ -886,6 +1413,8 @@ def main():
         except: pass
         print("完了。お疲れ様でした。")
         make_csv.print("msg", "完了。お疲れ様でした。")
+    # 終わらずに抜けた（例外など）ときは 1 を返し、supervisor に再起動させる
+    return 0 if finished else 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# Altitude / vertical-speed estimator for CanSat SC-28
+# - 状態 (高度, 上昇率) の2状態カルマンフィルタ。BNO055 の上下方向の加速度で予測し、BME280 の気圧高度で更新する
+#   → 1回ごとの気圧の雑音（0.1~0.3 m）をならし、上昇率も直接出せるので、打ち上げ・着地を数秒で判定できる
+# - 加速度が読めないとき（BNO055 が無い）は「加速度は雑音」とみなして気圧だけで追う（上昇率は遅れる）
+# - 気圧の外れ値は、予測からのずれ（イノベーション）が GATE_SIGMA を超えたら捨てる
+#   続けて GATE_RESET_COUNT 回捨てたら、予測の方が間違っているとみなして高度を取り直す
+# - confidence は 0.0~1.0: 直近 CONF_WINDOW 回の気圧のうち採用できた割合（起動直後はサンプル数でも割り引く）
+#
+# 使い方:
+#   f = altitude_filter.AltitudeFilter()
+#   f.update(time.monotonic(), alt, accel_up)      # accel_up は vertical_accel() の値か None
+#   f.altitude, f.climb_rate, f.alt_sigma, f.confidence
+
+import math
+from collections import deque
+
+BARO_SIGMA = 0.3             # 気圧高度の雑音 [m]（BME280 の x1 オーバーサンプリング + 降下中の風圧）
+ACCEL_SIGMA = 2.0            # 加速度の誤差 [m/s^2]（傾き・バイアス・振り子運動。着地の衝撃は 20 Hz では取りこぼす）
+ACCEL_SIGMA_GAIN = 0.1       # 加速度が大きいほど誤差も大きいとみなす（打ち上げ・開傘の衝撃で飽和する）
+NO_ACCEL_SIGMA = 3.0         # 加速度が読めないときの、加速度そのものの大きさの見積もり [m/s^2]
+VZ_INIT_SIGMA = 5.0          # 最初の上昇率の不確かさ [m/s]
+MAX_DT = 1.0                 # これより間が空いたら加速度は積分しない（不確かさは間の分だけ増える）[s]
+GATE_SIGMA = 4.0             # イノベーションがこの σ を超える気圧は捨てる
+GATE_RESET_COUNT = 5         # 続けてこの回数捨てたら高度を取り直す
+CONF_WINDOW = 20             # confidence を出す気圧の回数
+
+
+def vertical_accel(linear_acceleration, gravity):
+    """
+    BNO055 の linear_acceleration を重力ベクトルの向きに射影した上向きの加速度 [m/s^2]
+    （BNO055 の gravity は静止時に上を向く。機体が逆さまでも傾いていてもそのまま使える）
+    """
+    if linear_acceleration is None or gravity is None:
+        return None
+    g = math.sqrt(sum(x * x for x in gravity))
+    if g < 1.0:
+        return None
+    return sum(a * b for a, b in zip(linear_acceleration, gravity)) / g
+
+
+class AltitudeFilter:
+    def __init__(self, baro_sigma=BARO_SIGMA, accel_sigma=ACCEL_SIGMA, no_accel_sigma=NO_ACCEL_SIGMA):
+        self.baro_sigma = baro_sigma
+        self.accel_sigma = accel_sigma
+        self.no_accel_sigma = no_accel_sigma
+        self.reset()
+
+    def reset(self):
+        self.t = None
+        self.x = None                # [高度, 上昇率]
+        self.P = None                # 共分散 [[P00, P01], [P10, P11]]
+        self.updates = 0
+        self.rejected = 0            # 続けて捨てた回数
+        self._accepted = deque(maxlen=CONF_WINDOW)
+
+    # ----------------------------
+    # 推定値
+    # ----------------------------
+    @property
+    def ready(self):
+        return self.x is not None
+
+    @property
+    def altitude(self):
+        return None if self.x is None else self.x[0]
+
+    @property
+    def climb_rate(self):
+        return None if self.x is None else self.x[1]
+
+    @property
+    def alt_sigma(self):
+        return None if self.P is None else math.sqrt(max(0.0, self.P[0][0]))
+
+    @property
+    def vz_sigma(self):
+        return None if self.P is None else math.sqrt(max(0.0, self.P[1][1]))
+
+    @property
+    def confidence(self):
+        if not self._accepted:
+            return 0.0
+        ratio = sum(self._accepted) / len(self._accepted)
+        return ratio * min(1.0, self.updates / CONF_WINDOW)
+
+    # ----------------------------
+    # 予測・更新
+    # ----------------------------
+    def _init(self, t, alt):
+        self.t = t
+        self.x = [alt, 0.0]
+        self.P = [[self.baro_sigma ** 2, 0.0], [0.0, VZ_INIT_SIGMA ** 2]]
+
+    def predict(self, t, accel=None):
+        """時刻 t まで進める（accel: 上向きの加速度 [m/s^2]。None なら 0 とみなして不確かさを大きくする）"""
+        if self.x is None:
+            return
+        dt = t - self.t
+        if dt <= 0.0:
+            return
+        self.t = t
+        if accel is None:
+            a, q = 0.0, self.no_accel_sigma
+        else:
+            a, q = accel, self.accel_sigma + ACCEL_SIGMA_GAIN * abs(accel)
+        if dt > MAX_DT:
+            a = 0.0      # 古い加速度で長く積分しない
+
+        alt, vz = self.x
+        self.x = [alt + vz * dt + 0.5 * a * dt * dt, vz + a * dt]
+
+        # P = F P F^T + Q（F = [[1, dt], [0, 1]]、Q は加速度の誤差を dt の間の白色雑音とみなしたもの）
+        (p00, p01), (p10, p11) = self.P
+        q2 = q * q
+        n00 = p00 + dt * (p10 + p01) + dt * dt * p11 + q2 * dt ** 4 / 4.0
+        n01 = p01 + dt * p11 + q2 * dt ** 3 / 2.0
+        n11 = p11 + q2 * dt * dt
+        self.P = [[n00, n01], [n01, n11]]
+
+    def update(self, t, alt, accel=None):
+        """気圧高度 alt [m] を1つ入れる。採用したら True、外れ値として捨てたら False"""
+        if alt is None or not math.isfinite(alt):
+            return False
+        if self.x is None:
+            self._init(t, alt)
+            self.updates = 1
+            self._accepted.append(1)
+            return True
+        self.predict(t, accel)
+
+        r = self.baro_sigma ** 2
+        y = alt - self.x[0]
+        s = self.P[0][0] + r
+        if y * y > GATE_SIGMA * GATE_SIGMA * s:
+            self.rejected += 1
+            self._accepted.append(0)
+            if self.rejected >= GATE_RESET_COUNT:
+                # 予測の方がずれている（長い欠測・加速度の飽和など）: 高度を取り直す（上昇率の値は残し、不確かさは最初に戻す）
+                vz = self.x[1]
+                self._init(t, alt)
+                self.x[1] = vz
+                self.rejected = 0
+            return False
+
+        (p00, p01), (p10, p11) = self.P
+        k0, k1 = p00 / s, p10 / s
+        self.x = [self.x[0] + k0 * y, self.x[1] + k1 * y]
+        self.P = [[(1.0 - k0) * p00, (1.0 - k0) * p01],
+                  [p10 - k1 * p00, p11 - k1 * p01]]
+        self.updates += 1
+        self.rejected = 0
+        self._accepted.append(1)
+        return True
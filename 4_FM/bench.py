@@ -0,0 +1,459 @@
+# Micro-benchmarks for CanSat SC-28
+# - ドライバとログの「毎回通る処理」の速さを実機なしで測る（I2C・シリアルは固定のバイト列を返す偽物）
+#   * BME280: compensate_T / P / H、I2C読み取り込みの pressure()
+#   * BNO055: _read_vector のデコード、euler()
+#   * GPS   : pynmea2 での NMEA 解析、read_gps_data()（偽シリアル）、calculate_distance_and_angle
+#   * ijochi.abnormal_check（単一値と lat/lon）、make_csv.print（一時ファイルへ）
+#   * Camera.detect() を 5_log/picture の保存画像で
+# - 1_definition/SC-28, 2_phase, 3_EM の同名モジュールも --tree で測れる（コピーの間で速さがずれていないかを比べる）
+#   木ごとに別プロセスで読み込む。関数が無い・引数が違うものは理由を表示して飛ばす
+# - --save で結果を基準値(bench_baseline.json)として保存し、--compare で基準値より遅くなったものがあれば終了コード1
+#   ※ 基準値は測ったマシンの値。別のマシン(Pi と PC など)の基準値とは比べないこと
+#
+# 使い方:
+#   python3 bench.py                              # 4_FM を測って表示
+#   python3 bench.py --save                       # 基準値を保存（上書き）
+#   python3 bench.py --compare --threshold 0.25   # 基準値より25%以上遅いものがあれば失敗
+#   python3 bench.py --tree 3_EM --tree 4_FM      # コピーの比較
+#   python3 bench.py --only bme280 --only nmea    # 名前の一部で絞る
+
+import os
+import sys
+import json
+import glob
+import time
+import types
+import struct
+import inspect
+import argparse
+import platform
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+DEFAULT_BASELINE = os.path.join(HERE, "bench_baseline.json")
+PIC_DIR = os.path.join(ROOT, "5_log", "picture")
+
+# BME280 のキャリブレーション値（データシートの例。fm_sim と同じ）
+BME_T = (27504, 26435, -1000)
+BME_P = (36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000)
+BME_H = (75, 362, 0, 313, 50, 30)
+BME_RAW = bytes([0x65, 0x5A, 0xC0, 0x7E, 0xED, 0x00, 0x75, 0x30])   # pres, temp, hum の生データ
+
+
+def _nmea(body):
+    cs = 0
+    for ch in body:
+        cs ^= ord(ch)
+    return f"${body}*{cs:02X}"
+
+
+NMEA_GGA = _nmea("GPGGA,123519.00,3022.45564,N,13057.59701,E,1,08,0.9,10.0,M,30.0,M,,")
+NMEA_RMC = _nmea("GPRMC,123519.00,A,3022.45564,N,13057.59701,E,0.5,0.0,060326,,,A")
+
+
+# ==========================================
+# 偽のバス
+# ==========================================
+class _FakeBus:
+    """pigpio.pi の代わり: どのレジスタにも固定のバイト列を返す"""
+    connected = True
+
+    def __init__(self, data=b"\x00" * 64):
+        self.data = bytes(data)
+
+    def i2c_read_i2c_block_data(self, handle, reg, count):
+        return count, bytearray(self.data[:count])
+
+    def i2c_read_byte_data(self, handle, reg):
+        return self.data[0]
+
+    def i2c_write_byte_data(self, handle, reg, value):
+        pass
+
+    def i2c_close(self, handle):
+        pass
+
+
+class _FakeSerial:
+    """serial.Serial の代わり: 固定の NMEA 文を順番に返す"""
+    lines = [b"$GPGSV,3,1,12*70\r\n", (NMEA_RMC + "\r\n").encode(), (NMEA_GGA + "\r\n").encode()]
+
+    def __init__(self, *args, **kwargs):
+        self.is_open = True
+        self._i = 0
+
+    def readline(self):
+        line = self.lines[self._i % len(self.lines)]
+        self._i += 1
+        return line
+
+    def close(self):
+        self.is_open = False
+
+
+def _install_fake_modules():
+    """ハードウェアのモジュールを偽物にする（実機のライブラリが入っていても、バスには触らない）"""
+    mod = types.ModuleType
+    pigpio = mod("pigpio")
+    pigpio.pi = lambda *a, **k: _FakeBus()
+    pigpio.error = Exception
+    pigpio.OUTPUT, pigpio.INPUT = 1, 0
+    serial = mod("serial")
+    serial.Serial = _FakeSerial
+    serial.SerialException = IOError
+    picamera2 = mod("picamera2")
+    picamera2.Picamera2 = None
+    ultralytics = mod("ultralytics")
+    ultralytics.YOLO = None
+    sys.modules.update({"pigpio": pigpio, "serial": serial, "picamera2": picamera2, "ultralytics": ultralytics})
+
+
+# ==========================================
+# 計測
+# ==========================================
+def measure(fn, min_time=0.2, repeat=5):
+    """
+    fn() 1回あたりの時間 [ns]（repeat 回測って一番速い回）
+    1回の測定が min_time / repeat 以上になるまでループ回数を増やす
+    """
+    target = min_time / repeat
+    n = 1
+    while True:
+        t0 = time.perf_counter_ns()
+        for _ in range(n):
+            fn()
+        dt = time.perf_counter_ns() - t0
+        if dt >= target * 1e9 or n >= 1 << 24:
+            break
+        n *= 2
+    best = dt / n
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter_ns()
+        for _ in range(n):
+            fn()
+        best = min(best, (time.perf_counter_ns() - t0) / n)
+    return best
+
+
+class Skip(Exception):
+    pass
+
+
+# ==========================================
+# ベンチマーク（setup を返す関数: 呼ぶと計測対象の fn を返す）
+# ==========================================
+def _bme():
+    from bme280 import BME280Sensor
+    s = object.__new__(BME280Sensor)
+    s.pi = _FakeBus(BME_RAW)
+    s.i2c_handle = 1
+    s.debug = False
+    s.calib_ok = True
+    s.digT, s.digP, s.digH = list(BME_T), list(BME_P), list(BME_H)
+    s.t_fine = 0.0
+    s.compensate_T(519888)
+    return s
+
+
+def bench_bme_T():
+    s = _bme()
+    return lambda: s.compensate_T(519888)
+
+
+def bench_bme_P():
+    s = _bme()
+    return lambda: s.compensate_P(415148)
+
+
+def bench_bme_H():
+    s = _bme()
+    return lambda: s.compensate_H(30000)
+
+
+def bench_bme_pressure():
+    s = _bme()
+    if s.pressure() is None:
+        raise Skip("pressure() returned None with the fake bus")
+    return s.pressure
+
+
+def _bno():
+    from bno055 import BNO055
+    b = object.__new__(BNO055)
+    b.pi = _FakeBus(struct.pack("<8h", 1234, -567, 89, -12, 3456, -7890, 16384, 0))
+    b._i2c_handle = 1
+    if b._read_vector(0x1A, 3) is None:
+        raise Skip("_read_vector() returned None with the fake bus")
+    return b
+
+
+def bench_bno_vector():
+    b = _bno()
+    return lambda: b._read_vector(0x1A, 3)
+
+
+def bench_bno_euler():
+    b = _bno()
+    return b.euler
+
+
+def bench_nmea_parse():
+    import pynmea2
+    return lambda: (pynmea2.parse(NMEA_GGA), pynmea2.parse(NMEA_RMC))
+
+
+def bench_gps_read():
+    import gps
+    g = gps.GPS(port="fake", timeout=0.5)
+    if g.read_gps_data()[0] is None:
+        raise Skip("read_gps_data() found no fix in the fake NMEA stream")
+    return g.read_gps_data
+
+
+def bench_gps_distance():
+    from gps import calculate_distance_and_angle
+    args = (30.3745, 130.9601, 30.3748, 130.9605, 30.3742606, 130.9599502)
+    return lambda: calculate_distance_and_angle(*args)
+
+
+def _abnormal_check(list_value):
+    import ijochi
+    params = list(inspect.signature(ijochi.abnormal_check).parameters)
+    if params[:2] == ["value_name", "read_func"]:
+        if list_value:
+            return lambda: ijochi.abnormal_check(["lat", "lon"], lambda: (30.3745, 130.9601), ERROR_FLAG=False)
+        return lambda: ijochi.abnormal_check("press", lambda: 1013.2, ERROR_FLAG=False)
+    if params[:3] == ["sensor_name", "value_name", "sensor_value"]:
+        if list_value:
+            raise Skip("old abnormal_check() has no lat/lon form")
+        return lambda: ijochi.abnormal_check("bme", "press", 1013.2, ERROR_FLAG=False)
+    raise Skip(f"unknown abnormal_check{tuple(params)}")
+
+
+def bench_ijochi_press():
+    return _abnormal_check(False)
+
+
+def bench_ijochi_latlon():
+    return _abnormal_check(True)
+
+
+def bench_csv_msg():
+    import make_csv
+    return lambda: make_csv.print("msg", "bench message")
+
+
+def bench_csv_vector():
+    import make_csv
+    return lambda: make_csv.print("gyro", [0.01, -0.02, 0.03])
+
+
+def bench_camera_detect():
+    import cv2
+    from camera import Camera
+    if not hasattr(Camera, "detect"):
+        raise Skip("Camera has no detect()")
+    paths = sorted(glob.glob(os.path.join(PIC_DIR, "run_*", "raw_*.jpg")))
+    paths = paths or sorted(glob.glob(os.path.join(PIC_DIR, "run_*", "img_*.jpg")))
+    frames = [f for f in (cv2.imread(p) for p in paths[:20]) if f is not None]
+    if not frames:
+        raise Skip(f"no images under {PIC_DIR}")
+    cam = Camera(model_path=None, use_camera=False, log_csv=False)
+    state = {"i": 0}
+
+    def run():
+        cam.detect(frames[state["i"] % len(frames)])
+        state["i"] += 1
+    return run
+
+
+BENCHMARKS = [
+    ("bme280.compensate_T", bench_bme_T),
+    ("bme280.compensate_P", bench_bme_P),
+    ("bme280.compensate_H", bench_bme_H),
+    ("bme280.pressure", bench_bme_pressure),
+    ("bno055._read_vector", bench_bno_vector),
+    ("bno055.euler", bench_bno_euler),
+    ("nmea.parse", bench_nmea_parse),
+    ("gps.read_gps_data", bench_gps_read),
+    ("gps.calculate_distance_and_angle", bench_gps_distance),
+    ("ijochi.abnormal_check.press", bench_ijochi_press),
+    ("ijochi.abnormal_check.lat_lon", bench_ijochi_latlon),
+    ("make_csv.print.msg", bench_csv_msg),
+    ("make_csv.print.vector", bench_csv_vector),
+    ("camera.detect", bench_camera_detect),
+]
+
+
+# ==========================================
+# 1つの木を測る
+# ==========================================
+def run_tree(tree, only=None, min_time=0.2):
+    """tree のモジュールを読み込んで全ベンチマークを測る（1プロセスで1つの木だけ）。Return: {name: ns or 'skip: ...'}"""
+    path = os.path.join(ROOT, tree)
+    sys.path.insert(0, path)
+    _install_fake_modules()
+
+    log_fd, log_path = tempfile.mkstemp(prefix="bench_", suffix=".csv")
+    os.close(log_fd)
+    results = {}
+    try:
+        try:
+            import make_csv
+            if make_csv.log_file is not None:
+                make_csv.log_file.close()
+            make_csv.log_file = open(log_path, "w", encoding="utf-8")
+        except Exception as e:
+            print(f"make_csv: {e}", file=sys.stderr)
+
+        for name, setup in BENCHMARKS:
+            if only and not any(key in name for key in only):
+                continue
+            try:
+                fn = setup()
+                fn()
+                results[name] = measure(fn, min_time=min_time)
+            except Skip as e:
+                results[name] = f"skip: {e}"
+            except Exception as e:
+                results[name] = f"skip: {type(e).__name__}: {e}"
+    finally:
+        os.remove(log_path)
+    return results
+
+
+def _run_tree_subprocess(tree, only, min_time):
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", tree, "--min-time", str(min_time)]
+    for key in only or []:
+        cmd += ["--only", key]
+    out = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.join(ROOT, tree))
+    for line in out.stdout.splitlines():
+        if line.startswith("BENCH_JSON "):
+            return json.loads(line[len("BENCH_JSON "):])
+    raise RuntimeError(f"{tree}: benchmark worker failed\n{out.stderr[-2000:]}")
+
+
+# ==========================================
+# 基準値
+# ==========================================
+def _machine():
+    return {"machine": platform.machine(), "node": platform.node(), "python": platform.python_version()}
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path, all_results):
+    data = load_baseline(path) or {"trees": {}}
+    data["machine"] = _machine()
+    data["saved"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    for tree, results in all_results.items():
+        data["trees"][tree] = {k: v for k, v in results.items() if isinstance(v, (int, float))}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def compare(all_results, baseline, threshold):
+    """基準値より threshold 以上遅いものの一覧 [(tree, name, base_ns, now_ns)]"""
+    slow = []
+    for tree, results in all_results.items():
+        base = baseline.get("trees", {}).get(tree, {})
+        for name, ns in results.items():
+            if isinstance(ns, (int, float)) and name in base and ns > base[name] * (1.0 + threshold):
+                slow.append((tree, name, base[name], ns))
+    return slow
+
+
+def _fmt_ns(ns):
+    if not isinstance(ns, (int, float)):
+        return "-"
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f}ms"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.2f}us"
+    return f"{ns:.0f}ns"
+
+
+def format_table(all_results, baseline=None):
+    trees = list(all_results)
+    names = [name for name, _ in BENCHMARKS if any(name in r for r in all_results.values())]
+    width = max(len(n) for n in names) if names else 10
+    head = f"{'benchmark':<{width}}  " + "  ".join(f"{t:>14}" for t in trees)
+    if baseline:
+        head += "  (vs baseline)"
+    lines = [head]
+    skips = []
+    for name in names:
+        cells = []
+        ratios = []
+        for tree in trees:
+            v = all_results[tree].get(name)
+            if isinstance(v, str):
+                skips.append(f"  {tree} {name}: {v}")
+            cells.append(f"{_fmt_ns(v):>14}")
+            base = (baseline or {}).get("trees", {}).get(tree, {}).get(name)
+            if base and isinstance(v, (int, float)):
+                ratios.append(f"{(v / base - 1) * 100:+.0f}%")
+        line = f"{name:<{width}}  " + "  ".join(cells)
+        if ratios:
+            line += "  " + " ".join(ratios)
+        lines.append(line)
+    if skips:
+        lines.append("skipped:")
+        lines.extend(skips)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the driver and logging hot paths")
+    parser.add_argument("--tree", action="append", default=None,
+                        help="directory under the repo root to benchmark (repeatable, default: 4_FM)")
+    parser.add_argument("--only", action="append", default=None, help="run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="measuring time per benchmark [s]")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="fail if slower than the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown for --compare (0.25 = 25%%)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        results = run_tree(args.worker, only=args.only, min_time=args.min_time)
+        print("BENCH_JSON " + json.dumps(results))
+        return
+
+    trees = args.tree or [os.path.basename(HERE)]
+    all_results = {}
+    for tree in trees:
+        print(f"running {tree} ...", flush=True)
+        all_results[tree] = _run_tree_subprocess(tree, args.only, args.min_time)
+
+    baseline = load_baseline(args.baseline) if args.compare else None
+    if args.compare and baseline is None:
+        print(f"no baseline at {args.baseline} (run with --save first)")
+        sys.exit(2)
+    if baseline and baseline.get("machine", {}).get("node") != platform.node():
+        print(f"warning: baseline was saved on {baseline.get('machine', {}).get('node')}, "
+              f"this is {platform.node()}")
+
+    print(format_table(all_results, baseline))
+
+    if args.save:
+        save_baseline(args.baseline, all_results)
+        print(f"baseline saved: {args.baseline}")
+    if baseline:
+        slow = compare(all_results, baseline, args.threshold)
+        for tree, name, base, now in slow:
+            print(f"SLOWER: {tree} {name} {_fmt_ns(base)} -> {_fmt_ns(now)} ({(now / base - 1) * 100:+.0f}%)")
+        print("result: " + ("FAIL" if slow else "PASS"))
+        sys.exit(1 if slow else 0)
+
+
+if __name__ == "__main__":
+    main()
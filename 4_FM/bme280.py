@@ -80,8 +80,10 @@ class BME280Sensor:
         osrs_h = 1
         mode = 3  # normal mode
 
-        # standby 1000ms (datasheet t_sb=5), filter off
-        t_sb = 5
+        # standby 0.5ms (datasheet t_sb=0), filter off
+        # 高度フィルタ(altitude_filter.py)が 20 Hz で読むので、測定を待たずに続ける（約100 Hzで新しい値が出る）
+        # 平滑化はフィルタ側で行うのでIIRフィルタは使わない
+        t_sb = 0
         filt = 0
         spi3w_en = 0
 
@@ -3,12 +3,19 @@
 # - Fixes: OpenCV findContours compatibility, bitwise_or
 # - YOLO throttling
 # - Auto CSV logging for camera data
+# - Frame-to-frame cone tracker (template correlation) to skip redundant YOLO
+# - Lazy picamera2/ultralytics imports + background model preload (warm-up)
+# - HSV threshold profile loading (hsv_tuner.py output)
 
+import os
+import json
 import time
+import threading
 import cv2
 import numpy as np
-from picamera2 import Picamera2
-from ultralytics import YOLO
+from tracker import ConeTracker
+import profiler
+import heartbeat
 
 # ★ make_csvをインポート (安全な読み込み)
 try:
@@ -18,6 +25,128 @@ except ImportError:
     print("Warning: make_csv module not found. Logging will be disabled.")
 
 
+# ---------------------------------------------------------
+# YOLOモデルの遅延読み込み・事前読み込み
+# ultralytics(torch)のimportは数秒かかるため、起動時には読み込まない
+# ---------------------------------------------------------
+_model_cache = {}          # model_path -> ロード済みモデル
+_preload_threads = {}      # model_path -> 読み込みスレッド
+_model_lock = threading.Lock()
+MODEL_LOAD_EXPECT = 60.0   # 同期読み込みにかかりうる時間 [s]（supervisor の心拍の猶予）
+
+
+def _load_model(model_path, warmup=True):
+    """YOLOモデルを読み込み、ダミー推論で初回推論のコールドスタートを済ませる"""
+    from ultralytics import YOLO
+
+    t0 = time.monotonic()
+    model = YOLO(model_path)
+    if warmup:
+        dummy = np.zeros((480, 640, 3), dtype=np.uint8)
+        model.predict(dummy, save=False, show=False, verbose=False)
+    msg = f"YOLO model ready ({time.monotonic() - t0:.1f}s, warmup={warmup})"
+    print(msg)
+    if make_csv:
+        try: make_csv.print('msg', msg)
+        except Exception: pass
+    return model
+
+
+def _preload_worker(model_path, warmup):
+    try:
+        model = _load_model(model_path, warmup=warmup)
+        with _model_lock:
+            _model_cache[model_path] = model
+    except Exception as e:
+        print(f"Warning: YOLO preload failed: {e}")
+        if make_csv:
+            try: make_csv.print('warning', f"YOLO preload failed: {e}")
+            except Exception: pass
+
+
+def preload_model(model_path="./my_custom_model.pt", warmup=True):
+    """
+    バックグラウンドでYOLOモデルの読み込みとウォームアップを開始する（何度呼んでも1回だけ）
+    Return:
+        新しく開始した読み込みスレッド（開始済み・ロード済みの場合は None）
+    """
+    with _model_lock:
+        if model_path in _model_cache or model_path in _preload_threads:
+            return None
+        th = threading.Thread(target=_preload_worker, args=(model_path, warmup),
+                              name="yolo-preload", daemon=True)
+        _preload_threads[model_path] = th
+    th.start()
+    return th
+
+
+def get_model(model_path="./my_custom_model.pt", timeout=None):
+    """
+    ロード済みモデルを返す。事前読み込み中なら完了を待ち、未開始なら同期で読み込む。
+    失敗時は例外を投げる
+    """
+    with _model_lock:
+        model = _model_cache.get(model_path)
+        th = _preload_threads.get(model_path)
+    if model is not None:
+        return model
+
+    heartbeat.beat(expect=MODEL_LOAD_EXPECT)  # 読み込みを待つ間はメインループが止まる
+    if th is not None:
+        th.join(timeout)
+        with _model_lock:
+            model = _model_cache.get(model_path)
+        if model is not None:
+            return model
+
+    model = _load_model(model_path, warmup=False)
+    with _model_lock:
+        _model_cache[model_path] = model
+    return model
+
+
+# ---------------------------------------------------------
+# 色検出の閾値（hsv_tuner.py が出力するプロファイルで上書きできる）
+# ---------------------------------------------------------
+DEFAULT_HSV_PROFILE = {
+    "hsv_min1": [0, 117, 115],
+    "hsv_max1": [18, 255, 255],
+    "hsv_min2": [169, 117, 104],
+    "hsv_max2": [179, 255, 255],
+}
+
+
+def load_hsv_profile(path):
+    """
+    しきい値プロファイル(JSON)を読み込む。読めない・形式が違う場合は既定値を返す
+    """
+    profile = {k: list(v) for k, v in DEFAULT_HSV_PROFILE.items()}
+    if not path:
+        return profile
+    if not os.path.exists(path):
+        print(f"HSV profile not found ({path}). Using default thresholds.")
+        return profile
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for k in DEFAULT_HSV_PROFILE:
+            v = [int(x) for x in data[k]]
+            if len(v) != 3:
+                raise ValueError(f"{k} must have 3 values")
+            profile[k] = v
+        print(f"HSV profile loaded: {path}")
+        if make_csv:
+            try: make_csv.print('msg', f"HSV profile loaded: {path} {profile}")
+            except Exception: pass
+    except Exception as e:
+        print(f"Warning: Failed to load HSV profile: {e}")
+        if make_csv:
+            try: make_csv.print('warning', f"Failed to load HSV profile: {e}")
+            except Exception: pass
+        profile = {k: list(v) for k, v in DEFAULT_HSV_PROFILE.items()}
+    return profile
+
+
 class Camera:
     def __init__(
         self,
@@ -28,6 +157,12 @@ class Camera:
         yolo_conf_min=0.25,           # YOLOの最低信頼度
         yolo_red_min=0.001,           # 赤がこの割合以上のときだけYOLO（0.1%）
         yolo_red_max=0.05,            # 赤がこの割合未満のときだけYOLO（=色追尾に移る前の遠距離帯）
+        use_tracker=True,             # 確定したコーン矩形をフレーム間で追跡する
+        tracker_conf_min=0.55,        # 追跡の信頼度がこれ未満ならフル検出に戻す
+        keep_raw=False,               # 注釈描画前の画像を self.last_raw に残す（画像ログ用）
+        use_camera=True,              # Falseならカメラを開かない（detect()で保存画像を解析する用）
+        log_csv=True,                 # Falseなら判定結果をCSVに書かない（オフライン解析用）
+        hsv_profile=None,             # hsv_tuner.py が出力したしきい値JSONのパス（無ければ既定値）
     ):
         self.debug = debug
         self.model = None
@@ -40,32 +175,48 @@ class Camera:
         self.yolo_red_max = float(yolo_red_max)
 
         self._frame_count = 0
+        self.keep_raw = bool(keep_raw)
+        self.last_raw = None
+        self.log_csv = bool(log_csv)
 
-        # 1. YOLOモデルのロード
-        try:
-            self.model = YOLO(model_path)
-            print("YOLO model loaded successfully.")
-        except Exception as e:
-            print(f"Warning: Failed to load YOLO model: {e}")
-            print("Running in Color-Detection-Only mode.")
-            self.model = None
+        # 直近フレームの判定詳細（オフライン解析・デバッグ用）
+        self.last_center = (0, 0)
+        self.last_source = "none"      # "color" / "yolo" / "track" / "none"
+
+        # ★ トラッカー（YOLO/大きな赤領域で確定した矩形を引き継ぐ）
+        self.tracker = ConeTracker(conf_min=tracker_conf_min) if use_tracker else None
+        self.track_conf = 0.0          # 直近フレームの追跡信頼度（0.0~1.0）
+        self._force_detect = False     # ロスト直後は yolo_every を待たずにYOLOを回す
+
+        # 1. YOLOモデルのロード（preload_model() 済みならキャッシュを使う / model_path=None なら色検出のみ）
+        if model_path:
+            try:
+                self.model = get_model(model_path)
+                print("YOLO model loaded successfully.")
+            except Exception as e:
+                print(f"Warning: Failed to load YOLO model: {e}")
+                print("Running in Color-Detection-Only mode.")
+                self.model = None
 
         # 2. カメラの初期化 (640x480)
-        try:
-            self.picam2 = Picamera2()
-            config = self.picam2.create_preview_configuration({"format": "XRGB8888", "size": (640, 480)})
-            self.picam2.configure(config)
-            self.picam2.start()
-            print("Camera started.")
-        except Exception as e:
-            print(f"Error initializing camera: {e}")
-            self.picam2 = None
+        if use_camera:
+            try:
+                from picamera2 import Picamera2
+                self.picam2 = Picamera2()
+                config = self.picam2.create_preview_configuration({"format": "XRGB8888", "size": (640, 480)})
+                self.picam2.configure(config)
+                self.picam2.start()
+                print("Camera started.")
+            except Exception as e:
+                print(f"Error initializing camera: {e}")
+                self.picam2 = None
 
         # 色検出の閾値
-        self.hsv_min1 = np.array([0, 117, 115])
-        self.hsv_max1 = np.array([18, 255, 255])
-        self.hsv_min2 = np.array([169, 117, 104])
-        self.hsv_max2 = np.array([179, 255, 255])
+        profile = load_hsv_profile(hsv_profile)
+        self.hsv_min1 = np.array(profile["hsv_min1"])
+        self.hsv_max1 = np.array(profile["hsv_max1"])
+        self.hsv_min2 = np.array(profile["hsv_min2"])
+        self.hsv_max2 = np.array(profile["hsv_max2"])
 
     def close(self):
         """カメラを安全に停止・開放する"""
@@ -131,12 +282,30 @@ class Camera:
                 print("Camera is not initialized!")
                 return np.zeros((480, 640, 3), dtype=np.uint8), 0.0, 0, 0
 
+            try:
+                # 1. フレーム取得
+                with profiler.span("camera.capture"):
+                    frame_raw = self.picam2.capture_array()
+            except Exception as e:
+                print(f"Camera Process Error: {e}")
+                return np.zeros((480, 640, 3), dtype=np.uint8), 0.0, 0, 0
+
+            return self.detect(frame_raw, is_inverted=is_inverted)
+
+    @profiler.timed("camera.detect")
+    def detect(self, frame_raw, is_inverted=False):
+            """
+            取得済みの画像からコーン位置を判定する（保存画像のオフライン解析にも使う）
+            Args:
+                frame_raw: BGR/BGRA画像
+                is_inverted (bool): Trueの場合、機体が逆さまになっている（逆さ走行）
+            Return:
+                frame, target_x_percent, order, red_area
+            """
             self._frame_count += 1
 
             try:
-                # 1. フレーム取得 & 前処理
-                frame_raw = self.picam2.capture_array()
-                
+                # 1. 前処理
                 # 【修正】ユーザーさんの環境で正しく表示された条件に直しました！
                 # 逆さ走行時(True)だけ回転させて正立へ、通常時(False)はそのまま
                 if is_inverted:
@@ -147,10 +316,14 @@ class Camera:
                 if frame.shape[2] == 4:
                     frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
 
+                if self.keep_raw:
+                    self.last_raw = frame.copy()
+
                 height, width = frame.shape[:2]
                 frame_center_x = width // 2
 
                 # 2. 赤色検出
+                t_color = profiler.mark()
                 hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
                 mask1 = cv2.inRange(hsv, self.hsv_min1, self.hsv_max1)
                 mask2 = cv2.inRange(hsv, self.hsv_min2, self.hsv_max2)
@@ -175,16 +348,21 @@ class Camera:
                         red_center_y = red_rect[1] + red_rect[3] // 2
 
                 red_percent = red_area / float(width * height)
+                profiler.record("camera.color", t_color)
 
                 camera_order = 0
                 target_x_percent = 0.0
                 detected_center_x = red_center_x
                 detected_center_y = red_center_y
+                source = "none"
 
                 # --- 判定ロジック ---
 
                 if red_percent > 0.3:
                     camera_order = 4
+                    source = "color"
+                    if self.tracker is not None:
+                        self.tracker.reset()
                     cv2.rectangle(frame, (red_rect[0], red_rect[1]), 
                                 (red_rect[0] + red_rect[2], red_rect[1] + red_rect[3]), (0, 0, 255), 2)
 
@@ -193,17 +371,51 @@ class Camera:
                     target_x_percent = (red_center_x - frame_center_x) / float(width)
                     target_x_percent = max(-0.5, min(0.5, target_x_percent))
                     camera_order = self._decide_direction(target_x_percent)
+                    source = "color"
+                    # 赤が十分大きい矩形は確定扱いとしてトラッカーに渡す（描画前の画像で）
+                    if self.tracker is not None:
+                        self.tracker.init(frame, red_rect)
+                        self.track_conf = 1.0
                     cv2.rectangle(frame, (red_rect[0], red_rect[1]), 
                                 (red_rect[0] + red_rect[2], red_rect[1] + red_rect[3]), (0, 0, 255), 2)
 
                 else:
+                    # ★ まずトラッカーで前回の確定矩形を引き継ぐ
+                    tracked = False
+                    if self.tracker is not None and self.tracker.active:
+                        with profiler.span("camera.track"):
+                            box, self.track_conf = self.tracker.update(frame, red_area=red_area)
+                        if box is not None:
+                            tx, ty, tw, th = box
+                            track_center_x = tx + tw // 2
+                            track_center_y = ty + th // 2
+
+                            target_x_percent = (track_center_x - frame_center_x) / float(width)
+                            target_x_percent = max(-0.5, min(0.5, target_x_percent))
+                            camera_order = self._decide_direction(target_x_percent)
+                            tracked = True
+                            source = "track"
+
+                            detected_center_x = track_center_x
+                            detected_center_y = track_center_y
+
+                            cv2.rectangle(frame, (tx, ty), (tx + tw, ty + th), (0, 255, 255), 2)
+                            cv2.putText(frame, f"track {self.track_conf:.2f}",
+                                        (tx, max(0, ty - 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
+                        else:
+                            # 信頼度が落ちたので、次はYOLOを即実行する
+                            self._force_detect = True
+
                     yolo_found = False
-                    run_yolo = (self.model is not None and (self._frame_count % self.yolo_every == 0)
+                    run_yolo = (not tracked and self.model is not None
+                                and (self._force_detect or self._frame_count % self.yolo_every == 0)
                                 and (self.yolo_red_min <= red_percent < self.yolo_red_max))
 
                     if run_yolo:
+                        self._force_detect = False
                         try:
-                            results = self.model.predict(frame, save=False, show=False, verbose=False)
+                            with profiler.span("camera.yolo"):
+                                results = self.model.predict(frame, save=False, show=False, verbose=False)
                             if results and len(results) > 0:
                                 result = results[0]
                                 if result.boxes is not None and len(result.boxes) > 0:
@@ -232,37 +444,49 @@ class Camera:
                                         target_x_percent = max(-0.5, min(0.5, target_x_percent))
                                         camera_order = self._decide_direction(target_x_percent)
                                         yolo_found = True
+                                        source = "yolo"
                                         
                                         detected_center_x = yolo_center_x
                                         detected_center_y = yolo_center_y
 
+                                        # YOLOで確定した矩形からトラッカーを再開（描画前の画像で）
+                                        if self.tracker is not None:
+                                            self.tracker.init(frame, (xmin, ymin, xmax - xmin, ymax - ymin))
+                                            self.track_conf = conf
+
                                         cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (255, 0, 0), 2)
                                         cv2.putText(frame, f"{self.yolo_target_class} {conf:.2f}", 
                                                     (xmin, max(0, ymin - 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
                         except Exception as e:
                             if self.debug: print(f"YOLO Error: {e}")
 
-                    if (not yolo_found) and (red_percent > 0.001):
+                    if (not tracked) and (not yolo_found) and (red_percent > 0.001):
                         # orderの反転は行わず、純粋なカメラ視点の方向を取得
                         target_x_percent = (red_center_x - frame_center_x) / float(width)
                         target_x_percent = max(-0.5, min(0.5, target_x_percent))
                         camera_order = self._decide_direction(target_x_percent)
+                        source = "color"
                         cv2.rectangle(frame, (red_rect[0], red_rect[1]), 
                                     (red_rect[0] + red_rect[2], red_rect[1] + red_rect[3]), (0, 0, 255), 2)
 
-                    if red_percent <= 0.001 and not yolo_found:
+                    if red_percent <= 0.001 and not yolo_found and not tracked:
                         camera_order = 0
 
                 inv_str = "INV" if is_inverted else "NRM"
                 info = f"Ord:{camera_order} {inv_str} X:{target_x_percent:.2f}"
                 cv2.putText(frame, info, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
 
-                if make_csv:
+                self.last_center = (detected_center_x, detected_center_y)
+                self.last_source = source
+
+                if make_csv and self.log_csv:
                     try:
                         make_csv.print('camera_order', camera_order)
                         make_csv.print('camera_area', red_area)
                         make_csv.print('camera_center', (detected_center_x, detected_center_y))
                         make_csv.print('camera_frame_size', (width, height))
+                        if self.tracker is not None:
+                            make_csv.print('camera_track_conf', self.track_conf)
                     except Exception:
                         pass
 
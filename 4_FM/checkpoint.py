@@ -0,0 +1,105 @@
+# Mission checkpoint for CanSat SC-28
+# - 再起動（クラッシュ・電源断）から続きに戻れるよう、ミッションの状態を小さなJSONに保存する
+# - 書き込みは 一時ファイル → fsync → os.replace なので、途中で電源が落ちても前回か今回のどちらかが必ず残る
+# - 読み込みでは版・保存時刻・ゴール座標を確かめ、合わなければ使わない（前日の試験の残りで再開しない）
+# - 保存時の起動ID（/proc/sys/kernel/random/boot_id）も残す。Pi ごと再起動した後（電源断・ウォッチドッグ）も
+#   フェーズからは再開するが、same_boot が False なら位置に関わる値（最後の測位・進行方向）は呼び出し側で捨てる
+#
+# 使い方:
+#   checkpoint.save(path, {"phase": 3, "qnh": 1009.8, ...})
+#   state = checkpoint.load(path, max_age=6 * 3600, goal=(lat, lon))   # 使えなければ None
+#   checkpoint.clear(path)                                              # ミッションを終えたら消す
+
+import os
+import json
+import time
+
+VERSION = 2
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def boot_id():
+    """今の起動のID（読めなければ None）"""
+    try:
+        with open(BOOT_ID_PATH) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def save(path, state):
+    """state(dict) を原子的に書き込む。失敗したら False"""
+    data = dict(state)
+    data["version"] = VERSION
+    data["saved_at"] = time.time()
+    data["boot_id"] = boot_id()
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        # 置き換え（ディレクトリのエントリ）も確実にディスクへ
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Warning: checkpoint save failed: {e}")
+        return False
+
+
+def load(path, max_age=None, goal=None):
+    """
+    保存された状態を読む。無い・壊れている・古い・ゴールが違うときは None
+    max_age: 保存からこの秒数より古ければ使わない
+             同じ起動の中で保存時刻が今より後なら時計がおかしいので使わない
+             （別の起動なら、RTCの無いPiは再起動で時計が戻ることがあるので未来の時刻も受け入れる）
+    goal: (lat, lon)。保存時のゴール座標と違えば別のミッションとみなす
+    戻り値には age（保存からの秒数）と same_boot（保存時と同じ起動か）を加える
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Warning: checkpoint unreadable ({e}). Starting from phase 1.")
+        return None
+
+    if not isinstance(data, dict) or data.get("version") != VERSION or not isinstance(data.get("phase"), int):
+        print("Warning: checkpoint format mismatch. Starting from phase 1.")
+        return None
+    current = boot_id()
+    same_boot = current is not None and data.get("boot_id") == current
+    age = time.time() - data.get("saved_at", 0.0)
+    if age < 0 and same_boot:
+        print(f"checkpoint is from the future ({-age:.0f}s). Starting from phase 1.")
+        return None
+    if max_age is not None and age > max_age:
+        print(f"checkpoint is {age:.0f}s old. Starting from phase 1.")
+        return None
+    if goal is not None and data.get("goal") is not None:
+        if any(abs(a - b) > 1e-7 for a, b in zip(goal, data["goal"])):
+            print("checkpoint is for another goal. Starting from phase 1.")
+            return None
+    data["age"] = max(0.0, age)
+    data["same_boot"] = same_boot
+    return data
+
+
+def clear(path):
+    """チェックポイントを消す（次の起動はフェーズ1から）"""
+    for p in (path, f"{path}.tmp"):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: checkpoint clear failed: {e}")
@@ -0,0 +1,213 @@
+# Offline detector replay for CanSat SC-28
+# - 5_log/picture/run_* の保存画像を Camera.detect() に流し、実機なしで判定結果を再現する
+# - runごとにプロセスプールへ投げる（runの中はトラッカー/YOLO間引きの状態があるので順番に処理）
+# - 画像ごとの camera_order, red_area, 中心座標, 処理時間を表(CSV)にまとめる
+# - 2つの設定(--config-a / --config-b)を比較し、判定が変わった画像と処理時間の差を表示する
+#
+# 使い方:
+#   python3 detector_replay.py                                  # 色検出のみ・既定パラメータ
+#   python3 detector_replay.py --config-b tuned.json --out replay.csv
+#   python3 detector_replay.py --runs run_20260306_141437 --workers 4
+#
+# 設定ファイルは Camera() のキーワード引数をそのまま書いたJSON
+#   例: {"model_path": "./my_custom_model.pt", "yolo_every": 1, "use_tracker": false}
+# ※ model_path を書かなければYOLOは使わない（色検出＋トラッカーのみ）
+
+import os
+import csv
+import glob
+import json
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+DEFAULT_PIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "5_log", "picture")
+
+RESULT_COLUMNS = [
+    "config", "run", "image", "camera_order", "red_area", "center_x", "center_y",
+    "target_x_percent", "source", "time_ms",
+]
+
+
+def list_runs(pic_dir, names=None):
+    """run_* フォルダを古い順に返す（names指定時はその名前だけ）"""
+    runs = sorted(d for d in glob.glob(os.path.join(pic_dir, "run_*")) if os.path.isdir(d))
+    if names:
+        wanted = set(names)
+        runs = [d for d in runs if os.path.basename(d) in wanted]
+    return runs
+
+
+def list_images(run_dir):
+    """
+    runの画像を撮影順に返す
+    注釈前の raw_*.jpg があればそちらを使う（img_*.jpg は枠や文字が描き込まれていて赤検出が狂うため）
+    """
+    raw = sorted(glob.glob(os.path.join(run_dir, "raw_*.jpg")))
+    if raw:
+        return raw, True
+    return sorted(glob.glob(os.path.join(run_dir, "img_*.jpg"))), False
+
+
+def load_config(path):
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        cfg = json.load(f)
+    if not isinstance(cfg, dict):
+        raise ValueError(f"{path}: config must be a JSON object")
+    return cfg
+
+
+def _replay_run(job):
+    """プロセスプールのワーカー: 1つのrunを先頭から順に判定する"""
+    config_name, config, run_dir, images = job
+
+    from camera import Camera
+
+    kwargs = {"model_path": None}
+    kwargs.update(config)
+    kwargs["use_camera"] = False
+    kwargs["log_csv"] = False
+    cam = Camera(**kwargs)
+
+    run = os.path.basename(run_dir)
+    rows = []
+    for path in images:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        t0 = time.perf_counter()
+        _, x_pct, order, area = cam.detect(img, is_inverted=False)
+        dt_ms = (time.perf_counter() - t0) * 1000.0
+        rows.append({
+            "config": config_name,
+            "run": run,
+            "image": os.path.basename(path),
+            "camera_order": int(order),
+            "red_area": float(area),
+            "center_x": int(cam.last_center[0]),
+            "center_y": int(cam.last_center[1]),
+            "target_x_percent": round(float(x_pct), 4),
+            "source": cam.last_source,
+            "time_ms": round(dt_ms, 3),
+        })
+    return rows
+
+
+def replay(configs, runs, workers=None):
+    """
+    configs: {名前: Camera引数dict}
+    runs: run フォルダのリスト
+    Return: 結果行のリスト
+    """
+    jobs = []
+    for run_dir in runs:
+        images, is_raw = list_images(run_dir)
+        if not images:
+            continue
+        if not is_raw:
+            print(f"Warning: {os.path.basename(run_dir)} has only annotated img_*.jpg (no raw_*.jpg)")
+        for name, cfg in configs.items():
+            jobs.append((name, cfg, run_dir, images))
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(_replay_run, jobs):
+            rows.extend(result)
+    return rows
+
+
+def write_results(rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def summarize(rows, name):
+    sel = [r for r in rows if r["config"] == name]
+    if not sel:
+        print(f"[{name}] no images")
+        return
+    times = np.array([r["time_ms"] for r in sel])
+    orders = Counter(r["camera_order"] for r in sel)
+    sources = Counter(r["source"] for r in sel)
+    print(f"[{name}] images={len(sel)}  time_ms mean={times.mean():.2f} "
+          f"p50={np.percentile(times, 50):.2f} p95={np.percentile(times, 95):.2f} max={times.max():.2f}")
+    print("    order : " + ", ".join(f"{k}={orders.get(k, 0)}" for k in range(5)))
+    print("    source: " + ", ".join(f"{k}={v}" for k, v in sorted(sources.items())))
+
+
+def diff(rows, name_a, name_b, show=20):
+    """2つの設定の判定を画像ごとに比較する"""
+    a = {(r["run"], r["image"]): r for r in rows if r["config"] == name_a}
+    b = {(r["run"], r["image"]): r for r in rows if r["config"] == name_b}
+    keys = sorted(set(a) & set(b))
+    if not keys:
+        return
+
+    confusion = np.zeros((5, 5), dtype=int)
+    changed = []
+    for k in keys:
+        oa, ob = a[k]["camera_order"], b[k]["camera_order"]
+        confusion[oa, ob] += 1
+        if oa != ob:
+            changed.append(k)
+
+    print(f"\n=== diff {name_a} -> {name_b}: {len(changed)}/{len(keys)} images changed order ===")
+    print("      " + " ".join(f"{name_b}={j}".rjust(6) for j in range(5)))
+    for i in range(5):
+        print(f"{name_a}={i}".ljust(6) + " ".join(f"{confusion[i, j]:6d}" for j in range(5)))
+
+    ta = np.array([a[k]["time_ms"] for k in keys])
+    tb = np.array([b[k]["time_ms"] for k in keys])
+    print(f"time_ms mean: {ta.mean():.2f} -> {tb.mean():.2f} ({tb.mean() - ta.mean():+.2f})")
+
+    for k in changed[:show]:
+        print(f"  {k[0]}/{k[1]}: order {a[k]['camera_order']} ({a[k]['source']}) "
+              f"-> {b[k]['camera_order']} ({b[k]['source']})")
+    if len(changed) > show:
+        print(f"  ... and {len(changed) - show} more")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay saved pictures through Camera detection offline")
+    parser.add_argument("--pic-dir", default=DEFAULT_PIC_DIR, help="5_log/picture directory")
+    parser.add_argument("--runs", nargs="*", help="run_* folder names to replay (default: all)")
+    parser.add_argument("--config-a", help="JSON of Camera kwargs for config A (default: built-in)")
+    parser.add_argument("--config-b", help="JSON of Camera kwargs for config B (enables diff)")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+    parser.add_argument("--out", help="write per-image results to this CSV")
+    args = parser.parse_args()
+
+    configs = {"A": load_config(args.config_a)}
+    if args.config_b:
+        configs["B"] = load_config(args.config_b)
+
+    runs = list_runs(args.pic_dir, args.runs)
+    if not runs:
+        print(f"No run_* folders found in {args.pic_dir}")
+        return
+
+    t0 = time.perf_counter()
+    rows = replay(configs, runs, workers=args.workers)
+    elapsed = time.perf_counter() - t0
+    print(f"Replayed {len(rows)} detections from {len(runs)} runs in {elapsed:.1f}s")
+
+    for name in configs:
+        summarize(rows, name)
+    if "B" in configs:
+        diff(rows, "A", "B")
+
+    if args.out:
+        write_results(rows, args.out)
+        print(f"Results written: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
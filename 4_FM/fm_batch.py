@@ -0,0 +1,317 @@
+# Monte Carlo batch runner for CanSat SC-28
+# - fm_sim のミッションを、条件をランダムに変えながらプロセスプールで何百〜何千回も回す
+#   * 風: パラシュート降下中に流される距離と向き
+#   * GPS: 白色雑音・ゆっくり動く誤差・無効な測位の確率
+#   * 地面: スタックのしやすさ、旋回時の横滑り、逆さま着地
+#   * センサー故障: BME280 / BNO055 が応答しない
+# - 同じ seed なら同じ条件になる（設定を変えて比べるときは、どの設定も同じ条件の組で走らせる）
+# - FM.py の定数（HANDOVER_DISTANCE や FallPhase.LAND_HOLD など）を --set で変えたり、--sweep で振ったりできる
+# - 設定ごとに成功率・ゴールまでの時間・最終距離の分布をまとめて表示し、1回ごとの結果をCSVに書く
+#
+# 使い方:
+#   python3 fm_batch.py --runs 200
+#   python3 fm_batch.py --runs 100 --sweep HANDOVER_DISTANCE=6,8,10,12 --out sweep.csv
+#   python3 fm_batch.py --runs 50 --sweep WaitPhase.LAUNCH_HOLD=0.5,1 --sweep FallPhase.LAND_VZ=0.3,0.5,1.0
+#   python3 fm_batch.py --runs 100 --set GPS_CONTINUOUS=False --workers 8
+#
+# ※ fm_sim は1プロセス1回しか動かせないので、ワーカーは1回ごとに作り直す（max_tasks_per_child=1）
+
+import os
+import csv
+import math
+import time
+import random
+import shutil
+import argparse
+import itertools
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+RESULT_COLUMNS = [
+    "config", "seed", "goal", "goal_reason", "mission_time", "final_distance", "odometer",
+    "landed_at", "inverted", "stuck_events", "wind_speed", "wind_dir", "gps_sigma", "gps_bias",
+    "gps_dropout", "stuck_rate", "skid", "fault", "phases", "wall_time", "error",
+]
+
+
+# ==========================================
+# 条件の生成
+# ==========================================
+def sample_scenario(seed, distance=(30.0, 150.0), wind_max=8.0, p_inverted=0.2, p_fault=0.05):
+    """
+    seed から1回分の条件を作る
+    Return: (SimWorld のキーワード引数, その他の条件の dict)
+    """
+    rng = random.Random(seed * 7919 + 17)
+    apogee = rng.uniform(30.0, 100.0)
+    descent_rate = rng.uniform(4.0, 7.0)
+
+    # 風がなければ着地するはずだった点に、降下中に流された分を足す
+    wind_speed = rng.uniform(0.0, wind_max)
+    wind_dir = rng.uniform(0.0, 360.0)      # 風が吹いていく方位
+    drift = wind_speed * apogee / descent_rate
+    d0 = rng.uniform(*distance)
+    b0 = rng.uniform(0.0, 360.0)
+    x = d0 * math.sin(math.radians(b0)) + drift * math.sin(math.radians(wind_dir))
+    y = d0 * math.cos(math.radians(b0)) + drift * math.cos(math.radians(wind_dir))
+
+    fault = None
+    r = rng.random()
+    if r < p_fault:
+        fault = "bme280"
+    elif r < 2 * p_fault:
+        fault = "bno055"
+
+    world_kwargs = {
+        "seed": seed,
+        "distance": math.hypot(x, y),
+        "bearing": math.degrees(math.atan2(x, y)) % 360.0,
+        "apogee": apogee,
+        "descent_rate": descent_rate,
+        "p_inverted": p_inverted,
+        "stuck_rate": rng.uniform(0.0, 0.02),
+        "gps_sigma": rng.uniform(0.3, 2.0),
+        "gps_bias": rng.uniform(0.5, 4.0),
+        "gps_dropout": rng.uniform(0.0, 0.1),
+    }
+    extra = {
+        "wind_speed": wind_speed,
+        "wind_dir": wind_dir,
+        "skid": rng.uniform(0.2, 0.5),
+        "fault": fault,
+    }
+    return world_kwargs, extra
+
+
+# ==========================================
+# 設定（FM.py の定数の上書き）
+# ==========================================
+def _parse_value(text):
+    for conv in (int, float):
+        try:
+            return conv(text)
+        except ValueError:
+            pass
+    if text in ("True", "False", "None"):
+        return {"True": True, "False": False, "None": None}[text]
+    return text
+
+
+def parse_assignment(text):
+    """'NAME=1,2,3' -> ('NAME', [1, 2, 3])"""
+    if "=" not in text:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE: {text}")
+    name, values = text.split("=", 1)
+    return name.strip(), [_parse_value(v.strip()) for v in values.split(",") if v.strip()]
+
+
+def build_configs(sets, sweeps):
+    """--set は全設定に、--sweep は組み合わせの数だけ設定を作る。Return: [(名前, {NAME: value})]"""
+    base = {name: values[-1] for name, values in sets}
+    if not sweeps:
+        return [("base", base)]
+    configs = []
+    names = [name for name, _ in sweeps]
+    for combo in itertools.product(*[values for _, values in sweeps]):
+        overrides = dict(base)
+        overrides.update(zip(names, combo))
+        configs.append((" ".join(f"{n}={v}" for n, v in zip(names, combo)), overrides))
+    return configs
+
+
+def apply_overrides(FM, overrides):
+    """'NAME' は FM のモジュール定数、'Class.NAME' はフェーズのクラス属性"""
+    for name, value in overrides.items():
+        obj = FM
+        parts = name.split(".")
+        for part in parts[:-1]:
+            obj = getattr(obj, part)
+        if not hasattr(obj, parts[-1]):
+            raise AttributeError(f"FM has no attribute {name}")
+        setattr(obj, parts[-1], value)
+
+
+# ==========================================
+# 1回分（ワーカープロセス）
+# ==========================================
+def _quiet_worker():
+    """ワーカーの標準出力を捨てる（終了時の atexit やデストラクタの表示も含めて）"""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+
+def _run_one(job):
+    index, config_name, overrides, seed, scenario, time_limit, log_dir = job
+    world_kwargs, extra = scenario
+    row = {"config": config_name, "seed": seed}
+    row.update({k: world_kwargs[k] for k in ("gps_sigma", "gps_bias", "gps_dropout", "stuck_rate")})
+    row.update(extra)
+    wall0 = time.perf_counter()
+    try:
+        import fm_sim
+
+        world = fm_sim.SimWorld(**world_kwargs)
+        world.skid = extra["skid"]
+        world.name = f"c{index}_{seed}"
+
+        def on_import(FM, clock):
+            apply_overrides(FM, overrides)
+            if extra["fault"] == "bme280":
+                fm_sim._SIM.devices.pop(fm_sim.BME280_ADDR, None)
+            elif extra["fault"] == "bno055":
+                fm_sim._SIM.devices.pop(fm_sim.BNO055_ADDR, None)
+
+        r = fm_sim.run(world, time_limit=time_limit, log_dir=log_dir, quiet=True, on_import=on_import)
+        row.update({k: r[k] for k in ("goal", "goal_reason", "mission_time", "final_distance", "odometer",
+                                      "landed_at", "inverted", "stuck_events")})
+        row["phases"] = " ".join(f"{n}@{t:.0f}" for t, n in r["timeline"])
+    except BaseException as e:      # ワーカーで何が起きても1回分の失敗として数える
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["wall_time"] = time.perf_counter() - wall0
+    return row
+
+
+# ==========================================
+# 集計
+# ==========================================
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(math.floor(k)), int(math.ceil(k))
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _wilson(k, n, z=1.96):
+    """成功率の95%信頼区間"""
+    if n == 0:
+        return 0.0, 0.0
+    p = k / n
+    d = 1 + z * z / n
+    c = (p + z * z / (2 * n)) / d
+    h = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / d
+    return max(0.0, c - h), min(1.0, c + h)
+
+
+def summarize(rows):
+    """設定ごとの集計。Return: {config: dict}"""
+    by_config = {}
+    for row in rows:
+        by_config.setdefault(row["config"], []).append(row)
+    out = {}
+    for name, rs in by_config.items():
+        n = len(rs)
+        ok = [r for r in rs if r.get("goal")]
+        times = [r["mission_time"] for r in ok if r.get("mission_time") is not None]
+        dists = [r["final_distance"] for r in rs if r.get("final_distance") is not None]
+        out[name] = {
+            "runs": n,
+            "success": len(ok),
+            "ci": _wilson(len(ok), n),
+            "time": [_percentile(times, q) for q in (0.1, 0.5, 0.9)],
+            "distance": [_percentile(dists, q) for q in (0.5, 0.9)] + [max(dists) if dists else None],
+            "reasons": Counter(r.get("goal_reason") for r in ok),
+            "errors": sum(1 for r in rs if r.get("error")),
+            "failed_faults": Counter(r.get("fault") or "-" for r in rs if not r.get("goal")),
+        }
+    return out
+
+
+def format_summary(summary):
+    def f(v, fmt="{:.0f}"):
+        return "-" if v is None else fmt.format(v)
+
+    lines = []
+    for name, s in summary.items():
+        rate = s["success"] / s["runs"] if s["runs"] else 0.0
+        lines.append(f"[{name}]")
+        lines.append(f"  success      : {s['success']}/{s['runs']} = {rate * 100:.1f}% "
+                     f"(95% CI {s['ci'][0] * 100:.1f}-{s['ci'][1] * 100:.1f}%)")
+        lines.append("  time to goal : p10 {}s / p50 {}s / p90 {}s".format(*[f(v) for v in s["time"]]))
+        lines.append("  final dist   : p50 {}m / p90 {}m / max {}m".format(*[f(v, "{:.1f}") for v in s["distance"]]))
+        if s["reasons"]:
+            lines.append("  goal by      : " + ", ".join(f"{k}={v}" for k, v in s["reasons"].most_common()))
+        if s["runs"] > s["success"]:
+            lines.append("  failures     : " + ", ".join(f"fault {k}={v}" for k, v in s["failed_faults"].most_common()))
+        if s["errors"]:
+            lines.append(f"  errors       : {s['errors']}")
+    return "\n".join(lines)
+
+
+# ==========================================
+# 実行
+# ==========================================
+def run_batch(configs, seeds, workers=None, time_limit=1800.0, log_dir=None, scenario_kwargs=None, progress=True):
+    """全設定 × 全seed を回して1回ごとの結果(dict)のリストを返す"""
+    scenarios = {seed: sample_scenario(seed, **(scenario_kwargs or {})) for seed in seeds}
+    jobs = [(i, name, overrides, seed, scenarios[seed], time_limit, log_dir)
+            for i, (name, overrides) in enumerate(configs) for seed in seeds]
+    rows = []
+    wall0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1, initializer=_quiet_worker) as pool:
+        futures = [pool.submit(_run_one, job) for job in jobs]
+        for i, future in enumerate(as_completed(futures), 1):
+            rows.append(future.result())
+            if progress and (i % 10 == 0 or i == len(jobs)):
+                print(f"  {i}/{len(jobs)} runs ({time.perf_counter() - wall0:.0f}s)", flush=True)
+    rows.sort(key=lambda r: (r["config"], r["seed"]))
+    return rows
+
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many simulated missions with randomized conditions")
+    parser.add_argument("--runs", type=int, default=100, help="missions per config")
+    parser.add_argument("--seed", type=int, default=0, help="first seed")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--set", type=parse_assignment, action="append", default=[], metavar="NAME=VALUE",
+                        help="override an FM constant for every config (e.g. HANDOVER_DISTANCE=8)")
+    parser.add_argument("--sweep", type=parse_assignment, action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="run every combination of these values (repeatable)")
+    parser.add_argument("--min-distance", type=float, default=30.0, help="[m]")
+    parser.add_argument("--max-distance", type=float, default=150.0, help="[m]")
+    parser.add_argument("--wind-max", type=float, default=8.0, help="max wind speed during descent [m/s]")
+    parser.add_argument("--inverted", type=float, default=0.2, help="probability of landing upside down")
+    parser.add_argument("--fault-rate", type=float, default=0.05, help="probability of each sensor fault")
+    parser.add_argument("--time-limit", type=float, default=1800.0, help="virtual time limit per mission [s]")
+    parser.add_argument("--out", help="write one row per mission to this CSV")
+    parser.add_argument("--keep-logs", help="keep the flight CSV logs and pictures in this directory")
+    args = parser.parse_args()
+
+    configs = build_configs(args.set, args.sweep)
+    seeds = list(range(args.seed, args.seed + args.runs))
+    scenario_kwargs = {
+        "distance": (args.min_distance, args.max_distance),
+        "wind_max": args.wind_max,
+        "p_inverted": args.inverted,
+        "p_fault": args.fault_rate,
+    }
+    log_dir = args.keep_logs or tempfile.mkdtemp(prefix="fm_batch_")
+    print(f"{len(configs)} config(s) x {len(seeds)} runs = {len(configs) * len(seeds)} missions")
+
+    wall0 = time.perf_counter()
+    try:
+        rows = run_batch(configs, seeds, workers=args.workers, time_limit=args.time_limit,
+                         log_dir=log_dir, scenario_kwargs=scenario_kwargs)
+    finally:
+        if not args.keep_logs:
+            shutil.rmtree(log_dir, ignore_errors=True)
+    print(f"done in {time.perf_counter() - wall0:.0f}s\n")
+
+    print(format_summary(summarize(rows)))
+    if args.out:
+        write_csv(args.out, rows)
+        print(f"\nresults: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
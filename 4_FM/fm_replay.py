@@ -0,0 +1,587 @@
+# Mission replay for CanSat SC-28
+# - 5_log/csv の実機ログに記録されたセンサー値を、ドライバの入口から FM.main() に流し直して判断ロジックを再実行する
+#   * BME280  : press（無ければ alt から逆算）と temp を I2C レジスタで返す（ドライバの補正式もそのまま通る）
+#   * BNO055  : euler / grav / gyro / accel_line を I2C レジスタで返す
+#   * 高度フィルタ: 毎回記録された press / accel_up を BME280Sensor.pressure() / altitude_filter.vertical_accel() の
+#              戻り値として、alt_base_press を BME280Sensor.baseline() の戻り値として返す
+#              （I2C の量子化を通さないので、フィルタには記録時とまったく同じ入力が同じ順に入る）
+#   * GPS     : N回目の gps.idokeido() に、記録の N回目の読み取り結果（nmea 列の文か NO_FIX）を返す
+#              （nmea 列の無い古いログでは lat / lon の記録を順に返す）
+#   * カメラ  : N回目の Camera.capture_and_detect() に、記録の N回目の camera_order / area / center / frame_size を返す
+#              （画像は残っていないので、検出結果を差し込む）
+#   GPS とカメラは記録された時刻より早くは返さない（読み取りを待った時間も記録どおりになる）
+# - それ以外のセンサー値は、ログの time 列（monotonic）で記録された時刻から次の記録まで保持する（0次ホールド）
+#   最初のフェーズに入った時刻でログと再生の時刻を揃える
+# - 再生した結果のCSVを元のログと比べ、フェーズ遷移（順番と時刻）とモーター指令の一致度を表示する
+#   差があれば終了コード1（ロジックを変えたときの回帰テスト用）
+# - 仮想時計は fm_sim と同じ。--speed を指定しなければ最速で、1 なら記録どおりの速さで再生する
+# - --self-test: fm_sim で1回飛ばしたログをそのまま再生し、一致すること（PASS）を確かめる
+#
+# 使い方:
+#   python3 fm_replay.py ../5_log/csv/log_20260307_014628.csv
+#   python3 fm_replay.py ../5_log/csv/log_20260306_141437.csv --start-phase 4 --quiet
+#   python3 fm_replay.py LOG --speed 1 --out-dir /tmp/replay --tolerance 3
+#   python3 fm_replay.py --self-test --seed 3
+#
+# ※ 0次ホールドのセンサーは、ロジックが記録時と違うタイミングで読むと直前の値を返す。古いプログラム(3_EM など)のログでは読み取りの種類が足りず、差が出るのは当然なので
+#   --start-phase で比べたいフェーズから始めるとよい
+# ※ fm_sim と同じく、1プロセスで1回だけ実行できる
+
+import os
+import sys
+import csv
+import math
+import time
+import argparse
+import tempfile
+import contextlib
+import subprocess
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import numpy as np
+import pynmea2
+
+import fm_sim
+
+VECTOR_TYPES = ("euler", "grav", "gyro", "accel_line")
+SCALAR_TYPES = ("press", "alt", "temp", "accel_up")
+
+GPS_MAX_AGE = 5.0       # これより古い lat/lon は無効な測位として返す [s]（記録を使い切った後の偽GPS）
+NO_FIX = "NO_FIX"       # gps.NO_FIX と同じ（測位が取れなかった読み取り）
+MOTOR_GRID = 0.1        # モーター指令を比べる時間刻み [s]
+SELF_TEST_LIMIT = 900.0 # --self-test で飛ばす時間の上限 [s]
+SAMPLE_MAX_AGE = 0.01   # 高度フィルタの入力はこの時間内に書かれた記録だけ使う [s]（同じ読み取りの値。無ければ読めなかった）
+TIME_EPS = 1e-6         # 再生の時刻を戻すときの丸め誤差の余裕 [s]（同じ時刻に読んで書いた値を取りこぼさない）
+
+
+# ==========================================
+# ログの読み込み
+# ==========================================
+def _float(value):
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return None
+    return v if math.isfinite(v) else None
+
+
+class Series:
+    """時刻順の (t, value) 列。at(t) は t 以前で最後の値を返す"""
+    def __init__(self):
+        self.times = []
+        self.values = []
+
+    def add(self, t, value):
+        self.times.append(t)
+        self.values.append(value)
+
+    def __len__(self):
+        return len(self.times)
+
+    def at(self, t, default=None, max_age=None, backfill=True):
+        """
+        max_age: これより古い値なら default
+        backfill: 最初の記録より前なら最初の値を返す（False なら default）
+        """
+        i = bisect_right(self.times, t)
+        if i == 0:
+            return self.values[0] if (backfill and self.values) else default
+        if max_age is not None and t - self.times[i - 1] > max_age:
+            return default
+        return self.values[i - 1]
+
+
+def _parse_fix(line):
+    """nmea 列の文を gps.read_gps_data() と同じく (lat, lon) にする（NO_FIX・読めない文は None）"""
+    if line == NO_FIX:
+        return None
+    try:
+        msg = pynmea2.parse(line)
+        return float(msg.latitude), float(msg.longitude)
+    except (pynmea2.ParseError, AttributeError, TypeError, ValueError):
+        return None
+
+
+class RecordedLog:
+    """make_csv のログ1本を種類ごとの時系列にしたもの"""
+    def __init__(self, path):
+        self.path = path
+        self.t0 = None
+        self.t_end = None
+        self.date0 = None
+        self.series = {name: Series() for name in SCALAR_TYPES + VECTOR_TYPES + ("lat_lon",)}
+        self.qnh = None         # alt_base_press（高度の基準気圧）
+        self.phases = []        # [(t, phase)]
+        self.frames = []        # [dict(t, order, area, center, size)]（読んだ順）
+        self.gps_reads = []     # [(t, (lat, lon) か None, nmea の文)]（読んだ順）
+        self._fixes = []        # nmea 列の無い古いログ用: lat / lon の記録
+        # 行番号（同じ時刻に書かれた行の前後を区別する）
+        self.rows = 0
+        self.phase_rows = []
+        self.frame_rows = []
+        self.gps_rows = []
+        self._fix_rows = []
+        self.motor_cmds = []    # [(start, end, l, r)]（motor_cmd 行）
+        self.motor_rows = []    # [(t, l, r)]（motor 行）
+        self._load()
+        self._motor_times = [row[0] for row in self.motor_rows]
+
+    def _load(self):
+        with open(self.path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                t = _float(row.get("time"))
+                if t is None:
+                    continue
+                if self.t0 is None:
+                    self.t0 = t
+                    self.date0 = row.get("date") or None
+                self.t_end = t
+                self._add_row(t, row)
+                self.rows += 1
+        if not self.gps_reads:
+            self.gps_reads, self.gps_rows = self._fixes, self._fix_rows
+
+    def _add_row(self, t, row):
+        get = row.get
+        for name in SCALAR_TYPES:
+            v = _float(get(name))
+            if v is not None:
+                self.series[name].add(t, v)
+        for name in VECTOR_TYPES:
+            v = [_float(get(f"{name}_{a}")) for a in "xyz"]
+            if None not in v:
+                self.series[name].add(t, v)
+        lat, lon = _float(get("lat")), _float(get("lon"))
+        if lat is not None and lon is not None:
+            self.series["lat_lon"].add(t, (lat, lon))
+            self._fixes.append((t, (lat, lon), None))
+            self._fix_rows.append(self.rows)
+        line = get("nmea")
+        if line:
+            self.gps_reads.append((t, _parse_fix(line), line))
+            self.gps_rows.append(self.rows)
+
+        qnh = _float(get("alt_base_press"))
+        if qnh is not None and self.qnh is None:
+            self.qnh = qnh
+
+        phase = _float(get("phase"))
+        if phase is not None:
+            self.phases.append((t, int(phase)))
+            self.phase_rows.append(self.rows)
+
+        # カメラは1フレームを camera_order → area → center → frame_size の順に別々の行で書いている
+        order = _float(get("camera_order"))
+        if order is not None:
+            self.frames.append({"t": t, "order": int(order), "area": 0.0, "center": None, "size": None})
+            self.frame_rows.append(self.rows)
+        elif self.frames:
+            frame = self.frames[-1]
+            area = _float(get("camera_area"))
+            if area is not None:
+                frame["area"] = area
+            cx, cy = _float(get("camera_center_x")), _float(get("camera_center_y"))
+            if cx is not None and cy is not None:
+                frame["center"] = (cx, cy)
+            w, h = _float(get("camera_frame_size_x")), _float(get("camera_frame_size_y"))
+            if w is not None and h is not None:
+                frame["size"] = (int(w), int(h))
+
+        l, r = _float(get("motor_l")), _float(get("motor_r"))
+        if l is not None and r is not None:
+            start, duration = _float(get("motor_cmd_start")), _float(get("motor_cmd_duration"))
+            if start is not None and duration is not None:
+                self.motor_cmds.append((start, start + duration, l, r))
+            else:
+                self.motor_rows.append((t, l, r))
+
+    @property
+    def empty(self):
+        return self.t0 is None
+
+    def first_phase_time(self, number=None):
+        """最初に number のフェーズに入った時刻（number=None なら最初のフェーズ）"""
+        i = self._first_phase(number)
+        return None if i is None else self.phases[i][0]
+
+    def first_phase_row(self, number=None):
+        """最初に number のフェーズに入った行の番号"""
+        i = self._first_phase(number)
+        return None if i is None else self.phase_rows[i]
+
+    def _first_phase(self, number):
+        for i, (_, n) in enumerate(self.phases):
+            if number is None or n == number:
+                return i
+        return None
+
+    def motor_at(self, t):
+        """時刻 t のモーター指令 (左, 右)。記録が無ければ None"""
+        if self.motor_cmds:
+            value = (0.0, 0.0)
+            for start, end, l, r in self.motor_cmds:
+                if start > t:
+                    break
+                value = (l, r) if t <= end else (0.0, 0.0)
+            return value
+        if self.motor_rows:
+            i = bisect_right(self._motor_times, t)
+            return (0.0, 0.0) if i == 0 else self.motor_rows[i - 1][1:]
+        return None
+
+    @property
+    def has_motor(self):
+        return bool(self.motor_cmds or self.motor_rows)
+
+    def summary(self):
+        counts = [f"{name}={len(s)}" for name, s in self.series.items() if len(s)]
+        counts.append(f"camera={len(self.frames)}")
+        counts.append(f"gps_reads={len(self.gps_reads)}")
+        counts.append(f"motor={len(self.motor_cmds) or len(self.motor_rows)}")
+        return ", ".join(counts)
+
+
+# ==========================================
+# 記録値を返す世界
+# ==========================================
+class ReplayWorld(fm_sim.SimWorld):
+    """
+    fm_sim の偽ハードウェアが読む値を、物理モデルの代わりにログから返す
+    ロジック側の時刻 t とログの時刻は log_time = offset + t で対応させる
+    """
+    def __init__(self, log, gps_max_age=GPS_MAX_AGE):
+        super().__init__(seed=0, gps_dropout=0.0)
+        self.log = log
+        self.name = "replay_" + os.path.splitext(os.path.basename(log.path))[0].replace("log_", "", 1)
+        self.offset = log.t0
+        self.gps_max_age = gps_max_age
+        self.t_landed = 0.0
+        self.frames_read = 0
+        self.gps_read = 0
+        if log.date0:
+            try:
+                self.epoch = datetime.strptime(log.date0, "%Y-%m-%d %H:%M:%S.%f").timestamp()
+            except ValueError:
+                pass
+        self.temp = self._value("temp", 25.0)
+
+    def log_time(self):
+        return self.offset + self.t + TIME_EPS
+
+    def align(self, log_time, row=0):
+        """今の時刻をログの log_time に合わせる。row 行より前の GPS・カメラの読み取りは使わない"""
+        self.offset = log_time - self.t
+        self.frames_read = bisect_left(self.log.frame_rows, row)
+        self.gps_read = bisect_left(self.log.gps_rows, row)
+
+    def _value(self, name, default):
+        return self.log.series[name].at(self.log_time(), default)
+
+    # ----- 物理モデルの代わり -----
+    def step(self, dt):
+        self.t += dt
+        self.temp = self._value("temp", self.temp)
+        while self.t >= self._next_fix:
+            self._emit_nmea()
+
+    def pressure(self):
+        p = self._value("press", None)
+        if p is not None:
+            return p
+        alt = self._value("alt", 0.0)
+        return 1013.25 * (1.0 - alt / 44330.0) ** (1.0 / 0.1903)
+
+    def imu(self):
+        heading, roll, pitch = self._value("euler", (0.0, 0.0, 0.0))
+        gyro = list(self._value("gyro", (0.0, 0.0, 0.0)))
+        lin = list(self._value("accel_line", (0.0, 0.0, 0.0)))
+        grav = list(self._value("grav", (0.0, 0.0, 9.80665)))
+        return heading, roll, pitch, gyro, lin, grav
+
+    def gps_fix(self):
+        return self.log.series["lat_lon"].at(self.log_time(), None, max_age=self.gps_max_age, backfill=False)
+
+    def _wait_until(self, t_log):
+        """記録された時刻 t_log まで待つ（もう過ぎていれば待たない）"""
+        dt = t_log - self.log_time()
+        if dt > 0:
+            time.sleep(dt)
+
+    # ----- GPS -----
+    def next_gps_read(self):
+        """
+        N回目の GPS の読み取り結果 (lat, lon か None, nmea の文)
+        記録を使い切ったら、偽のシリアルから1回分読んだときと同じく1測位分待って None
+        """
+        reads = self.log.gps_reads
+        if self.gps_read >= len(reads):
+            time.sleep(1.0)
+            return None, NO_FIX
+        t, fix, line = reads[self.gps_read]
+        self.gps_read += 1
+        self._wait_until(t)
+        return fix, line
+
+    # ----- カメラ -----
+    def next_frame(self):
+        """N回目のカメラの検出結果（記録フレームの dict。記録を使い切ったら None）"""
+        frames = self.log.frames
+        if self.frames_read >= len(frames):
+            time.sleep(1.0 / fm_sim.FakePicamera2.FPS)
+            return None
+        frame = frames[self.frames_read]
+        self.frames_read += 1
+        self._wait_until(frame["t"])
+        return frame
+
+
+def _install_altitude(world):
+    """高度フィルタの入力を記録された値そのものに差し替える（記録の無い古いログではそのまま）"""
+    import altitude_filter
+    import bme280
+
+    log = world.log
+    if log.qnh is not None:
+        bme280.BME280Sensor.baseline = lambda self: log.qnh
+    if not len(log.series["accel_up"]):
+        return
+
+    # 同じ時刻に記録が無ければ、その読み取りは記録時に失敗している
+    def pressure(self):
+        return log.series["press"].at(world.log_time(), None, max_age=SAMPLE_MAX_AGE, backfill=False)
+
+    def vertical_accel(linear_acceleration, gravity):
+        return log.series["accel_up"].at(world.log_time(), None, max_age=SAMPLE_MAX_AGE, backfill=False)
+
+    bme280.BME280Sensor.pressure = pressure
+    altitude_filter.vertical_accel = vertical_accel
+
+
+def _install_gps(world):
+    """gps.idokeido() を記録された読み取り結果を順に返すものに差し替える"""
+    import gps
+
+    def idokeido():
+        fix, line = world.next_gps_read()
+        if line is not None:
+            gps.GPS._log_read(line)
+        return fix if fix is not None else (None, None)
+
+    gps.idokeido = idokeido
+
+
+def _install_camera(world):
+    """Camera.capture_and_detect() を記録された検出結果を返すものに差し替える"""
+    import camera
+
+    def capture_and_detect(self, is_inverted=False):
+        rec = world.next_frame()
+        w, h = (rec or {}).get("size") or (640, 480)
+        frame = np.zeros((h, w, 3), dtype=np.uint8)
+        if self.keep_raw:
+            self.last_raw = frame
+        if rec is None:
+            return frame, 0.0, 0, 0
+        x_pct = 0.0
+        if rec["center"] is not None:
+            x_pct = max(-0.5, min(0.5, (rec["center"][0] - w // 2) / float(w)))
+        if camera.make_csv and self.log_csv:
+            try:
+                camera.make_csv.print('camera_order', rec["order"])
+                camera.make_csv.print('camera_area', rec["area"])
+                if rec["center"] is not None:
+                    camera.make_csv.print('camera_center', rec["center"])
+                camera.make_csv.print('camera_frame_size', (w, h))
+            except Exception:
+                pass
+        return frame, x_pct, rec["order"], rec["area"]
+
+    camera.Camera.capture_and_detect = capture_and_detect
+
+
+# ==========================================
+# 比較
+# ==========================================
+def _maneuver(l, r, dead=0.05):
+    """(左, 右) を動きの種類にまとめる"""
+    if abs(l) < dead and abs(r) < dead:
+        return "stop"
+    if l > dead and r > dead and abs(l - r) < 0.5 * max(l, r):
+        return "forward"
+    if l < -dead and r < -dead and abs(l - r) < 0.5 * max(-l, -r):
+        return "backward"
+    return "left" if r > l else "right"
+
+
+def compare(ref, out, start_phase=None, tolerance=5.0, min_agreement=0.8):
+    """
+    元のログ(ref)と再生したログ(out)を、それぞれ start_phase に入った時刻を0として比べる
+    Return: dict(ok, phases_ref, phases_out, phase_ok, phase_errors, motor_ok, motor_agreement, motor_mae, motor_diffs, window)
+    """
+    a_ref = ref.first_phase_time(start_phase) or ref.t0
+    a_out = out.first_phase_time(start_phase) or out.t0
+    window = ref.t_end - a_ref
+
+    phases_ref = [(t - a_ref, n) for t, n in ref.phases if t >= a_ref]
+    phases_out = [(t - a_out, n) for t, n in out.phases if t >= a_out and t - a_out <= window]
+    seq_ok = [n for _, n in phases_ref] == [n for _, n in phases_out]
+    phase_errors = [(n, t_out - t_ref) for (t_ref, n), (t_out, _) in zip(phases_ref, phases_out)]
+    phase_ok = seq_ok and all(abs(dt) <= tolerance for _, dt in phase_errors)
+
+    result = {
+        "window": window,
+        "phases_ref": phases_ref,
+        "phases_out": phases_out,
+        "phase_ok": phase_ok,
+        "phase_errors": phase_errors,
+        "motor_agreement": None,
+        "motor_mae": None,
+        "motor_diffs": [],
+    }
+
+    end = min(window, out.t_end - a_out)
+    if ref.has_motor and out.has_motor and end > 0:
+        same = 0
+        err = 0.0
+        n = 0
+        prev = None
+        for k in range(int(end / MOTOR_GRID) + 1):
+            t = k * MOTOR_GRID
+            m_ref = ref.motor_at(a_ref + t)
+            m_out = out.motor_at(a_out + t)
+            k_ref, k_out = _maneuver(*m_ref), _maneuver(*m_out)
+            n += 1
+            err += abs(m_ref[0] - m_out[0]) + abs(m_ref[1] - m_out[1])
+            if k_ref == k_out:
+                same += 1
+            elif prev != (k_ref, k_out):
+                result["motor_diffs"].append((t, k_ref, k_out))
+            prev = None if k_ref == k_out else (k_ref, k_out)
+        result["motor_agreement"] = same / n
+        result["motor_mae"] = err / (2 * n)
+
+    # 片方だけ走っている（もう片方はモーター指令が1つも無い）のは一致とはみなさない
+    if ref.has_motor != out.has_motor:
+        motor_ok = False
+    else:
+        motor_ok = result["motor_agreement"] is None or result["motor_agreement"] >= min_agreement
+    result["motor_ok"] = motor_ok
+    result["ok"] = phase_ok and motor_ok
+    return result
+
+
+def format_diff(diff, max_lines=10):
+    lines = [f"compare window: {diff['window']:.1f}s"]
+    lines.append("  phases (log)   : " + (" -> ".join(f"{n}@{t:.1f}s" for t, n in diff["phases_ref"]) or "-"))
+    lines.append("  phases (replay): " + (" -> ".join(f"{n}@{t:.1f}s" for t, n in diff["phases_out"]) or "-"))
+    if diff["phase_errors"]:
+        lines.append("  phase timing   : " + ", ".join(f"{n}:{dt:+.1f}s" for n, dt in diff["phase_errors"]))
+    lines.append(f"  phases         : {'OK' if diff['phase_ok'] else 'DIFF'}")
+    if diff["motor_agreement"] is None:
+        if diff["motor_ok"]:
+            lines.append("  motor          : - (no motor commands on either side)")
+        else:
+            lines.append("  motor          : DIFF (motor commands on one side only)")
+    else:
+        lines.append(f"  motor          : agreement {diff['motor_agreement'] * 100:.0f}%, "
+                     f"mean |diff| {diff['motor_mae']:.2f}")
+        for t, k_ref, k_out in diff["motor_diffs"][:max_lines]:
+            lines.append(f"    {t:7.1f}s  log={k_ref:<8} replay={k_out}")
+        if len(diff["motor_diffs"]) > max_lines:
+            lines.append(f"    ... {len(diff['motor_diffs']) - max_lines} more")
+    lines.append(f"result: {'PASS' if diff['ok'] else 'FAIL'}")
+    return "\n".join(lines)
+
+
+# ==========================================
+# 実行
+# ==========================================
+def replay(log, start_phase=None, out_dir=None, speed=None, quiet=False, margin=10.0):
+    """
+    ログの値で FM.main() を動かし、再生したCSVのパスと fm_sim.run() の結果を返す
+    start_phase: このフェーズから始める（None ならログの最初のフェーズ、無ければ1）
+    margin: ログの終わりより先に動かす時間 [s]（セットアップの時間ぶん）
+    """
+    world = ReplayWorld(log)
+    if start_phase is None:
+        start_phase = log.phases[0][1] if log.phases else 1
+    align_at = log.first_phase_time(start_phase) or log.t0
+    align_row = log.first_phase_row(start_phase) or 0
+
+    def on_import(FM, clock):
+        _install_camera(world)
+        _install_gps(world)
+        _install_altitude(world)
+        build_mission = FM.build_mission
+
+        def build(ctx, clock=None, sleep=None):
+            mission = build_mission(ctx)
+            mission.initial = start_phase
+            world.align(align_at, align_row)
+            return mission
+        FM.build_mission = build
+
+    time_limit = (log.t_end - align_at) + margin
+    result = fm_sim.run(world, time_limit=time_limit, goal_hold=float("inf"), log_dir=out_dir,
+                        quiet=quiet, speed=speed, on_import=on_import)
+    with contextlib.suppress(Exception):
+        sys.modules["make_csv"].log_file.flush()
+    return result["csv"], result
+
+
+def simulate(seed, out_dir, time_limit=SELF_TEST_LIMIT):
+    """fm_sim を別プロセスで1回飛ばし、そのログのパスを返す（fm_sim は1プロセスで1回しか動かせないため）"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.join(here, "fm_sim.py"), "--seed", str(seed), "--quiet",
+           "--time-limit", str(time_limit), "--log-dir", out_dir]
+    proc = subprocess.run(cmd, cwd=here, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    path = os.path.join(out_dir, f"log_sim_{seed}.csv")
+    if not os.path.exists(path):
+        print(proc.stdout[-2000:])
+        return None
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded CSV log through FM.main() and diff the decisions")
+    parser.add_argument("log", nargs="?", help="make_csv log (5_log/csv/log_*.csv)")
+    parser.add_argument("--self-test", action="store_true", help="fly fm_sim once and replay its log (must PASS)")
+    parser.add_argument("--seed", type=int, default=1, help="fm_sim seed for --self-test")
+    parser.add_argument("--start-phase", type=int, default=None, help="start the mission in this phase")
+    parser.add_argument("--speed", type=float, default=None, help="replay at this multiple of real time "
+                                                                  "(default: as fast as possible)")
+    parser.add_argument("--tolerance", type=float, default=5.0, help="allowed phase transition time error [s]")
+    parser.add_argument("--min-agreement", type=float, default=0.8, help="required motor command agreement (0-1)")
+    parser.add_argument("--out-dir", help="where to write the replayed CSV and pictures (default: a temp dir)")
+    parser.add_argument("--quiet", action="store_true", help="hide the flight code output")
+    args = parser.parse_args()
+    if args.self_test == bool(args.log):
+        parser.error("give either a log or --self-test")
+
+    out_dir = args.out_dir or tempfile.mkdtemp(prefix="fm_replay_")
+    if args.self_test:
+        path = simulate(args.seed, os.path.join(out_dir, "sim"))
+        if path is None:
+            print("self-test: fm_sim did not write a log")
+            sys.exit(2)
+        args.log = path
+
+    log = RecordedLog(args.log)
+    if log.empty:
+        print(f"{args.log}: no rows")
+        sys.exit(2)
+    print(f"log: {args.log} ({log.t_end - log.t0:.1f}s; {log.summary()})")
+
+    wall0 = time.perf_counter()
+    path, _ = replay(log, start_phase=args.start_phase, out_dir=out_dir, speed=args.speed, quiet=args.quiet)
+    print(f"replay: {path} ({time.perf_counter() - wall0:.1f}s wall)")
+
+    diff = compare(log, RecordedLog(path), start_phase=args.start_phase,
+                   tolerance=args.tolerance, min_agreement=args.min_agreement)
+    print(format_diff(diff))
+    sys.exit(0 if diff["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1028 @@
+# Software-in-the-loop simulator for CanSat SC-28
+# - FM.main() をそのまま実機と同じ順番で動かし、ハードウェアだけを物理モデル付きの偽モジュールに差し替える
+#   * pigpio      : BNO055 / BME280 のI2Cレジスタ（ドライバのデコード処理もそのまま通る）とモーターPWM
+#   * RPi.GPIO    : LED・ニクロム線・モーター電源(VM)
+#   * gpiozero    : モーターのフォールバック用
+#   * serial      : GPSモジュール（NMEA文を1Hzで出す。シリアルのバッファに溜まった古い文から読まれるのも再現）
+#   * picamera2   : ローバーの位置・向きからコーンを描いた画像
+#   * ultralytics : 同じ幾何からコーンの矩形を返すYOLO
+# - 物理モデル: 高度プロファイル(待機→上昇→パラシュート降下→着地)、ニクロム線での分離、
+#   差動二輪の運動(モーターの遅れ・不感帯・横滑り)、スタック地形、GPSのノイズ(ゆっくり動く誤差＋白色雑音)
+# - 時間は仮想時計: time.sleep は待たずに時計を進め、その間の物理と MotorController の制御周期を回す
+#   → 30分のミッションが数秒〜数十秒で終わる。乱数の種が同じなら同じ結果になる
+#
+# 使い方:
+#   python3 fm_sim.py                       # 既定の条件で1回実行し、結果を表示
+#   python3 fm_sim.py --seed 3 --distance 120 --inverted 1.0 --stuck-rate 0.01 --quiet
+#   python3 fm_sim.py --log-dir /tmp/sim    # CSVと画像ログを別の場所に書く
+#   python3 fm_sim.py --speed 1             # 実時間で動かす（2なら2倍速）
+#   python3 fm_sim.py --profile --quiet     # profiler を有効にして処理時間の内訳を表示する
+#                                           # （monotonic_ns は仮想時計にしないので、待ち時間を除いた計算時間になる）
+#
+# ※ FM.py / motordrive.py などのモジュール状態（シングルトン）を使うため、1プロセスで1回だけ実行できる
+#
+# 旋回の向きについて: 飛行コードは次の3つを前提にしている
+#   ① 右モーターを強くすると Yaw が増える（_apply_trim / 'd'）
+#   ② GPSの角度(正=左)をそのまま Yaw に足す（calculate_distance_and_angle → turn / PurePursuit）
+#   ③ 画像の右にあるコーンへは Yaw を増やして寄る（order=2 → 'e' / VisualServo）
+#   ①②は「Yaw が上から見て反時計回りに増える」なら物理的に正しいが、そのとき③が成り立つのは画像が左右反転している場合だけ
+#   既定値(YAW_CCW=True, CAMERA_HFLIP=True)は飛行コードの前提どおりの機体を再現する。どちらかを変えると取り付けが違う機体になる
+
+import os
+import sys
+import math
+import time
+import types
+import random
+import struct
+import tempfile
+import argparse
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# FM.main() のゴール座標（本番）
+GOAL_LAT = 30.3742606
+GOAL_LON = 130.9599502
+EARTH_R = 6378137.0
+
+YAW_CCW = True          # Yaw が上から見て反時計回りに増える
+CAMERA_HFLIP = True     # カメラ画像が左右反転している
+
+PHYSICS_STEP = 0.02     # 物理の最大刻み [s]
+
+
+# ==========================================
+# 仮想時計
+# ==========================================
+class VirtualClock:
+    """
+    time.time / time.monotonic / time.sleep を差し替える時計
+    sleep はメインスレッドからのときだけ仮想時間を進める（別スレッドからの sleep は実時間で少しだけ待つ）
+    speed を指定すると、仮想時間が実時間の speed 倍より速く進まないように実際にも待つ（None なら待たない）
+    """
+    def __init__(self, world, epoch=None, speed=None):
+        self.world = world
+        self.t = 0.0
+        self.epoch = world.epoch if epoch is None else epoch
+        self.speed = speed
+        self._wall0 = None
+        self.owner = threading.current_thread()
+        self.stop_when = None       # 進めるたびに呼ばれ、True を返したら KeyboardInterrupt で止める
+        self._tickers = []          # [次の時刻, 周期, 関数]
+        self._in_tick = False
+        self._saved = None
+
+    def monotonic(self):
+        return self.t
+
+    def time(self):
+        return self.epoch + self.t
+
+    def add_ticker(self, period, fn):
+        """period 秒ごとに fn(now) を呼ぶ（MotorController の制御周期用）"""
+        ticker = [self.t, float(period), fn]
+        self._tickers.append(ticker)
+        return ticker
+
+    def remove_ticker(self, ticker):
+        if ticker in self._tickers:
+            self._tickers.remove(ticker)
+
+    def advance(self, dt):
+        target = self.t + max(0.0, dt)
+        while True:
+            self._run_tickers()
+            if self.t >= target:
+                break
+            nxt = min([target, self.t + PHYSICS_STEP] + [tk[0] for tk in self._tickers])
+            self.world.step(nxt - self.t)
+            self.t = nxt
+            if self.speed:
+                self._pace()
+
+    def _pace(self):
+        wall = time.perf_counter()
+        if self._wall0 is None:
+            self._wall0 = wall - self.t / self.speed
+        wait = self._wall0 + self.t / self.speed - wall
+        if wait > 0:
+            self._saved[2](wait)
+
+    def _run_tickers(self):
+        if self._in_tick:
+            return
+        self._in_tick = True
+        try:
+            for ticker in list(self._tickers):
+                if ticker[0] <= self.t:
+                    ticker[0] += ticker[1]
+                    if ticker[0] <= self.t:
+                        ticker[0] = self.t + ticker[1]  # 遅れた分は追いかけない
+                    ticker[2](self.t)
+        finally:
+            self._in_tick = False
+
+    def sleep(self, dt):
+        if threading.current_thread() is not self.owner:
+            self._saved[2](min(max(dt, 0.0), 0.001))
+            return
+        if self._in_tick:
+            return
+        self.advance(dt)
+        if self.stop_when is not None and self.stop_when():
+            raise KeyboardInterrupt
+
+    def install(self):
+        self._saved = (time.time, time.monotonic, time.sleep)
+        time.time, time.monotonic, time.sleep = self.time, self.monotonic, self.sleep
+
+    def uninstall(self):
+        if self._saved is not None:
+            time.time, time.monotonic, time.sleep = self._saved
+            self._saved = None
+
+
+class SimFuture(Future):
+    """result() の待ちを仮想時計で進める Future（motordrive.Future と差し替える）"""
+    clock = None
+
+    def result(self, timeout=None):
+        clock = SimFuture.clock
+        if clock is None or threading.current_thread() is not clock.owner:
+            return super().result(timeout)
+        deadline = None if timeout is None else clock.t + timeout
+        while not self.done():
+            if deadline is not None and clock.t >= deadline:
+                raise FutureTimeoutError()
+            clock.sleep(PHYSICS_STEP)
+        return super().result(0)
+
+
+# ==========================================
+# 物理モデル
+# ==========================================
+def _wrap180(deg):
+    return (deg + 180.0) % 360.0 - 180.0
+
+
+class SimWorld:
+    def __init__(
+        self,
+        seed=0,
+        distance=60.0,          # 着地点からゴールまでの距離 [m]
+        bearing=None,           # ゴールから見た着地点の方位 [deg]（None なら乱数）
+        pad_time=20.0,          # 打ち上げまでの待機 [s]
+        ascent_rate=5.0,        # [m/s]
+        apogee=50.0,            # [m]
+        apogee_hold=5.0,        # 最高点での滞在 [s]
+        descent_rate=5.0,       # パラシュート降下速度 [m/s]
+        release_time=3.0,       # ニクロム線をこの時間通電するとパラシュートが外れる [s]
+        p_inverted=0.0,         # 逆さまに着地する確率
+        stuck_rate=0.0,         # 1mあたりにスタックする確率
+        gps_sigma=0.7,          # GPSの白色雑音 [m]
+        gps_bias=1.5,           # GPSのゆっくり動く誤差 [m]
+        gps_bias_tau=30.0,      # その時定数 [s]
+        gps_dropout=0.02,       # 測位が無効になる確率（1回の測位あたり）
+        yaw_ccw=YAW_CCW,
+        camera_hflip=CAMERA_HFLIP,
+    ):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.name = f"sim_{seed}"   # ログのファイル名に使う
+        self.t = 0.0
+
+        # 飛行
+        self.pad_time = pad_time
+        self.ascent_rate = ascent_rate
+        self.apogee = apogee
+        self.apogee_hold = apogee_hold
+        self.descent_rate = descent_rate
+        self.t_apogee = pad_time + apogee / ascent_rate
+        self.t_landed = self.t_apogee + apogee_hold + apogee / descent_rate
+        self.release_time = release_time
+        self.nichrome_time = 0.0
+        self.released = False
+        self.qnh = 1013.25 + self.rng.uniform(-8.0, 8.0)
+        self.temp = 25.0 + self.rng.uniform(-5.0, 5.0)
+
+        # 地上（ゴール=コーンを原点とする東(x)・北(y) [m]）
+        if bearing is None:
+            bearing = self.rng.uniform(0.0, 360.0)
+        self.x = distance * math.sin(math.radians(bearing))
+        self.y = distance * math.cos(math.radians(bearing))
+        self.yaw = self.rng.uniform(0.0, 360.0)       # 地面基準のYaw（ground_yaw() が返す値）
+        self.yaw_ccw = bool(yaw_ccw)
+        self.az0 = self.rng.uniform(0.0, 360.0)       # Yaw=0 のときの方位角（北から時計回り）
+        self.inverted = self.rng.random() < p_inverted
+        self.camera_hflip = bool(camera_hflip)
+
+        # 車輪
+        self.vmax = 0.9           # デューティ1.0での車輪の速さ [m/s]
+        self.tread = 0.2          # 車輪間隔 [m]
+        self.skid = 0.35          # 旋回時の横滑り（1.0 で理想的な差動二輪）
+        self.tau = 0.15           # モーターの遅れ [s]
+        self.deadband = 0.08      # これ未満のデューティでは動かない
+        self.vr = self.vl = 0.0
+        self.v = 0.0              # 地面に対する前進速度 [m/s]
+        self.w = 0.0              # Yaw の変化率 [rad/s]
+        self.odometer = 0.0
+
+        self.stuck_rate = stuck_rate
+        self.stuck = False
+        self.stuck_dir = 0
+        self._escape = 0.0
+        self.stuck_count = 0
+
+        # GPS
+        self.gps_sigma = gps_sigma
+        self.gps_bias = gps_bias
+        self.gps_bias_tau = gps_bias_tau
+        self.gps_dropout = gps_dropout
+        self._bias = [self.rng.gauss(0.0, gps_bias), self.rng.gauss(0.0, gps_bias)]
+        self._next_fix = 1.0
+        self.epoch = time.time()     # 仮想時間0の時刻（NMEAの時刻用）
+        self.nmea = deque()          # シリアルのバッファに溜まっている文
+        self._nmea_bytes = 0
+
+        # 偽ハードウェアの状態
+        self.gpio = {}           # RPi.GPIO の出力
+        self.pwm = {}            # ピン -> デューティ(0.0~1.0)
+        self.motor_pins = None   # (右前, 右後, 左前, 左後)
+        self.vm_pin = None
+
+    # ----------------------------
+    # 飛行
+    # ----------------------------
+    def altitude(self):
+        t = self.t
+        if t < self.pad_time:
+            return 0.0
+        if t < self.t_apogee:
+            return (t - self.pad_time) * self.ascent_rate
+        if t < self.t_apogee + self.apogee_hold:
+            return self.apogee
+        return max(0.0, self.apogee - (t - self.t_apogee - self.apogee_hold) * self.descent_rate)
+
+    @property
+    def landed(self):
+        return self.t >= self.t_landed
+
+    def pressure(self):
+        """高度と雑音から気圧 [hPa]"""
+        alt = self.altitude() + self.rng.gauss(0.0, 0.15)
+        return self.qnh * (1.0 - alt / 44330.0) ** (1.0 / 0.1903)
+
+    # ----------------------------
+    # 地上走行
+    # ----------------------------
+    @property
+    def azimuth(self):
+        """ローバーの向き（北から時計回り [deg]）"""
+        return (self.az0 + (-self.yaw if self.yaw_ccw else self.yaw)) % 360.0
+
+    @property
+    def distance(self):
+        return math.hypot(self.x, self.y)
+
+    def _duties(self):
+        if self.motor_pins is None or not self.gpio.get(self.vm_pin, 0):
+            return 0.0, 0.0
+        rf, rb, lf, lb = self.motor_pins
+        r = self.pwm.get(rf, 0.0) - self.pwm.get(rb, 0.0)
+        l = self.pwm.get(lf, 0.0) - self.pwm.get(lb, 0.0)
+        r = 0.0 if abs(r) < self.deadband else r
+        l = 0.0 if abs(l) < self.deadband else l
+        return r, l
+
+    def step(self, dt):
+        self.t += dt
+        while self.t >= self._next_fix:
+            self._emit_nmea()
+
+        if self.landed and not self.released:
+            if self.gpio.get(16, 0):
+                self.nichrome_time += dt
+                if self.nichrome_time >= self.release_time:
+                    self.released = True
+        if not (self.landed and self.released):
+            return
+
+        r, l = self._duties()
+        k = min(1.0, dt / self.tau)
+        self.vr += (r * self.vmax - self.vr) * k
+        self.vl += (l * self.vmax - self.vl) * k
+        v = 0.5 * (self.vr + self.vl)
+        w = self.skid * (self.vr - self.vl) / self.tread
+        if self.inverted:
+            # 逆さまだと車輪が地面を逆向きに蹴る（左右の車輪も入れ替わるので回転の向きはそのまま）
+            v = -v
+
+        if self.stuck:
+            # 逆向きに 0.8 秒以上進もうとすれば抜け出せる
+            if v * self.stuck_dir < -0.05:
+                self._escape += dt
+                if self._escape >= 0.8:
+                    self.stuck = False
+            else:
+                self._escape = 0.0
+            if self.stuck:
+                v, w = 0.0, 0.0
+        elif abs(v) > 0.05 and self.rng.random() < self.stuck_rate * abs(v) * dt:
+            self.stuck = True
+            self.stuck_dir = 1 if v > 0 else -1
+            self._escape = 0.0
+            self.stuck_count += 1
+            v, w = 0.0, 0.0
+
+        self.yaw = (self.yaw + math.degrees(w) * dt) % 360.0
+        az = math.radians(self.azimuth)
+        nx = self.x + v * math.sin(az) * dt
+        ny = self.y + v * math.cos(az) * dt
+        if math.hypot(nx, ny) > 0.25:   # コーンにぶつかったらそれ以上進めない
+            self.x, self.y = nx, ny
+            self.odometer += abs(v) * dt
+        self.v, self.w = v, w
+
+    # ----------------------------
+    # IMU
+    # ----------------------------
+    def imu(self):
+        """(heading, roll, pitch, gyro[rad/s], linear_accel[m/s^2], gravity[m/s^2])"""
+        g = 9.80665
+        rng = self.rng
+        t = self.t
+        heading = self.yaw if not self.inverted else (360.0 - self.yaw) % 360.0
+        gyro = [rng.gauss(0.0, 0.005), rng.gauss(0.0, 0.005), rng.gauss(0.0, 0.005)]
+        lin = [rng.gauss(0.0, 0.02), rng.gauss(0.0, 0.02), rng.gauss(0.0, 0.02)]
+
+        if not self.landed:
+            alt = self.altitude()
+            if alt > 0.0:
+                # 上昇・降下中は揺れと回転
+                heading = (heading + 20.0 * t) % 360.0
+                gyro[2] += math.radians(20.0)
+                lin[0] += 0.8 * math.sin(2.0 * math.pi * 0.7 * t)
+                lin[1] += 0.8 * math.cos(2.0 * math.pi * 0.5 * t)
+        else:
+            spin = abs(self.vr) + abs(self.vl)
+            motion = min(1.0, max(abs(self.v) / 0.45, abs(self.w) / 0.6))
+            if motion > 0.02:
+                # 走行中: 地面の凹凸で車体が揺れる（低い周波数）
+                lin[0] += 0.6 * motion * math.sin(2.0 * math.pi * 0.9 * t)
+                lin[2] += 1.0 * motion * math.sin(2.0 * math.pi * 1.6 * t + 1.0)
+                gyro[0] += 0.4 * motion * math.sin(2.0 * math.pi * 1.3 * t)
+                gyro[1] += 0.4 * motion * math.sin(2.0 * math.pi * 1.1 * t + 0.5)
+            elif spin > 0.05:
+                # 空転: 細かい振動だけ
+                for i in range(3):
+                    lin[i] += rng.gauss(0.0, 0.12)
+            gyro[2] += -self.w if self.inverted else self.w
+
+        gz = -g if self.inverted else g
+        gravity = [rng.gauss(0.0, 0.05), rng.gauss(0.0, 0.05), gz + rng.gauss(0.0, 0.05)]
+        roll = 180.0 if self.inverted else 0.0
+        return heading, roll, 0.0, gyro, lin, gravity
+
+    # ----------------------------
+    # GPS
+    # ----------------------------
+    NMEA_BUFFER_BYTES = 4096
+
+    def _emit_nmea(self):
+        """1秒ごとの測位を GGA/RMC にしてバッファへ（溢れたら古いものから捨てる）"""
+        for line in _nmea_lines(self.epoch + self._next_fix, self.gps_fix()):
+            self.nmea.append(line)
+            self._nmea_bytes += len(line)
+        while self._nmea_bytes > self.NMEA_BUFFER_BYTES:
+            self._nmea_bytes -= len(self.nmea.popleft())
+        self._next_fix += 1.0
+
+    def read_nmea(self):
+        if not self.nmea:
+            return None
+        line = self.nmea.popleft()
+        self._nmea_bytes -= len(line)
+        return line
+
+    def gps_fix(self):
+        """真値＋誤差の (lat, lon)。無効な測位なら None"""
+        dt = 1.0
+        a = math.exp(-dt / self.gps_bias_tau)
+        s = self.gps_bias * math.sqrt(1.0 - a * a)
+        self._bias = [b * a + self.rng.gauss(0.0, s) for b in self._bias]
+        if self.rng.random() < self.gps_dropout:
+            return None
+        ex = self.x + self._bias[0] + self.rng.gauss(0.0, self.gps_sigma)
+        ny = self.y + self._bias[1] + self.rng.gauss(0.0, self.gps_sigma)
+        lat = GOAL_LAT + math.degrees(ny / EARTH_R)
+        lon = GOAL_LON + math.degrees(ex / (EARTH_R * math.cos(math.radians(GOAL_LAT))))
+        return lat, lon
+
+    # ----------------------------
+    # カメラ
+    # ----------------------------
+    def cone_box(self, width=640, height=480, hfov=62.0, cam_h=0.12, cone_h=0.7, cone_w=0.35):
+        """正立画像でのコーンの三角形 (apex, left, right) と外接矩形。写っていなければ None"""
+        d = self.distance
+        if not self.landed or d < 0.2:
+            return None
+        bearing = math.degrees(math.atan2(-self.x, -self.y))
+        rel = _wrap180(bearing - self.azimuth)      # 正: 右
+        if abs(rel) > hfov / 2.0 + 10.0 or d > 40.0:
+            return None
+        f = (width / 2.0) / math.tan(math.radians(hfov / 2.0))
+        xc = width / 2.0 + f * math.tan(math.radians(rel))
+        if self.camera_hflip:
+            xc = width - xc
+        y_base = height / 2.0 + f * cam_h / d
+        y_apex = height / 2.0 - f * (cone_h - cam_h) / d
+        half = f * cone_w / d / 2.0
+
+        def clip(v):
+            return int(max(-10000, min(10000, v)))
+        tri = np.array([[clip(xc), clip(y_apex)], [clip(xc - half), clip(y_base)], [clip(xc + half), clip(y_base)]],
+                       dtype=np.int32)
+        x0, x1 = max(0, xc - half), min(width - 1, xc + half)
+        y0, y1 = max(0, y_apex), min(height - 1, y_base)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return tri, (x0, y0, x1, y1)
+
+
+# ==========================================
+# 偽ハードウェア
+# ==========================================
+BNO055_ADDR = 0x28
+BME280_ADDR = 0x76
+
+# BME280 のキャリブレーション値（データシートの例）
+_BME_T = (27504, 26435, -1000)
+_BME_P = (36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000)
+_BME_H = (75, 362, 0, 313, 50, 30)
+
+
+class _Bno055Device:
+    def __init__(self, world):
+        self.world = world
+
+    def registers(self):
+        heading, roll, pitch, gyro, lin, grav = self.world.imu()
+        reg = bytearray(0x40)
+        reg[0x00] = 0xA0
+        reg[0x01], reg[0x02], reg[0x03] = 0xFB, 0x32, 0x0F
+        reg[0x04], reg[0x05], reg[0x06] = 0x11, 0x03, 0x15
+
+        def put(addr, values, scale):
+            ints = [int(round(v * scale)) for v in values]
+            struct.pack_into("<%dh" % len(ints), reg, addr, *[max(-32768, min(32767, i)) for i in ints])
+
+        put(0x08, [a + b for a, b in zip(lin, grav)], 100.0)
+        put(0x0E, [20.0, 5.0, -40.0], 16.0)
+        put(0x14, gyro, 900.0)
+        put(0x1A, [heading, roll, pitch], 16.0)
+        h = math.radians(heading) / 2.0
+        put(0x20, [math.cos(h), 0.0, 0.0, math.sin(h)], 1 << 14)
+        put(0x28, lin, 100.0)
+        put(0x2E, grav, 100.0)
+        reg[0x34] = int(round(self.world.temp)) & 0xFF
+        return reg
+
+    def read(self, reg, count):
+        return bytes(self.registers()[reg:reg + count])
+
+    def write(self, reg, data):
+        pass
+
+
+class _Bme280Device:
+    def __init__(self, world):
+        self.world = world
+        from bme280 import BME280Sensor
+        # ドライバ自身の補正式を逆に解いて生の値を作る（デコードまで実機と同じ経路を通す）
+        calc = object.__new__(BME280Sensor)
+        calc.pi = types.SimpleNamespace(connected=False)
+        calc.i2c_handle = None
+        calc.digT, calc.digP, calc.digH = list(_BME_T), list(_BME_P), list(_BME_H)
+        calc.t_fine = 0.0
+        self.calc = calc
+
+        calib = struct.pack("<Hhh", *_BME_T) + struct.pack("<Hhhhhhhhh", *_BME_P)
+        h1, h2, h3, h4, h5, h6 = _BME_H
+        self.regs = {0x88 + i: b for i, b in enumerate(calib)}
+        self.regs[0xA1] = h1
+        e1 = struct.pack("<hB", h2, h3) + bytes([(h4 >> 4) & 0xFF, (h4 & 0x0F) | ((h5 & 0x0F) << 4),
+                                                 (h5 >> 4) & 0xFF]) + struct.pack("<b", h6)
+        self.regs.update({0xE1 + i: b for i, b in enumerate(e1)})
+
+    @staticmethod
+    def _invert(fn, value, lo, hi, increasing):
+        for _ in range(24):
+            mid = (lo + hi) // 2
+            if (fn(mid) < value) == increasing:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def measurement(self):
+        c = self.calc
+        temp = self.world.temp + self.world.rng.gauss(0.0, 0.02)
+        adc_t = self._invert(c.compensate_T, temp, 0, 1 << 20, True)
+        c.compensate_T(adc_t)
+        adc_p = self._invert(c.compensate_P, self.world.pressure(), 0, 1 << 20, False)
+        adc_h = self._invert(c.compensate_H, 40.0, 0, 1 << 16, True)
+        return bytes([(adc_p >> 12) & 0xFF, (adc_p >> 4) & 0xFF, (adc_p & 0x0F) << 4,
+                      (adc_t >> 12) & 0xFF, (adc_t >> 4) & 0xFF, (adc_t & 0x0F) << 4,
+                      (adc_h >> 8) & 0xFF, adc_h & 0xFF])
+
+    def read(self, reg, count):
+        if reg == 0xF7:
+            return self.measurement()[:count]
+        return bytes(self.regs.get(reg + i, 0) for i in range(count))
+
+    def write(self, reg, data):
+        pass
+
+
+class _PigpioError(Exception):
+    pass
+
+
+class FakePi:
+    """pigpio.pi の代わり（I2C・PWM・GPIOモード）"""
+    _handles = {}
+    _next_handle = 0
+
+    def __init__(self, host=None, port=None):
+        self.connected = True
+
+    # ----- I2C -----
+    def i2c_open(self, bus, address, flags=0):
+        dev = _SIM.devices.get(address)
+        if dev is None:
+            raise _PigpioError(f"no device at 0x{address:02X}")
+        FakePi._next_handle += 1
+        FakePi._handles[FakePi._next_handle] = dev
+        return FakePi._next_handle
+
+    def i2c_close(self, handle):
+        FakePi._handles.pop(handle, None)
+
+    def _dev(self, handle):
+        dev = FakePi._handles.get(handle)
+        if dev is None:
+            raise _PigpioError("bad i2c handle")
+        return dev
+
+    def i2c_read_byte_data(self, handle, reg):
+        return self._dev(handle).read(reg, 1)[0]
+
+    def i2c_read_i2c_block_data(self, handle, reg, count):
+        data = self._dev(handle).read(reg, count)
+        return len(data), bytearray(data)
+
+    def i2c_write_byte_data(self, handle, reg, value):
+        self._dev(handle).write(reg, bytes([value & 0xFF]))
+
+    def i2c_write_i2c_block_data(self, handle, reg, data):
+        self._dev(handle).write(reg, bytes(data))
+
+    # ----- GPIO / PWM -----
+    def set_mode(self, pin, mode):
+        pass
+
+    def write(self, pin, level):
+        _SIM.world.gpio[pin] = int(level)
+
+    def set_PWM_frequency(self, pin, frequency):
+        return int(frequency)
+
+    def get_PWM_real_range(self, pin):
+        return 100
+
+    def set_PWM_range(self, pin, value):
+        _SIM.ranges[pin] = int(value)
+
+    def set_PWM_dutycycle(self, pin, duty):
+        _SIM.world.pwm[pin] = duty / float(_SIM.ranges.get(pin, 255))
+
+    def hardware_PWM(self, pin, frequency, duty):
+        _SIM.world.pwm[pin] = duty / 1e6 if frequency else 0.0
+
+    def stop(self):
+        self.connected = False
+
+
+class FakeSerial:
+    """GPSモジュール: 1秒ごとの GGA/RMC が溜まったバッファ(4KB)から、古い文から順に読む"""
+    def __init__(self, port=None, baudrate=9600, timeout=None, **kwargs):
+        self.port = port
+        self.timeout = timeout
+        self.is_open = True
+
+    def readline(self):
+        world = _SIM.world
+        line = world.read_nmea()
+        if line is None:
+            # 次の文が届くまで（最大 timeout）待つ
+            wait = world._next_fix - world.t
+            if self.timeout is not None:
+                wait = min(wait, self.timeout)
+            time.sleep(max(wait, 0.001))
+            line = world.read_nmea()
+        return line or b""
+
+    def close(self):
+        self.is_open = False
+
+
+def _nmea(body):
+    cs = 0
+    for ch in body:
+        cs ^= ord(ch)
+    return f"${body}*{cs:02X}\r\n".encode("ascii")
+
+
+def _nmea_lines(epoch, fix):
+    tm = time.gmtime(epoch)
+    hhmmss = time.strftime("%H%M%S", tm) + f".{int((epoch % 1) * 100):02d}"
+    ddmmyy = time.strftime("%d%m%y", tm)
+    if fix is None:
+        return [_nmea(f"GPGGA,{hhmmss},,,,,0,00,99.9,,M,,M,,"),
+                _nmea(f"GPRMC,{hhmmss},V,,,,,,,{ddmmyy},,,N")]
+    lat, lon = fix
+    lat_s = f"{int(lat):02d}{(lat - int(lat)) * 60.0:08.5f}"
+    lon_s = f"{int(lon):03d}{(lon - int(lon)) * 60.0:08.5f}"
+    return [_nmea(f"GPGGA,{hhmmss},{lat_s},N,{lon_s},E,1,08,0.9,10.0,M,30.0,M,,"),
+            _nmea(f"GPRMC,{hhmmss},A,{lat_s},N,{lon_s},E,0.5,0.0,{ddmmyy},,,A")]
+
+
+class FakePicamera2:
+    """コーンを描いた画像を返すカメラ（30fps: 撮影ごとに次のフレームの時刻まで進む）"""
+    FPS = 30.0
+
+    def __init__(self, *args, **kwargs):
+        self.size = (640, 480)
+        self._background = None
+
+    def create_preview_configuration(self, main=None, **kwargs):
+        return {"main": main or {}}
+
+    def configure(self, config):
+        size = (config.get("main") or {}).get("size")
+        if size:
+            self.size = tuple(size)
+
+    def start(self):
+        w, h = self.size
+        bg = np.zeros((h, w, 4), dtype=np.uint8)
+        bg[: h // 2] = (235, 206, 170, 255)      # 空
+        bg[h // 2:] = (60, 130, 70, 255)         # 草地
+        rng = np.random.default_rng(_SIM.world.seed)
+        noise = rng.integers(-12, 13, size=(h - h // 2, w, 1), dtype=np.int16)
+        bg[h // 2:, :, :3] = np.clip(bg[h // 2:, :, :3].astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        self._background = bg
+
+    def capture_array(self, name="main"):
+        period = 1.0 / self.FPS
+        now = time.monotonic()
+        time.sleep((math.floor(now / period + 1e-6) + 1) * period - now)
+        w, h = self.size
+        frame = self._background.copy()
+        cone = _SIM.world.cone_box(w, h)
+        if cone is not None:
+            cv2.fillConvexPoly(frame, cone[0], (30, 30, 200, 255))
+        if _SIM.world.inverted:
+            frame = cv2.rotate(frame, cv2.ROTATE_180)   # カメラごと逆さま
+        return frame
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Tensor:
+    def __init__(self, array):
+        self._array = np.asarray(array, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._array
+
+
+class _Boxes:
+    def __init__(self, boxes):
+        self.xyxy = _Tensor([b[:4] for b in boxes] or np.zeros((0, 4)))
+        self.conf = _Tensor([b[4] for b in boxes])
+        self.cls = _Tensor([0 for _ in boxes])
+
+    def __len__(self):
+        return len(self.conf.numpy())
+
+
+class FakeYOLO:
+    """コーンの位置を幾何から求めて返す検出器（推論時間ぶん時計を進める）"""
+    INFERENCE_TIME = 0.4
+
+    def __init__(self, model_path=None, *args, **kwargs):
+        self.names = {0: "cone"}
+
+    def predict(self, frame, **kwargs):
+        time.sleep(self.INFERENCE_TIME)
+        boxes = []
+        h, w = frame.shape[:2]
+        cone = _SIM.world.cone_box(w, h) if frame.any() else None
+        if cone is not None:
+            x0, y0, x1, y1 = cone[1]
+            size = (x1 - x0) * (y1 - y0)
+            conf = min(0.95, 0.3 + size / 2000.0)
+            boxes.append((x0, y0, x1, y1, conf))
+        return [types.SimpleNamespace(boxes=_Boxes(boxes))]
+
+
+class _GpioModule(types.ModuleType):
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    HIGH = 1
+    LOW = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode, initial=0, **kwargs):
+        if mode == self.OUT:
+            _SIM.world.gpio[pin] = int(initial)
+
+    def output(self, pin, value):
+        _SIM.world.gpio[pin] = int(value)
+
+    def input(self, pin):
+        return _SIM.world.gpio.get(pin, 0)
+
+    def cleanup(self, *args):
+        for pin in list(_SIM.world.gpio):
+            _SIM.world.gpio[pin] = 0
+
+
+class _ZeroPwm:
+    def __init__(self, pin):
+        self.pin = pin
+        self.frequency = 100
+
+    def set(self, v):
+        _SIM.world.pwm[self.pin] = v
+
+
+class FakeMotor:
+    """gpiozero.Motor の代わり"""
+    def __init__(self, forward, backward, pin_factory=None, **kwargs):
+        self.forward_device = _ZeroPwm(forward)
+        self.backward_device = _ZeroPwm(backward)
+        self._value = 0.0
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, v):
+        self._value = max(-1.0, min(1.0, float(v)))
+        self.forward_device.set(max(0.0, self._value))
+        self.backward_device.set(max(0.0, -self._value))
+
+    def close(self):
+        self.value = 0.0
+
+
+def _module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    return mod
+
+
+class _Sim:
+    """偽モジュールから見える現在のシミュレーション"""
+    world = None
+    clock = None
+    devices = {}
+    ranges = {}
+
+
+_SIM = _Sim()
+
+
+def install_stubs(world, clock):
+    """ハードウェアのモジュールを偽物に差し替え、時計を仮想時計にする（FM等を import する前に呼ぶ）"""
+    _SIM.world = world
+    _SIM.clock = clock
+    _SIM.ranges = {}
+
+    gpio = _GpioModule("RPi.GPIO")
+    rpi = _module("RPi", GPIO=gpio)
+    pigpio = _module("pigpio", pi=FakePi, error=_PigpioError, OUTPUT=1, INPUT=0,
+                     EITHER_EDGE=2, RISING_EDGE=0, FALLING_EDGE=1)
+    gpiozero = _module("gpiozero", Motor=FakeMotor)
+    pins = _module("gpiozero.pins")
+    pins_pigpio = _module("gpiozero.pins.pigpio", PiGPIOFactory=lambda *a, **k: object())
+    serial = _module("serial", Serial=FakeSerial, SerialException=IOError)
+    picamera2 = _module("picamera2", Picamera2=FakePicamera2)
+    ultralytics = _module("ultralytics", YOLO=FakeYOLO)
+    sys.modules.update({
+        "RPi": rpi, "RPi.GPIO": gpio, "pigpio": pigpio,
+        "gpiozero": gpiozero, "gpiozero.pins": pins, "gpiozero.pins.pigpio": pins_pigpio,
+        "serial": serial, "picamera2": picamera2, "ultralytics": ultralytics,
+    })
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+
+    clock.install()
+    _SIM.devices = {BNO055_ADDR: _Bno055Device(world), BME280_ADDR: _Bme280Device(world)}
+
+
+def _redirect_logs(log_dir, FM):
+    """CSVと画像ログの保存先を log_dir に変える"""
+    import make_csv
+    os.makedirs(log_dir, exist_ok=True)
+    if make_csv.log_file is not None:
+        make_csv.log_file.close()
+    path = os.path.join(log_dir, f"log_{_SIM.world.name}.csv")
+    make_csv.log_file = open(path, "w", encoding="utf-8")
+    make_csv.log_file.write(",".join(make_csv.msg_types) + "\n")
+    make_csv.filename = path
+    FM.SESSION_SAVE_DIR = os.path.join(log_dir, f"picture_{_SIM.world.name}")
+    return path
+
+
+# ==========================================
+# 実行
+# ==========================================
+class _ClockThread:
+    """MotorController のスレッドの代わり: 仮想時計の制御周期で _step() を呼ぶ"""
+    def __init__(self, clock, ctrl):
+        self.clock = clock
+        self.ctrl = ctrl
+        self.ticker = clock.add_ticker(ctrl.period, ctrl._step)
+
+    def join(self, timeout=None):
+        self.clock.remove_ticker(self.ticker)
+        self.ctrl._finish()
+
+
+def run(world, time_limit=1800.0, goal_hold=3.0, log_dir=None, quiet=False, speed=None, on_import=None):
+    """
+    FM.main() を仮想時計で1回動かす
+    time_limit: 打ち切る仮想時間 [s]
+    goal_hold: ゴール(フェーズ5)に入ってから止めるまでの時間 [s]
+    speed: 実時間の何倍で動かすか（None なら待たずに最速）
+    on_import: FM を import した後、main() の前に on_import(FM, clock) を呼ぶ（リプレイでの差し替え用）
+               チェックポイントは log_dir（無ければ一時ディレクトリ）に置き、呼ぶ前に消しておく
+    Return: 結果の dict
+    """
+    clock = VirtualClock(world, speed=speed)
+    install_stubs(world, clock)
+    wall0 = time.perf_counter()
+    state = {"mission": None, "ctx": None, "timeline": [], "t_goal": None}
+
+    try:
+        out = open(os.devnull, "w") if quiet else None
+        with (contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext()):
+            import motordrive
+            import FM
+
+            motordrive.Future = SimFuture
+            SimFuture.clock = clock
+
+            def start(ctrl):
+                if ctrl._thread is not None:
+                    return
+                motordrive.setup_motors()
+                ctrl._running = True
+                ctrl._thread = _ClockThread(clock, ctrl)
+            motordrive.MotorController.start = start
+
+            world.motor_pins = (motordrive.PIN_RIGHT_FORWARD, motordrive.PIN_RIGHT_BACKWARD,
+                                motordrive.PIN_LEFT_FORWARD, motordrive.PIN_LEFT_BACKWARD)
+            world.vm_pin = motordrive.PIN_VM
+            csv_path = _redirect_logs(log_dir, FM) if log_dir else getattr(sys.modules.get("make_csv"), "filename", None)
+            # 実機のチェックポイントを読んだり上書きしたりしない（毎回フェーズ1から）
+            import checkpoint
+            FM.CHECKPOINT_PATH = os.path.join(log_dir or tempfile.gettempdir(), f"checkpoint_{world.name}.json")
+            checkpoint.clear(FM.CHECKPOINT_PATH)
+
+            build_mission = FM.build_mission
+
+            def build(ctx, clock=None, sleep=None):
+                mission = build_mission(ctx, clock=time.monotonic, sleep=time.sleep)
+                state["mission"], state["ctx"] = mission, ctx
+                return mission
+            FM.build_mission = build
+            if on_import is not None:
+                on_import(FM, clock)
+
+            def stop_when():
+                mission = state["mission"]
+                if mission is None or not mission._running:
+                    return False
+                n = mission.current.number if mission.current else None
+                if n is not None and (not state["timeline"] or state["timeline"][-1][1] != n):
+                    state["timeline"].append((round(clock.t, 2), n))
+                if n == 5 and state["t_goal"] is None:
+                    state["t_goal"] = clock.t
+                if state["t_goal"] is not None and clock.t - state["t_goal"] >= goal_hold:
+                    return True
+                return clock.t >= time_limit
+            clock.stop_when = stop_when
+
+            FM.main()
+    finally:
+        clock.uninstall()
+        if quiet:
+            out.close()
+
+    ctx = state["ctx"]
+    return {
+        "seed": world.seed,
+        "goal": state["t_goal"] is not None,
+        "goal_reason": ctx.goal_reason if ctx else None,
+        "mission_time": state["t_goal"],
+        "sim_time": clock.t,
+        "wall_time": time.perf_counter() - wall0,
+        "final_distance": world.distance,
+        "odometer": world.odometer,
+        "landed_at": world.t_landed,
+        "inverted": world.inverted,
+        "stuck_events": world.stuck_count,
+        "timeline": state["timeline"],
+        "csv": csv_path,
+    }
+
+
+def format_result(r):
+    lines = [
+        f"seed={r['seed']} goal={'YES' if r['goal'] else 'NO'} ({r['goal_reason']})",
+        f"  mission time : {r['mission_time']:.1f}s" if r["mission_time"] is not None
+        else f"  mission time : - (stopped at {r['sim_time']:.1f}s)",
+        f"  wall time    : {r['wall_time']:.2f}s (x{r['sim_time'] / max(r['wall_time'], 1e-6):.0f})",
+        f"  final dist   : {r['final_distance']:.2f}m, driven {r['odometer']:.1f}m",
+        f"  landed at    : {r['landed_at']:.1f}s, inverted={r['inverted']}, stuck events={r['stuck_events']}",
+        "  phases       : " + " -> ".join(f"{n}@{t:.0f}s" for t, n in r["timeline"]),
+    ]
+    if r.get("csv"):
+        lines.append(f"  csv          : {r['csv']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run FM.main() end to end against simulated hardware")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--distance", type=float, default=60.0, help="landing point to goal [m]")
+    parser.add_argument("--bearing", type=float, default=None, help="landing point bearing from goal [deg]")
+    parser.add_argument("--apogee", type=float, default=50.0, help="[m]")
+    parser.add_argument("--descent-rate", type=float, default=5.0, help="parachute descent rate [m/s]")
+    parser.add_argument("--inverted", type=float, default=0.0, help="probability of landing upside down")
+    parser.add_argument("--stuck-rate", type=float, default=0.0, help="probability of getting stuck per meter")
+    parser.add_argument("--gps-sigma", type=float, default=0.7, help="GPS white noise [m]")
+    parser.add_argument("--gps-bias", type=float, default=1.5, help="GPS slowly varying error [m]")
+    parser.add_argument("--gps-dropout", type=float, default=0.02, help="probability of an invalid fix")
+    parser.add_argument("--no-hflip", action="store_true", help="camera image is not mirrored")
+    parser.add_argument("--yaw-cw", action="store_true", help="yaw increases clockwise")
+    parser.add_argument("--time-limit", type=float, default=1800.0, help="virtual time limit [s]")
+    parser.add_argument("--speed", type=float, default=None, help="run at this multiple of real time (default: as fast as possible)")
+    parser.add_argument("--log-dir", help="write the CSV log and pictures here instead of /home/sc28")
+    parser.add_argument("--quiet", action="store_true", help="hide the flight code output")
+    parser.add_argument("--profile", action="store_true", help="enable FM.PROFILE and print the span summary")
+    args = parser.parse_args()
+
+    world = SimWorld(
+        seed=args.seed, distance=args.distance, bearing=args.bearing, apogee=args.apogee,
+        descent_rate=args.descent_rate, p_inverted=args.inverted, stuck_rate=args.stuck_rate,
+        gps_sigma=args.gps_sigma, gps_bias=args.gps_bias, gps_dropout=args.gps_dropout,
+        yaw_ccw=not args.yaw_cw, camera_hflip=not args.no_hflip,
+    )
+    on_import = (lambda FM, clock: setattr(FM, "PROFILE", True)) if args.profile else None
+    result = run(world, time_limit=args.time_limit, log_dir=args.log_dir, quiet=args.quiet, speed=args.speed,
+                 on_import=on_import)
+    print(format_result(result))
+    if args.profile:
+        import profiler
+        print("\n".join(profiler.report()))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@
 # - Added auto re-open on serial disconnect
 # - Keeps Geodesic calc & EM.py angle sign compatibility
 # - Added auto CSV logging for distance, angle, and time
+# - Logs every read result in the nmea column (the sentence used, or NO_FIX) so fm_replay can replay reads in order
 
 import serial
 import pynmea2
@@ -12,6 +13,8 @@ import math
 import pyproj
 from datetime import datetime, timedelta
 
+import profiler
+
 # ★ make_csvを安全にインポート
 try:
     import make_csv
@@ -21,6 +24,7 @@ except ImportError:
 
 # 定数定義 (EM.pyとの互換性のため維持)
 ERROR_DISTANCE = 2727272727
+NO_FIX = "NO_FIX"  # 測位が取れなかった読み取りの nmea 列
 
 
 class GPS:
@@ -94,12 +98,14 @@ class GPS:
         except Exception:
             return False
 
+    @profiler.timed("gps.read_gps_data")
     def read_gps_data(self):
         """
         最新のGPSデータを取得する
         Return: (latitude, longitude) or (None, None)
         """
         if not self._ensure_serial():
+            self._log_read(NO_FIX)
             return None, None
 
         try:
@@ -134,7 +140,8 @@ class GPS:
                     if hasattr(msg, "latitude") and hasattr(msg, "longitude"):
                         # (1) 0.0,0.0 は無効データとして弾く（両方0のときだけ弾く）
                         if msg.latitude != 0.0 and msg.longitude != 0.0:
-                            # ※ ここはijochi経由でCSV保存されるため記録処理は不要
+                            # ※ 緯度経度はijochi経由でCSV保存される。ここでは元の文だけ残す
+                            self._log_read(line)
                             return msg.latitude, msg.longitude
 
                 except pynmea2.ParseError:
@@ -142,12 +149,23 @@ class GPS:
                 except Exception:
                     continue
 
+            self._log_read(NO_FIX)
             return None, None
 
         except Exception as e:
             print(f"GPS Read Error: {e}")
+            self._log_read(NO_FIX)
             return None, None
 
+    @staticmethod
+    def _log_read(line):
+        """読み取り1回の結果を nmea 列に残す（範囲外でijochiに捨てられた値も含めて、読んだ順に全部残る）"""
+        if make_csv:
+            try:
+                make_csv.print('nmea', line)
+            except Exception:
+                pass
+
     def get_time_jst(self):
         """JST時間を取得する（RMCのdate+timeが揃ったときだけ返す）"""
         if not self._ensure_serial():
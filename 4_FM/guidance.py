@@ -0,0 +1,139 @@
+# GPS pure-pursuit guidance for CanSat SC-28
+# - 走りながらGPSの測位ごとにゴールまでの距離と方位ズレを計算し直す（Stop & Go で止まらない）
+# - 方位ズレは「最近の走行ベクトル(過去の測位→今の測位)」に対して求め、その間のYaw平均と合わせて目標Yawにする
+#   → 測位と測位の間はBNO055のYawで目標Yawを追いかける（GPSが1Hzでも操舵は制御周期ごとに更新される）
+# - 操舵は pure pursuit: 曲率 κ = 2 sin(α) / L（α: 目標方向とのズレ, L: 先読み距離）に比例した左右差
+# - ゴール(引き渡し半径)に近づくほど減速する
+#
+# 符号は turn_by_angle() / md.turn() と同じ（calculate_distance_and_angle の角度が正なら Yaw を増やす向き）
+
+import math
+from collections import deque
+
+import pyproj
+
+from gps import calculate_distance_and_angle, ERROR_DISTANCE
+
+_geod = pyproj.Geod(ellps="WGS84")
+
+
+def _wrap180(deg):
+    return (deg + 180.0) % 360.0 - 180.0
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """2点間の測地線距離 [m]（CSVには記録しない）"""
+    _, _, dist = _geod.inv(lon1, lat1, lon2, lat2)
+    return dist
+
+
+def _mean_yaw(yaws):
+    """角度の平均（0/360をまたいでも正しく平均する）。空なら None"""
+    yaws = [y for y in yaws if y is not None]
+    if not yaws:
+        return None
+    s = sum(math.sin(math.radians(y)) for y in yaws)
+    c = sum(math.cos(math.radians(y)) for y in yaws)
+    return math.degrees(math.atan2(s, c)) % 360.0
+
+
+class PurePursuit:
+    def __init__(
+        self,
+        yaw_fn,                 # yaw_fn(is_inverted) -> 地面基準のYaw[deg] or None
+        goal_lat,
+        goal_lon,
+        lookahead=8.0,          # 先読み距離 [m]（ゴールがこれより近ければゴールまでの距離）
+        gain=2.0,               # 曲率 [1/m] → 左右差 [モーター値]
+        max_turn=0.3,           # 左右差の上限 [モーター値]
+        max_power=0.7,          # 巡航パワー
+        min_power=0.45,         # 引き渡し半径付近のパワー
+        handover=10.0,          # 近距離フェーズへの引き渡し半径 [m]
+        slow_radius=25.0,       # これより近づいたら減速を始める [m]
+        min_baseline=2.0,       # 方位を計算する走行ベクトルの最小長 [m]（短いとGPSの誤差で方位が暴れる）
+    ):
+        self.yaw_fn = yaw_fn
+        self.goal_lat = goal_lat
+        self.goal_lon = goal_lon
+        self.lookahead = float(lookahead)
+        self.gain = float(gain)
+        self.max_turn = float(max_turn)
+        self.max_power = float(max_power)
+        self.min_power = float(min_power)
+        self.handover = float(handover)
+        self.slow_radius = max(float(slow_radius), self.handover + 1.0)
+        self.min_baseline = float(min_baseline)
+
+        self.is_inverted = False
+        self.distance = None      # 直近の測位でのゴールまでの距離 [m]
+        self.target_yaw = None    # 目標Yaw [deg]（まだ方位が分からなければ None）
+        self.alpha = 0.0          # 直近の操舵でのズレ [deg]
+        self._fixes = deque(maxlen=60)   # (lat, lon, 測位時のYaw)
+
+    def reset_heading(self):
+        """スタック脱出などで向きが大きく変わったとき、過去の走行ベクトルを捨てる"""
+        self._fixes.clear()
+        self.target_yaw = None
+
+    def add_fix(self, lat, lon):
+        """
+        新しい測位を入れて距離と目標Yawを更新する
+        Return:
+            (distance, angle_deg): angle_deg は走行ベクトルに対するゴールの方位ズレ（まだ計算できなければ None）
+        """
+        yaw = self.yaw_fn(self.is_inverted)
+
+        # 今の位置から min_baseline 以上離れた、一番新しい過去の測位を基準にする
+        ref = None
+        yaws = [yaw]
+        for f_lat, f_lon, f_yaw in reversed(self._fixes):
+            yaws.append(f_yaw)
+            if distance_m(f_lat, f_lon, lat, lon) >= self.min_baseline:
+                ref = (f_lat, f_lon)
+                break
+        self._fixes.append((lat, lon, yaw))
+
+        if ref is None:
+            # まだ十分に進んでいないので距離だけ更新（方位はそのまま）
+            self.distance = distance_m(lat, lon, self.goal_lat, self.goal_lon)
+            return self.distance, None
+
+        d, ang = calculate_distance_and_angle(lat, lon, ref[0], ref[1], self.goal_lat, self.goal_lon)
+        if d >= ERROR_DISTANCE:
+            return self.distance, None
+        self.distance = d
+        angle_deg = math.degrees(ang)
+
+        # 走行ベクトルの向き ≒ その間のYaw平均
+        motion_yaw = _mean_yaw(yaws)
+        if motion_yaw is not None:
+            self.target_yaw = (motion_yaw + angle_deg) % 360.0
+        return d, angle_deg
+
+    def power(self):
+        if self.distance is None:
+            return self.max_power
+        x = (self.distance - self.handover) / (self.slow_radius - self.handover)
+        x = min(1.0, max(0.0, x))
+        return self.min_power + (self.max_power - self.min_power) * x
+
+    def __call__(self):
+        """MotorController.steer(guide=...) から制御周期ごとに呼ばれる。Return: (power, turn)"""
+        power = self.power()
+        yaw = self.yaw_fn(self.is_inverted) if self.target_yaw is not None else None
+        if yaw is None:
+            return power, 0.0
+
+        alpha = _wrap180(self.target_yaw - yaw)
+        self.alpha = alpha
+        if abs(alpha) >= 90.0:
+            # 後ろ向き: sin では曲がりが弱くなるので最大で回す
+            turn = math.copysign(self.max_turn, alpha)
+        else:
+            dist = self.distance if self.distance is not None else self.lookahead
+            L = max(1.0, min(self.lookahead, dist))
+            turn = self.gain * 2.0 * math.sin(math.radians(alpha)) / L
+            turn = max(-self.max_turn, min(self.max_turn, turn))
+        # 大きくズレている間は速度を落として小さく回る
+        power *= max(0.6, math.cos(math.radians(min(abs(alpha), 90.0))))
+        return power, turn
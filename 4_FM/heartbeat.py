@@ -0,0 +1,85 @@
+# Heartbeat for the supervisor (supervisor.py) for CanSat SC-28
+# - メインスレッドが生きていることを、「この時刻までに次の beat をする」という期限としてファイルに書く
+# - supervisor.py が環境変数 SC28_HEARTBEAT でファイルの場所を渡したときだけ有効（単体で動かすときは何もしない）
+# - 長く止まると分かっている処理（15秒の前進、YOLOの読み込みなど）の前は beat(expect=秒) で期限を延ばす
+# - 別スレッドからの beat は無視する（制御スレッドが動いていてもメインが固まっていれば再起動させたい）
+#
+# 使い方:
+#   import heartbeat
+#   heartbeat.beat()              # ループのたびに（書き込みは BEAT_INTERVAL ごとに間引く）
+#   heartbeat.beat(expect=15.0)   # この後 15 秒戻ってこない
+#   heartbeat.set_phase(3)
+
+import os
+import time
+import threading
+
+ENV_PATH = "SC28_HEARTBEAT"
+ENV_TIMEOUT = "SC28_HEARTBEAT_TIMEOUT"
+ENV_CAUSE = "SC28_RESTART_CAUSE"
+ENV_RESTARTS = "SC28_RESTARTS"
+
+BEAT_INTERVAL = 0.5          # 書き込みの最小間隔 [s]
+
+_path = os.environ.get(ENV_PATH) or None
+_timeout = float(os.environ.get(ENV_TIMEOUT, "8.0"))
+_phase = None
+_last_write = None
+_deadline = 0.0
+
+
+def enabled():
+    return _path is not None
+
+
+def set_phase(phase):
+    """今のフェーズ（supervisor が再起動理由に書く）"""
+    global _phase
+    _phase = phase
+    beat(force=True)
+
+
+def beat(expect=0.0, force=False):
+    """
+    生きていることを知らせる。次の beat が timeout + expect 秒以内に来なければ supervisor が再起動する
+    """
+    global _last_write, _deadline
+    if _path is None or threading.current_thread() is not threading.main_thread():
+        return
+    now = time.monotonic()
+    deadline = now + _timeout + expect
+    # 間引く: 間隔が短く、期限も延びないなら書かない
+    if not force and _last_write is not None and now - _last_write < BEAT_INTERVAL and deadline <= _deadline + BEAT_INTERVAL:
+        return
+    _write(f"{os.getpid()} {deadline:.3f} {_phase if _phase is not None else '-'}\n")
+    _last_write = now
+    _deadline = deadline
+
+
+def _write(text):
+    # CLOCK_MONOTONIC はプロセス間で共通なので、supervisor はそのまま自分の time.monotonic() と比べられる
+    tmp = f"{_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, _path)
+    except OSError:
+        pass
+
+
+def read(path):
+    """(pid, 期限, フェーズ) を読む（無い・壊れていれば None）"""
+    try:
+        with open(path) as f:
+            pid, deadline, phase = f.read().split()
+        return int(pid), float(deadline), (None if phase == "-" else phase)
+    except (OSError, ValueError):
+        return None
+
+
+def restart_cause():
+    """supervisor に再起動された場合は (理由, 再起動回数)。そうでなければ None"""
+    cause = os.environ.get(ENV_CAUSE)
+    if not cause:
+        return None
+    return cause, int(os.environ.get(ENV_RESTARTS, "0"))
@@ -0,0 +1,213 @@
+# HSV threshold tuner for CanSat SC-28
+# - ラベル付き画像(コーンの矩形)から、Camera の赤色しきい値(hsv_min1/max1/min2/max2)を自動で探索する
+# - 各画像のHSVヒストグラム(H:180 x S:32 x V:32)を1回だけ作り、
+#   全しきい値候補の「矩形内で赤判定された画素数」「矩形外で赤判定された画素数」を累積和でまとめて計算する
+# - 評価値は 画素IoU = 矩形内の赤画素 / (矩形の画素数 + 矩形外の赤画素) の平均
+#   コーンが写っていない画像(ラベル null)は、赤が検出しきい値(0.1%)未満なら1点
+# - 結果は Camera(hsv_profile=...) で読み込めるJSONとして出力する
+#
+# 使い方:
+#   python3 hsv_tuner.py --labels labels.json --out hsv_profile.json
+#   python3 hsv_tuner.py --yolo ./my_custom_model.pt --runs run_20260306_141437 --write-labels labels.json
+#
+# labels.json の形式（パスは --pic-dir からの相対パス、null はコーン無し）:
+#   {"run_20260306_141437/raw_1772773000123_000001.jpg": [x, y, w, h], "run_.../raw_...jpg": null}
+
+import os
+import json
+import argparse
+
+import cv2
+import numpy as np
+
+from detector_replay import DEFAULT_PIC_DIR, list_runs, list_images
+
+S_BIN = 8                    # S,V は 8刻み(32ビン)でしきい値を探す
+N_SV = 256 // S_BIN
+LOW_HUE_MAX = range(0, 31)   # 低い側の赤: H = 0 ~ hl
+HIGH_HUE_MIN = range(150, 180)  # 高い側の赤: H = hh ~ 179
+RED_PERCENT_MIN = 0.001      # Camera が「赤あり」とみなす割合
+
+
+def load_labels(path):
+    with open(path, encoding="utf-8") as f:
+        labels = json.load(f)
+    if not isinstance(labels, dict):
+        raise ValueError(f"{path}: labels must be a JSON object")
+    return labels
+
+
+def yolo_labels(image_paths, pic_dir, model_path, conf_min=0.25, target_class="cone"):
+    """YOLOの検出結果からラベルを作る（検出できなかった画像はラベル無しとして除外）"""
+    from camera import get_model
+
+    model = get_model(model_path)
+    names = getattr(model, "names", {}) or {}
+    items = names.items() if isinstance(names, dict) else enumerate(names)
+    target_ids = [int(k) for k, v in items if str(v).strip().lower() == target_class] or [0]
+
+    labels = {}
+    for path in image_paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        results = model.predict(img, save=False, show=False, verbose=False)
+        if not results or results[0].boxes is None or len(results[0].boxes) == 0:
+            continue
+        boxes = results[0].boxes.xyxy.cpu().numpy()
+        confs = results[0].boxes.conf.cpu().numpy()
+        classes = results[0].boxes.cls.cpu().numpy().astype(int)
+        valid = np.isin(classes, target_ids) & (confs >= conf_min)
+        if not np.any(valid):
+            continue
+        xmin, ymin, xmax, ymax = map(int, boxes[valid][int(np.argmax(confs[valid]))])
+        labels[os.path.relpath(path, pic_dir)] = [xmin, ymin, xmax - xmin, ymax - ymin]
+    return labels
+
+
+def hsv_histograms(img, box):
+    """
+    矩形内・矩形外それぞれのHSVヒストグラム (180, 32, 32) を返す
+    """
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    idx = (hsv[:, :, 0].astype(np.int32) * N_SV + (hsv[:, :, 1] // S_BIN)) * N_SV + (hsv[:, :, 2] // S_BIN)
+
+    inside = np.zeros(idx.shape, dtype=bool)
+    if box is not None:
+        x, y, w, h = [int(v) for v in box]
+        inside[max(0, y):y + h, max(0, x):x + w] = True
+
+    size = 180 * N_SV * N_SV
+    h_in = np.bincount(idx[inside], minlength=size).reshape(180, N_SV, N_SV)
+    h_out = np.bincount(idx[~inside], minlength=size).reshape(180, N_SV, N_SV)
+    return h_in, h_out
+
+
+def _pass_counts(hist):
+    """
+    全候補 (hl, hh, s_min, v_min) について、しきい値を通過する画素数を返す
+    Return: shape (len(LOW_HUE_MAX), len(HIGH_HUE_MIN), 32, 32)
+    """
+    # S,V は「しきい値以上」なので後ろからの累積和
+    sv = hist[:, ::-1, ::-1].cumsum(axis=1).cumsum(axis=2)[:, ::-1, ::-1]
+    # H は前からの累積和 (P[k] = H<k の合計)
+    p = np.concatenate([np.zeros((1, N_SV, N_SV), dtype=sv.dtype), sv.cumsum(axis=0)], axis=0)
+
+    hl = np.array(LOW_HUE_MAX)
+    hh = np.array(HIGH_HUE_MIN)
+    low = p[hl + 1][:, None]                 # H = 0 ~ hl
+    high = (p[180] - p[hh])[None, :]        # H = hh ~ 179
+    return low + high
+
+
+def optimize(samples):
+    """
+    samples: [(h_in, h_out, box_pixels, total_pixels), ...]
+    Return: (best_profile, best_score, score_grid)
+    """
+    score = None
+    for h_in, h_out, box_pixels, total in samples:
+        fp = _pass_counts(h_out)
+        if box_pixels > 0:
+            tp = _pass_counts(h_in)
+            s = tp / (box_pixels + fp)
+        else:
+            s = (fp < RED_PERCENT_MIN * total).astype(np.float64)
+        score = s if score is None else score + s
+    score = score / len(samples)
+
+    i, j, si, vi = np.unravel_index(int(np.argmax(score)), score.shape)
+    profile = make_profile(LOW_HUE_MAX[i], HIGH_HUE_MIN[j], si * S_BIN, vi * S_BIN)
+    return profile, float(score[i, j, si, vi]), score
+
+
+def make_profile(hl, hh, s_min, v_min):
+    return {
+        "hsv_min1": [0, int(s_min), int(v_min)],
+        "hsv_max1": [int(hl), 255, 255],
+        "hsv_min2": [int(hh), int(s_min), int(v_min)],
+        "hsv_max2": [179, 255, 255],
+    }
+
+
+def evaluate_profile(images, profile):
+    """cv2.inRange で実際にマスクを作り、画素IoUの平均を求める（探索結果の確認用）"""
+    scores = []
+    for img, box in images:
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        mask = cv2.bitwise_or(
+            cv2.inRange(hsv, np.array(profile["hsv_min1"]), np.array(profile["hsv_max1"])),
+            cv2.inRange(hsv, np.array(profile["hsv_min2"]), np.array(profile["hsv_max2"])),
+        ) > 0
+        if box is None:
+            scores.append(1.0 if mask.mean() < RED_PERCENT_MIN else 0.0)
+            continue
+        x, y, w, h = [int(v) for v in box]
+        inside = np.zeros(mask.shape, dtype=bool)
+        inside[max(0, y):y + h, max(0, x):x + w] = True
+        tp = np.count_nonzero(mask & inside)
+        fp = np.count_nonzero(mask & ~inside)
+        scores.append(tp / float(np.count_nonzero(inside) + fp))
+    return float(np.mean(scores)) if scores else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search Camera HSV red thresholds from labeled images")
+    parser.add_argument("--pic-dir", default=DEFAULT_PIC_DIR, help="5_log/picture directory")
+    parser.add_argument("--labels", help="labels JSON {relative image path: [x, y, w, h] or null}")
+    parser.add_argument("--yolo", help="derive labels with this YOLO model instead of --labels")
+    parser.add_argument("--runs", nargs="*", help="run_* folders used with --yolo (default: all)")
+    parser.add_argument("--write-labels", help="save the labels actually used (for manual correction)")
+    parser.add_argument("--out", default="hsv_profile.json", help="output profile for Camera(hsv_profile=...)")
+    args = parser.parse_args()
+
+    if args.labels:
+        labels = load_labels(args.labels)
+    elif args.yolo:
+        paths = []
+        for run_dir in list_runs(args.pic_dir, args.runs):
+            paths.extend(list_images(run_dir)[0])
+        labels = yolo_labels(paths, args.pic_dir, args.yolo)
+    else:
+        parser.error("either --labels or --yolo is required")
+
+    if args.write_labels:
+        with open(args.write_labels, "w", encoding="utf-8") as f:
+            json.dump(labels, f, indent=1, ensure_ascii=False)
+
+    images = []
+    samples = []
+    for rel, box in sorted(labels.items()):
+        img = cv2.imread(os.path.join(args.pic_dir, rel), cv2.IMREAD_COLOR)
+        if img is None:
+            print(f"Warning: cannot read {rel}")
+            continue
+        h_in, h_out = hsv_histograms(img, box)
+        samples.append((h_in, h_out, int(h_in.sum()), img.shape[0] * img.shape[1]))
+        images.append((img, box))
+
+    if not samples:
+        print("No labeled images.")
+        return
+
+    from camera import DEFAULT_HSV_PROFILE
+    base_score = evaluate_profile(images, DEFAULT_HSV_PROFILE)
+
+    profile, score, grid = optimize(samples)
+    check = evaluate_profile(images, profile)
+    print(f"images={len(samples)} candidates={grid.size}")
+    print(f"current thresholds : IoU={base_score:.4f}")
+    print(f"best thresholds    : IoU={score:.4f} (inRange check {check:.4f})")
+    for k in ("hsv_min1", "hsv_max1", "hsv_min2", "hsv_max2"):
+        print(f"  {k} = {profile[k]}")
+
+    out = dict(profile)
+    out["score"] = round(check, 4)
+    out["images"] = len(samples)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2)
+    print(f"Profile written: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import time
 
+import profiler
+import heartbeat
+
 try:
     import make_csv
 except ImportError:
@@ -26,11 +29,16 @@ abnormal_value_table = {
 # ★ 第1引数を削除し、value_name からスタート
 def abnormal_check(value_name, read_func, ERROR_FLAG=True, max_retries=3, retry_delay=0.1, csv_label=None):
     for attempt in range(max_retries + 1):
+        heartbeat.beat()
+        t_read = profiler.mark()
         try:
             sensor_value = read_func()
         except Exception as e:
             print(f"[{value_name}] 値の取得時にエラー発生: {e}")
             sensor_value = None
+        if t_read is not None:
+            name = "_".join(value_name) if isinstance(value_name, (list, tuple)) else value_name
+            profiler.record(f"ijochi.read.{name}", t_read)
 
         is_abnormal = False
         
@@ -97,7 +105,8 @@ def abnormal_check(value_name, read_func, ERROR_FLAG=True, max_retries=3, retry_
         if is_abnormal:
             if attempt < max_retries:
                 print(f"[{value_name}] 異常値検知 (値: {sensor_value})。{retry_delay}秒後に再取得します (リトライ {attempt+1}/{max_retries})...")
-                time.sleep(retry_delay)
+                with profiler.span("ijochi.retry_sleep"):
+                    time.sleep(retry_delay)
             else:
                 # リトライ上限に達した時の処理
                 
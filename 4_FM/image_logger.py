@@ -0,0 +1,174 @@
+# Image logger for CanSat SC-28
+# - JPEG保存を別スレッドで行い、フェーズ4のループを cv2.imwrite で止めない
+# - キューは上限付き（溢れたら古いループを待たせず、そのフレームを捨てる）
+# - ファイル名はミリ秒＋連番（同じ秒に2枚保存しても衝突しない）
+# - 直近Nフレームをメモリに保持し、イベント(ゴール/ロスト/スタック)発生時に前後の画像をまとめて保存
+
+import os
+import time
+import queue
+import threading
+from collections import deque
+
+import cv2
+
+import profiler
+
+# ★ make_csvを安全にインポート
+try:
+    import make_csv
+except ImportError:
+    make_csv = None
+    print("Warning: make_csv module not found. Logging will be disabled.")
+
+
+class ImageLogger:
+    def __init__(
+        self,
+        save_dir,
+        interval=1.0,        # 定期保存の間隔 [s]
+        quality=80,          # JPEG品質 (0~100)
+        scale=1.0,           # 保存時の縮小率 (0.5なら320x240)
+        queue_size=32,       # 書き込み待ちの最大枚数
+        pre_frames=10,       # イベント前に保持しておくフレーム数
+        post_frames=5,       # イベント後に追加で保存するフレーム数
+    ):
+        self.save_dir = save_dir
+        self.interval = float(interval)
+        self.quality = int(max(0, min(100, quality)))
+        self.scale = float(scale)
+        self.post_frames = max(0, int(post_frames))
+
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._ring = deque(maxlen=max(0, int(pre_frames)))
+        self._seq = 0
+        self._last_save_time = 0.0
+        self._post_remaining = 0
+        self._post_tag = ""
+        self._dir_ready = False
+        self._thread = None
+
+        self.saved = 0      # 書き込み成功枚数
+        self.dropped = 0    # キュー満杯で捨てた枚数
+
+    # ----------------------------
+    # スレッド制御
+    # ----------------------------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._worker, name="image-logger", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=3.0):
+        """キューに残った画像を書き出してからスレッドを止める"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        print(f"Image logger closed (saved={self.saved}, dropped={self.dropped})")
+        if make_csv:
+            try: make_csv.print('msg', f"image logger closed (saved={self.saved}, dropped={self.dropped})")
+            except Exception: pass
+
+    def _ensure_dir(self):
+        if self._dir_ready:
+            return True
+        try:
+            os.makedirs(self.save_dir, exist_ok=True)
+            self._dir_ready = True
+        except Exception as e:
+            print(f"フォルダ作成エラー: {e}")
+            if make_csv:
+                try: make_csv.print('error', f"フォルダ作成エラー: {e}")
+                except Exception: pass
+        return self._dir_ready
+
+    def _worker(self):
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            filename, frame = item
+            if not self._ensure_dir():
+                continue
+            try:
+                if self.scale != 1.0:
+                    frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale,
+                                       interpolation=cv2.INTER_AREA)
+                with profiler.span("image.imwrite"):
+                    ok = cv2.imwrite(os.path.join(self.save_dir, filename), frame, params)
+                if ok:
+                    self.saved += 1
+            except Exception as e:
+                print(f"画像保存エラー: {e}")
+                if make_csv:
+                    try: make_csv.print('error', f"画像保存エラー: {e}")
+                    except Exception: pass
+
+    # ----------------------------
+    # 呼び出し側API（どれもブロックしない）
+    # ----------------------------
+    @property
+    def post_remaining(self):
+        """直前のイベントの後に、まだ保存していないフレーム数"""
+        return self._post_remaining
+
+    def submit(self, frame, tag="img", timestamp=None):
+        """1枚を書き込みキューに積む。満杯なら捨てて False を返す"""
+        if frame is None:
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+        self._seq += 1
+        filename = f"{tag}_{int(timestamp * 1000)}_{self._seq:06d}.jpg"
+        try:
+            self._queue.put_nowait((filename, frame))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def log(self, frame, raw=None):
+        """
+        毎フレーム呼ぶ。リングバッファへの保持、イベント後の追加保存、定期保存をまとめて行う
+        Args:
+            frame: 注釈付きの画像
+            raw: 注釈前の画像（あれば一緒に保存する）
+        """
+        now = time.time()
+        self._ring.append((now, frame, raw))
+
+        if self._post_remaining > 0:
+            self._post_remaining -= 1
+            self.submit(frame, tag=f"evt-{self._post_tag}-post", timestamp=now)
+            if raw is not None:
+                self.submit(raw, tag=f"evt-{self._post_tag}-post-raw", timestamp=now)
+            return
+
+        if (now - self._last_save_time) >= self.interval:
+            self._last_save_time = now
+            self.submit(frame, tag="img", timestamp=now)
+            if raw is not None:
+                self.submit(raw, tag="raw", timestamp=now)
+
+    def trigger(self, event):
+        """
+        イベント発生時に呼ぶ。保持している直前のフレームを全て保存し、続く post_frames 枚も保存する
+        """
+        frames = list(self._ring)
+        self._ring.clear()
+        for ts, frame, raw in frames:
+            self.submit(frame, tag=f"evt-{event}-pre", timestamp=ts)
+            if raw is not None:
+                self.submit(raw, tag=f"evt-{event}-pre-raw", timestamp=ts)
+        self._post_remaining = self.post_frames
+        self._post_tag = event
+        if make_csv:
+            try: make_csv.print('msg', f"image event [{event}]: {len(frames)} frames dumped")
+            except Exception: pass
@@ -10,6 +10,8 @@ import builtins
 import atexit  # ★ 追加：プログラム終了時の処理用
 from datetime import datetime
 
+import profiler
+
 # ★ log_file をグローバルで初期化しておく
 log_file = None
 
@@ -19,10 +21,11 @@ try:
     # ログファイルの列定義（順番重要）
     msg_types = [
         'time', 'date', 'file', 'func', 'line', 'serious_error', 'error', 'warning', 'msg', 'format_exception', 
-        'phase', 'gnss_time', 'lat', 'lon', 'alt', 'alt_base_press', 'goal_lat', 'goal_lon', 
+        'phase', 'gnss_time', 'lat', 'lon', 'alt', 'climb_rate', 'alt_conf', 'accel_up', 'alt_base_press', 'goal_lat', 'goal_lon', 
         'temp', 'press', 'camera_area', 'camera_order', 'camera_center_x', 'camera_center_y', 
-        'camera_frame_size_x', 'camera_frame_size_y', 'motor_l', 'motor_r', 
-        'goal_relative_x', 'goal_relative_y', 'goal_relative_angle_rad', 'goal_distance', 
+        'camera_frame_size_x', 'camera_frame_size_y', 'camera_track_conf', 'motor_l', 'motor_r', 
+        'motor_cmd_start', 'motor_cmd_dir', 'motor_cmd_power', 'motor_cmd_ramp', 'motor_cmd_duration', 'motor_cmd_stack', 
+        'goal_relative_x', 'goal_relative_y', 'goal_relative_angle_rad', 'goal_distance', 'heading_error', 'stack_prob', 
         'accel_all_x', 'accel_all_y', 'accel_all_z', 'accel_line_x', 'accel_line_y', 'accel_line_z', 
         'mag_x', 'mag_y', 'mag_z', 'gyro_x', 'gyro_y', 'gyro_z', 'grav_x', 'grav_y', 'grav_z', 
         'euler_x', 'euler_y', 'euler_z', 'nmea'
@@ -38,8 +41,12 @@ try:
 
     current_time_str = datetime.now().strftime("%Y%m%d_%H%M%S")
     
+    # 別プロセス（sensor_proc.py / vision_proc.py）は SC28_LOG_TAG を付けた別ファイルに書く（例: log_..._vision.csv）
+    log_tag = os.environ.get('SC28_LOG_TAG')
+    suffix = f'_{log_tag}' if log_tag else ''
+
     # ディレクトリパスとファイル名を結合
-    filename = os.path.join(log_dir, f'log_{current_time_str}.csv')
+    filename = os.path.join(log_dir, f'log_{current_time_str}{suffix}.csv')
 
     # ファイル作成とヘッダー書き込み
     if not os.path.exists(filename) or os.path.getsize(filename) == 0:
@@ -73,9 +80,10 @@ def print(msg_type : str, msg_data):
     if log_file is None:
         return
 
+    t_print = profiler.mark()
     try:
         special_keys = ['accel_all', 'accel_line', 'mag', 'gyro', 'grav', 'euler', 
-                        'goal_relative', 'camera_center', 'camera_frame_size', 'motor', 'lat_lon']
+                        'goal_relative', 'camera_center', 'camera_frame_size', 'motor', 'motor_cmd', 'lat_lon']
         
         # ガード処理
         if msg_type not in msg_types and msg_type not in special_keys:
@@ -104,6 +112,13 @@ def print(msg_type : str, msg_data):
                     output_dict['motor_l'] = str(msg_data[0])
                     output_dict['motor_r'] = str(msg_data[1])
             
+            elif msg_type == 'motor_cmd':
+                # (開始時刻, 方向, 目標パワー, ランプ, 所要時間, スタック, 左, 右)
+                if isinstance(msg_data, (list, tuple)) and len(msg_data) >= 6:
+                    for key, val in zip(['motor_cmd_start', 'motor_cmd_dir', 'motor_cmd_power', 'motor_cmd_ramp',
+                                         'motor_cmd_duration', 'motor_cmd_stack', 'motor_l', 'motor_r'], msg_data):
+                        output_dict[key] = str(val)
+
             elif msg_type == 'lat_lon':
                  if isinstance(msg_data, (list, tuple)) and len(msg_data) >= 2:
                     output_dict['lat'] = str(msg_data[0])
@@ -145,4 +160,5 @@ def print(msg_type : str, msg_data):
         log_file.flush()
         
     except Exception as e:
-        builtins.print(f"An error occured in printing to csv: {e}")
\ No newline at end of file
+        builtins.print(f"An error occured in printing to csv: {e}")
+    profiler.record("make_csv.print", t_print)
\ No newline at end of file
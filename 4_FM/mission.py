@@ -0,0 +1,308 @@
+# Mission framework for CanSat SC-28
+# - フェーズを enter / tick / exit を持つオブジェクトとして書き、スケジューラが決まった周期で tick を呼ぶ
+# - tick が次のフェーズ番号を返したら遷移する。遷移ガード(guard)で条件を満たさない遷移は止める
+# - フェーズと関係なく回したい処理（温度の記録など）は every() で登録し、tick の合間に実行する
+# - フェーズごとの滞在時間・tick の処理時間・周期超過回数を自動で集計し、フェーズを抜けるたびにCSVへ記録する
+# - 時計(clock)と待ち(sleep)は差し替えられる（シミュレーターで仮想時間を使う用）
+# - profiler が有効なら、計測をフェーズごとに分けて集計し、フェーズを抜けるたびにその内訳も記録する
+# - on_enter() で登録した関数はフェーズに入るたび（enter の前）に呼ばれる（チェックポイントの保存など）
+# - ループを回るたびに heartbeat.beat() する（supervisor.py の下で動いているときだけ有効）
+
+import time
+
+import profiler
+import heartbeat
+
+# ★ make_csvを安全にインポート
+try:
+    import make_csv
+except ImportError:
+    make_csv = None
+    print("Warning: make_csv module not found. Logging will be disabled.")
+
+
+def _log(msg_type, msg):
+    if make_csv:
+        try: make_csv.print(msg_type, msg)
+        except Exception: pass
+
+
+class Phase:
+    """
+    1つのフェーズ。サブクラスで number / name / period と enter/tick/exit を書く
+    tick() は1周期ぶんの処理をして、遷移するなら次のフェーズ番号を返す（留まるなら None）
+    """
+    number = 0
+    name = ""
+    period = 0.1    # tick の周期 [s]（tick の処理がこれより長ければ待たずに次を呼ぶ）
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.mission = None
+        self.entered_at = None
+        self._timers = {}
+
+    # ----------------------------
+    # フック（必要なものだけ上書きする）
+    # ----------------------------
+    def enter(self):
+        pass
+
+    def tick(self):
+        return None
+
+    def exit(self):
+        pass
+
+    def on_error(self, e):
+        """tick で例外が出たとき。既定はログを残してそのフェーズを続ける"""
+        print(f"\n予期せぬエラーが発生しました: {e}")
+        _log("serious_error", f"予期せぬエラーが発生しました: {e}")
+        self.mission.sleep(2.0)
+
+    # ----------------------------
+    # フェーズ内タイマー（enter のたびにリセットされる）
+    # ----------------------------
+    def now(self):
+        return self.mission.clock()
+
+    @property
+    def elapsed(self):
+        """このフェーズに入ってからの時間 [s]"""
+        return self.now() - self.entered_at if self.entered_at is not None else 0.0
+
+    def start_timer(self, name, duration):
+        self._timers[name] = self.now() + duration
+
+    def cancel_timer(self, name):
+        self._timers.pop(name, None)
+
+    def timer_running(self, name):
+        return name in self._timers and self.now() < self._timers[name]
+
+    def timer_expired(self, name):
+        """タイマーが設定されていて、時間が過ぎていれば True"""
+        return name in self._timers and self.now() >= self._timers[name]
+
+
+class PhaseStats:
+    """フェーズごとの時間計測"""
+    def __init__(self):
+        self.entries = 0
+        self.total_time = 0.0
+        self.ticks = 0
+        self.tick_time = 0.0
+        self.tick_max = 0.0
+        self.overruns = 0       # tick が周期より長くかかった回数
+        self.errors = 0
+
+    def add_tick(self, dt, period):
+        self.ticks += 1
+        self.tick_time += dt
+        self.tick_max = max(self.tick_max, dt)
+        if period > 0 and dt > period:
+            self.overruns += 1
+
+    def summary(self):
+        mean = self.tick_time / self.ticks * 1000.0 if self.ticks else 0.0
+        return (f"entries={self.entries} time={self.total_time:.1f}s ticks={self.ticks} "
+                f"tick mean={mean:.1f}ms max={self.tick_max * 1000.0:.1f}ms "
+                f"overruns={self.overruns} errors={self.errors}")
+
+
+class _Task:
+    def __init__(self, period, fn, phases, name):
+        self.period = float(period)
+        self.fn = fn
+        self.phases = None if phases is None else set(phases)
+        self.name = name or getattr(fn, "__name__", "task")
+        self.next_t = None
+
+
+class Mission:
+    def __init__(self, phases, initial, clock=time.monotonic, sleep=time.sleep):
+        """
+        phases: Phase インスタンスのリスト
+        initial: 最初のフェーズ番号
+        """
+        self.phases = {}
+        for p in phases:
+            p.mission = self
+            self.phases[p.number] = p
+        self.initial = initial
+        self.clock = clock
+        self.sleep = sleep
+
+        self.current = None
+        self.stats = {n: PhaseStats() for n in self.phases}
+        self._guards = []
+        self._tasks = []
+        self._enter_hooks = []
+        self._running = False
+        self._next_tick = None
+
+    # ----------------------------
+    # 登録
+    # ----------------------------
+    def guard(self, to_phase, fn, from_phase=None, reason=""):
+        """
+        遷移ガードを登録する。fn(ctx) が False を返したら to_phase への遷移を取りやめて今のフェーズに留まる
+        from_phase を指定するとその遷移元からのときだけ調べる
+        """
+        self._guards.append((from_phase, to_phase, fn, reason))
+
+    def every(self, period, fn, phases=None, name=None):
+        """tick の合間に period 秒ごとに fn() を呼ぶ（phases を指定するとそのフェーズ中だけ）"""
+        self._tasks.append(_Task(period, fn, phases, name))
+
+    def on_enter(self, fn):
+        """フェーズに入るたびに fn(フェーズ番号) を呼ぶ（phase.enter() の前）"""
+        self._enter_hooks.append(fn)
+
+    # ----------------------------
+    # 遷移
+    # ----------------------------
+    def _allowed(self, src, dst):
+        for from_phase, to_phase, fn, reason in self._guards:
+            if to_phase != dst or (from_phase is not None and from_phase != src):
+                continue
+            try:
+                ok = fn(self.current.ctx if self.current else None)
+            except Exception as e:
+                ok = False
+                reason = f"{reason} ({e})"
+            if not ok:
+                msg = f"transition {src}->{dst} blocked: {reason}"
+                print(msg)
+                _log("warning", msg)
+                return False
+        return True
+
+    def _enter(self, number):
+        phase = self.phases[number]
+        self.current = phase
+        phase.entered_at = self.clock()
+        phase._timers = {}
+        self.stats[number].entries += 1
+        profiler.set_phase(number)
+        heartbeat.set_phase(number)
+        _log("phase", str(number))
+        for fn in self._enter_hooks:
+            try:
+                fn(number)
+            except Exception as e:
+                _log("error", f"enter hook error: {e}")
+        phase.enter()
+        self._next_tick = self.clock()
+
+    def _exit(self):
+        phase = self.current
+        if phase is None:
+            return
+        try:
+            phase.exit()
+        finally:
+            st = self.stats[phase.number]
+            st.total_time += self.clock() - phase.entered_at
+            msg = f"phase {phase.number} ({phase.name}) exit: {st.summary()}"
+            print(msg)
+            _log("msg", msg)
+            profiler.dump(phase.number)
+
+    def transition(self, number):
+        """次のフェーズへ移る（ガードで止められたら False）"""
+        src = self.current.number if self.current else None
+        if number == src:
+            return True
+        if number not in self.phases:
+            _log("error", f"unknown phase {number}")
+            return False
+        if not self._allowed(src, number):
+            return False
+        self._exit()
+        self._enter(number)
+        return True
+
+    # ----------------------------
+    # スケジューラ
+    # ----------------------------
+    def _run_tasks(self, now):
+        for task in self._tasks:
+            if task.phases is not None and self.current.number not in task.phases:
+                continue
+            if task.next_t is None or now >= task.next_t:
+                task.next_t = now + task.period
+                try:
+                    with profiler.span(f"task.{task.name}"):
+                        task.fn()
+                except Exception as e:
+                    _log("error", f"task {task.name} error: {e}")
+
+    def step(self):
+        """1回分: 期限の来たタスクと、現フェーズの tick を実行する（次の tick までは待たない）"""
+        if self.current is None:
+            self._enter(self.initial)
+        phase = self.current
+        self._run_tasks(self.clock())
+
+        heartbeat.beat()
+        t0 = self.clock()
+        nxt = None
+        try:
+            nxt = phase.tick()
+        except Exception as e:
+            self.stats[phase.number].errors += 1
+            phase.on_error(e)
+        t1 = self.clock()
+        self.stats[phase.number].add_tick(t1 - t0, phase.period)
+
+        # ガードで止められたときも、今のフェーズの次の tick まで待つ（待たずに回り続けない）
+        if nxt is None or nxt == phase.number or not self.transition(nxt):
+            self._next_tick += phase.period
+            if self._next_tick < t1:
+                self._next_tick = t1  # 遅れた分は追いかけない
+        return nxt
+
+    def run(self, until=None):
+        """
+        stop() されるまで（または until のフェーズに入るまで）回し続ける
+        tick の間の待ち時間にもタスクを実行する
+        """
+        self._running = True
+        if self.current is None:
+            self._enter(self.initial)
+        while self._running:
+            if until is not None and self.current.number == until:
+                break
+            self.step()
+            wait = self._next_tick - self.clock()
+            while wait > 0 and self._running:
+                due = [t.next_t for t in self._tasks
+                       if t.next_t is not None and (t.phases is None or self.current.number in t.phases)]
+                nearest = min([self._next_tick] + due)
+                self.sleep(max(0.0, min(wait, nearest - self.clock())))
+                heartbeat.beat()
+                self._run_tasks(self.clock())
+                wait = self._next_tick - self.clock()
+
+    def stop(self):
+        self._running = False
+
+    def shutdown(self):
+        """現在のフェーズの exit を呼び、全フェーズの計測結果を記録する"""
+        self._running = False
+        try:
+            self._exit()
+        except Exception as e:
+            _log("error", f"phase exit error: {e}")
+        self.current = None
+        self.report()
+
+    def report(self):
+        for n in sorted(self.stats):
+            st = self.stats[n]
+            if st.entries == 0:
+                continue
+            msg = f"phase {n} ({self.phases[n].name}): {st.summary()}"
+            print(msg)
+            _log("msg", msg)
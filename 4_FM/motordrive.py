@@ -7,22 +7,22 @@ import RPi.GPIO as GPIO  # GPIOモジュールをインポート
 from gpiozero import Motor
 from gpiozero.pins.pigpio import PiGPIOFactory
 import time
+import queue
+import threading
+from concurrent.futures import Future
 import numpy as np
 
 # ---------------------------------------------------------
 # インポートと初期化
 # ---------------------------------------------------------
-try:
-    from bno055 import BNO055
-    bno = BNO055()
-    if not bno.begin():
-        print("BNO055 Begin Failed. (motordrive)")
-        bno = None
-    else:
-        print("BNO055 initialized successfully. (motordrive)")
-except Exception as e:
-    print(f"Error initializing BNO055 in motordrive: {e}")
-    bno = None
+# BNO055 は import 時には開かない（起動を遅くしないため）
+# FM.py は attach_bno() でセットアップ済みのものを渡す。渡されなければ setup_motors() で自分で開く
+bno = None
+_bno_tried = False
+
+from stack_detector import StackDetector
+import profiler
+import heartbeat
 
 # ★ make_csvを安全にインポート
 try:
@@ -51,11 +51,132 @@ PIN_LEFT_BACKWARD = 24
 PIN_LED = 5
 PIN_VM = 4
 
+# PWM設定
+# "pigpio": pigpio で直接駆動。左右4本のピンがすべてハードウェアPWM対応(12/13/18/19)で、チャンネルが重ならないときだけ
+#           ハードウェアPWM。それ以外は4本ともソフトウェアPWM（前進・後退・左右で周波数が違うと同じデューティでもトルクが変わるため揃える。
+#           チャンネルを共有するピンはデューティも共有されてしまう）
+#           ※ 今の配線(右18/23, 左13/24)は 23/24 が非対応なので常にソフトウェアPWM（MOTOR_PWM_FREQUENCY は使われない）
+#             ハードウェアPWMのチャンネルは2つしかないので、モーター2個（4本）ではどう配線してもハードウェアPWMにはならない
+# "gpiozero": 従来通り gpiozero の Motor（全ピンソフトウェアPWM）
+MOTOR_PWM_BACKEND = "pigpio"
+MOTOR_PWM_FREQUENCY = 20000      # ハードウェアPWMの周波数 [Hz]（可聴域外にしてモーターの鳴きを無くす）
+MOTOR_SOFT_PWM_FREQUENCY = 2000  # ソフトウェアPWMの周波数 [Hz]（pigpio既定のサンプル周期5usで分解能100段）
+HARDWARE_PWM_PINS = (12, 13, 18, 19)  # 12/18 がチャンネル0, 13/19 がチャンネル1
+
 # グローバル変数としてモーター保持
 motor_right = None
 motor_left = None
 _gpio_initialized = False
 _factory = None  # pigpioファクトリーのインスタンス保持用
+_pi = None       # pigpio接続 (MOTOR_PWM_BACKEND = "pigpio" のとき)
+
+# ---------------------------------------------------------
+# pigpio直接駆動のモーター
+# gpiozero の Motor と同じく value (-1.0~1.0) と close() を持つ
+# 出力が変わらない書き込みは pigpio に送らない（細かいランプでもソケット通信が増えない）
+# ---------------------------------------------------------
+def _pwm_channel(pin):
+    """ハードウェアPWMのチャンネル（12/18 → 0, 13/19 → 1）"""
+    return 0 if pin in (12, 18) else 1
+
+
+class _PwmPin:
+    def __init__(self, pi, pin, frequency, soft_frequency, hardware=None):
+        self.pi = pi
+        self.pin = pin
+        self.hardware = (pin in HARDWARE_PWM_PINS) if hardware is None else hardware
+        self._raw = None
+        if self.hardware:
+            self.frequency = int(frequency)
+            self.range = 1000000  # hardware_PWM のデューティ指定は 0~1e6 固定
+        else:
+            pi.set_mode(pin, 1)  # OUTPUT
+            # 指定できる周波数は決まっているので、実際に設定された値と分解能を読み直す
+            self.frequency = pi.set_PWM_frequency(pin, int(soft_frequency))
+            self.range = pi.get_PWM_real_range(pin)
+            pi.set_PWM_range(pin, self.range)
+        self.set(0.0)
+
+    def set(self, duty):
+        """デューティ(0.0~1.0)を設定する。量子化後に変化が無ければ何もせず False"""
+        raw = int(round(min(1.0, max(0.0, duty)) * self.range))
+        if raw == self._raw:
+            return False
+        if self.hardware:
+            self.pi.hardware_PWM(self.pin, self.frequency, raw)
+        else:
+            self.pi.set_PWM_dutycycle(self.pin, raw)
+        self._raw = raw
+        return True
+
+    @property
+    def duty(self):
+        """量子化後の実際のデューティ"""
+        return (self._raw or 0) / float(self.range)
+
+    def describe(self):
+        kind = "hw" if self.hardware else "sw"
+        return f"GPIO{self.pin} {kind} {self.frequency}Hz/{self.range}"
+
+    def close(self):
+        self.set(0.0)
+        if self.hardware:
+            self.pi.hardware_PWM(self.pin, 0, 0)
+
+
+def hardware_pwm_usable(pins):
+    """pins（同時に使う全ピン）をすべてハードウェアPWMにできるか（全部対応ピンで、チャンネルが重ならない）"""
+    pins = list(pins)
+    if not all(p in HARDWARE_PWM_PINS for p in pins):
+        return False
+    channels = [_pwm_channel(p) for p in pins]
+    return len(set(channels)) == len(channels)
+
+
+class PwmMotor:
+    def __init__(self, pi, forward, backward, frequency=None, soft_frequency=None, hardware=None):
+        """hardware: ハードウェアPWMを使うか（None なら、このモーターの2本だけで hardware_pwm_usable() を判定する）"""
+        frequency = MOTOR_PWM_FREQUENCY if frequency is None else frequency
+        soft_frequency = MOTOR_SOFT_PWM_FREQUENCY if soft_frequency is None else soft_frequency
+        # 前進・後退を同じ周波数で出す（両方ハードウェアか両方ソフトウェア）
+        if hardware is None:
+            hardware = hardware_pwm_usable((forward, backward))
+        self.forward_pin = _PwmPin(pi, forward, frequency, soft_frequency, hardware=hardware)
+        self.backward_pin = _PwmPin(pi, backward, frequency, soft_frequency, hardware=hardware)
+        self.writes = 0     # 実際に pigpio へ送った回数
+        self.skipped = 0    # 変化が無く省略した回数
+
+    @property
+    def value(self):
+        """実際に出力しているデューティ（量子化後）。前進が正"""
+        return self.forward_pin.duty - self.backward_pin.duty
+
+    @value.setter
+    def value(self, v):
+        v = min(1.0, max(-1.0, float(v)))
+        # 逆側を先に落としてから出す（両方ONの瞬間を作らない）
+        if v >= 0:
+            changed = self.backward_pin.set(0.0) + self.forward_pin.set(v)
+        else:
+            changed = self.forward_pin.set(0.0) + self.backward_pin.set(-v)
+        if changed:
+            self.writes += changed
+        else:
+            self.skipped += 1
+
+    @property
+    def matched(self):
+        """前進と後退が同じ周波数・分解能で出ているか"""
+        f, b = self.forward_pin, self.backward_pin
+        return f.hardware == b.hardware and f.frequency == b.frequency and f.range == b.range
+
+    def describe(self):
+        text = f"fwd={self.forward_pin.describe()}, bwd={self.backward_pin.describe()}"
+        return text if self.matched else text + " (MISMATCH)"
+
+    def close(self):
+        self.forward_pin.close()
+        self.backward_pin.close()
 
 # ---------------------------------------------------------
 # セットアップ・終了処理
@@ -72,12 +193,65 @@ def setup_gpio():
         GPIO.output(PIN_VM, 0) 
         _gpio_initialized = True
 
+def attach_bno(dev):
+    """セットアップ済みの BNO055 を使う（None なら姿勢を使わない）"""
+    global bno, _bno_tried
+    bno = dev
+    _bno_tried = True
+
+
+def _open_bno():
+    """attach_bno() されていなければ BNO055 を開く（1回だけ試す）"""
+    global bno, _bno_tried
+    if _bno_tried:
+        return
+    _bno_tried = True
+    try:
+        from bno055 import BNO055
+        dev = BNO055()
+        if not dev.begin():
+            print("BNO055 Begin Failed. (motordrive)")
+        else:
+            bno = dev
+            print("BNO055 initialized successfully. (motordrive)")
+    except Exception as e:
+        print(f"Error initializing BNO055 in motordrive: {e}")
+
+
 def setup_motors():
-    """モータードライバの初期化 (gpiozero)"""
-    global motor_right, motor_left, _factory
+    """モータードライバの初期化 (pigpio直接駆動、失敗時は gpiozero)"""
+    global motor_right, motor_left, _factory, _pi
+    _open_bno()
     if motor_right and motor_left:
         return
 
+    if MOTOR_PWM_BACKEND == "pigpio":
+        try:
+            import pigpio
+            if _pi is None:
+                _pi = pigpio.pi()
+            if not _pi.connected:
+                raise RuntimeError("pigpio daemon not connected")
+            # 左右のモーターもそろえる: チャンネルの重なりは4本まとめて調べる
+            hardware = hardware_pwm_usable((PIN_LEFT_FORWARD, PIN_LEFT_BACKWARD, PIN_RIGHT_FORWARD, PIN_RIGHT_BACKWARD))
+            motor_left = PwmMotor(_pi, PIN_LEFT_FORWARD, PIN_LEFT_BACKWARD, hardware=hardware)
+            motor_right = PwmMotor(_pi, PIN_RIGHT_FORWARD, PIN_RIGHT_BACKWARD, hardware=hardware)
+            setup_gpio()
+            msg = f"motor PWM: left[{motor_left.describe()}] right[{motor_right.describe()}]"
+            print(msg)
+            matched = motor_left.matched and motor_right.matched
+            if make_csv:
+                try: make_csv.print('msg' if matched else 'warning', msg)
+                except Exception: pass
+            return
+        except Exception as e:
+            print(f"pigpio PWM setup failed, falling back to gpiozero: {e}")
+            if make_csv:
+                try: make_csv.print('warning', f"pigpio PWM setup failed, falling back to gpiozero: {e}")
+                except Exception: pass
+            motor_right = None
+            motor_left = None
+
     try:
         # pigpio接続を使い回す (毎回接続すると不安定になるため)
         if _factory is None:
@@ -85,6 +259,9 @@ def setup_motors():
             
         motor_left = Motor(forward=PIN_LEFT_FORWARD, backward=PIN_LEFT_BACKWARD, pin_factory=_factory)
         motor_right = Motor(forward=PIN_RIGHT_FORWARD, backward=PIN_RIGHT_BACKWARD, pin_factory=_factory)
+        for m in (motor_left, motor_right):
+            for dev in (m.forward_device, m.backward_device):
+                dev.frequency = MOTOR_SOFT_PWM_FREQUENCY
         setup_gpio() # LEDなども一緒に準備
     except Exception as e:
         print(f"Motor Setup Error: {e}")
@@ -94,27 +271,265 @@ def setup_motors():
         motor_right = None
         motor_left = None
 
+def motors_ready():
+    """setup_motors() でモーターを開けたか（setup_motors() は失敗しても例外を投げない）"""
+    return bool(motor_right and motor_left)
+
 def cleanup():
     """終了時の安全停止処理"""
     print("Cleaning up motors and GPIO...")
+    if _controller is not None:
+        _controller.shutdown()
     stop()
     if motor_left:
         motor_left.close()
     if motor_right:
         motor_right.close()
+    if _pi is not None:
+        try:
+            _pi.stop()
+        except Exception:
+            pass
     try:
         GPIO.cleanup()
     except:
         pass
 
+# ---------------------------------------------------------
+# 共通ヘルパー
+# ---------------------------------------------------------
+_INVERT_MAP = {'w': 's', 's': 'w', 'a': 'q', 'd': 'e', 'q': 'd', 'e': 'a'}
+
+def _invert_direction(direction, is_inverted):
+    """逆さ走行時は操作を反転する"""
+    if is_inverted:
+        return _INVERT_MAP.get(direction, direction)
+    return direction
+
+def _motor_values(d, unsafe_p):
+    """
+    方向と入力パワー(0.0~1.0)から (右, 左) のモーター値を返す。不正な方向なら None
+    """
+    p = unsafe_p * MAX_POWER_LIMIT #ここで引数(0.0~1.0)を安全な値(0~0.71)に自動変換
+    p = min(1.0 , p) #浮動小数点の誤差で1.0を超えないように
+    if d == 'w':   return p, p
+    elif d == 's': return -p, -p
+    elif d == 'a': return p*0.2, p  # 左前旋回
+    elif d == 'd': return p, p*0.2  # 右前旋回
+    elif d == 'e': return -p*0.2, -p   # 右後旋回
+    elif d == 'q': return -p, -p*0.2   # 左後旋回
+    return None
+
+# ---------------------------------------------------------
+# スタック監視 (IMUの窓統計からスタック確率を出す)
+# ---------------------------------------------------------
+STACK_CHECK_PERIOD = 0.05    # IMUのサンプリング周期 [s]
+STACK_PROB_THRESHOLD = 0.8   # スタック確率がこれ以上なら「止まっている」
+STACK_HOLD_TIME = 0.3        # その状態がこの時間続いたらスタック確定 [s]
+STACK_LOG_PERIOD = 0.2       # スタック確率をCSVに記録する周期 [s]
+
+class StackMonitor:
+    """1回の走行指令ぶんのスタック監視"""
+    def __init__(self, direction):
+        # 旋回中は土や草の抵抗でゆっくり回ることを考慮し、Yaw角速度だけを見る
+        self.turning = direction in ['a', 'd', 'q', 'e']
+        self.detector = StackDetector()
+        self.probability = None
+        self._last_sample = 0.0
+        self._last_log = 0.0
+        self._stuck_start = None
+
+    def sample(self, now):
+        """
+        STACK_CHECK_PERIOD ごとにIMUを1回読み、スタック確定なら True を返す
+        now: time.monotonic()
+        """
+        if now - self._last_sample < STACK_CHECK_PERIOD:
+            return False
+        self._last_sample = now
+
+        # サンプル間隔を乱さないよう、リトライ無しで1回だけ読む（欠けたサンプルは捨てる）
+        gyro = ijochi.abnormal_check("gyro", bno.gyroscope, ERROR_FLAG=False, max_retries=0)
+        lin_accel = ijochi.abnormal_check("accel_line", bno.linear_acceleration, ERROR_FLAG=False, max_retries=0)
+        self.detector.add(now, gyro, lin_accel)
+
+        prob = self.detector.probability(turning=self.turning)
+        self.probability = prob
+        if prob is not None and make_csv and now - self._last_log >= STACK_LOG_PERIOD:
+            self._last_log = now
+            try: make_csv.print('stack_prob', f"{prob:.3f}")
+            except Exception: pass
+
+        if prob is None or prob < STACK_PROB_THRESHOLD:
+            self._stuck_start = None
+            return False
+        if self._stuck_start is None:
+            self._stuck_start = now
+            return False
+        return now - self._stuck_start >= STACK_HOLD_TIME
+
+# ---------------------------------------------------------
+# モーターのCSV記録
+# ランプの1段ごとに記録すると1回の move() で十数行になるため、
+# 1指令につき1行 (motor_cmd) にまとめる。実際の出力の推移が必要なときだけ間引いて記録する
+# ---------------------------------------------------------
+MOVE_RAMP_PROFILE = f"lin{delta_power:g}/0.025s"   # move() の加速
+STOP_RAMP_PROFILE = "lin/0.05s"                       # stop() の減速
+MOTOR_LOG_SAMPLE_PERIOD = 0.0   # >0 にすると、この周期[s]で実際の出力を 'motor' 行として記録する
+_last_setpoint_log = 0.0
+
+def _log_setpoint(mr, ml):
+    """実際の出力の記録（MOTOR_LOG_SAMPLE_PERIOD で間引く。既定は記録しない）"""
+    global _last_setpoint_log
+    if not make_csv or MOTOR_LOG_SAMPLE_PERIOD <= 0:
+        return
+    now = time.monotonic()
+    if now - _last_setpoint_log < MOTOR_LOG_SAMPLE_PERIOD:
+        return
+    _last_setpoint_log = now
+    try: make_csv.print('motor', (ml, mr)) # 左, 右の順
+    except Exception: pass
+
+def _log_command(start, direction, power, ramp, is_stacked, values):
+    """
+    1指令分の記録: 開始時刻(monotonic), 方向, 目標パワー, ランプ, 実際の所要時間, スタック結果, 目標出力(左, 右)
+    """
+    if not make_csv:
+        return
+    values = values or (0.0, 0.0)
+    try:
+        make_csv.print('motor_cmd', (f"{start:.3f}", direction, power, ramp,
+                                     f"{time.monotonic() - start:.3f}", is_stacked, values[1], values[0]))
+    except Exception:
+        pass
+
+def _ramp_toward(current, target, step):
+    """current を最大 step だけ target に近づける（届く場合は target ちょうどにする）"""
+    diff = target - current
+    if abs(diff) <= step:
+        return target
+    return current + (step if diff > 0 else -step)
+
+def _apply_trim(values, trim):
+    """
+    (右, 左) のモーター値に方位保持の補正を加える
+    正の trim で右の出力を上げ左を下げる（=Yawが増える向き。逆さ時も符号はそのまま使える）
+    """
+    mr, ml = values
+    r = min(1.0, max(0.0, abs(mr) + trim))
+    l = min(1.0, max(0.0, abs(ml) - trim))
+    return (r if mr >= 0 else -r), (l if ml >= 0 else -l)
+
+# ---------------------------------------------------------
+# 方位保持 (Heading Hold)
+# ---------------------------------------------------------
+HEADING_HOLD_PERIOD = 0.02   # 補正周期 [s] (50Hz)
+HEADING_LOG_PERIOD = 0.2     # 追従誤差をCSVに記録する周期 [s]
+
+class HeadingHold:
+    """
+    BNO055のYaw(euler[0], 時計回り[deg])を目標方位に保つPID
+    出力は左右の出力差（モーター値の単位）
+    """
+    def __init__(self, kp=0.01, ki=0.002, kd=0.001, limit=0.3):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.limit = limit
+        self.target = None
+        self._integral = 0.0
+        self._prev_err = None
+        self._prev_t = None
+        self._last_log = 0.0
+        self._trim = 0.0
+        self._n = 0
+        self._sum_abs = 0.0
+        self._max_abs = 0.0
+
+    @staticmethod
+    def _read_yaw():
+        # 50Hzで読むため ijochi は通さない（リトライ待ちを避ける）
+        # 読めた値は毎回CSVに残す（補正量を決める入力なので、fm_replay で同じ走りを再現できるように）
+        try:
+            euler = bno.euler()
+        except Exception:
+            return None
+        if euler is None or not (0.0 <= euler[0] <= 360.0):
+            return None
+        if make_csv:
+            try: make_csv.print('euler', euler)
+            except Exception: pass
+        return euler[0]
+
+    def reset(self, target=None):
+        """目標方位を設定する（省略時は現在の方位）。Yawが読めなければ False"""
+        if target is None:
+            target = self._read_yaw()
+            if target is None:
+                return False
+        self.target = target % 360.0
+        self._integral = 0.0
+        self._prev_err = None
+        self._prev_t = None
+        self._trim = 0.0
+        return True
+
+    def update(self):
+        """Yawを1回読んで補正量を返す（読めなければ前回の補正量を維持）"""
+        yaw = self._read_yaw()
+        now = time.time()
+        if yaw is None or self.target is None:
+            return self._trim
+
+        err = (self.target - yaw + 180.0) % 360.0 - 180.0
+        dt = (now - self._prev_t) if self._prev_t is not None else 0.0
+        deriv = (err - self._prev_err) / dt if (dt > 0 and self._prev_err is not None) else 0.0
+
+        # アンチワインドアップ: 積分項だけで limit を超えないようにする
+        if self.ki > 0:
+            self._integral += err * dt
+            i_max = self.limit / self.ki
+            self._integral = max(-i_max, min(i_max, self._integral))
+
+        u = self.kp * err + self.ki * self._integral + self.kd * deriv
+        self._trim = max(-self.limit, min(self.limit, u))
+        self._prev_err = err
+        self._prev_t = now
+
+        self._n += 1
+        self._sum_abs += abs(err)
+        self._max_abs = max(self._max_abs, abs(err))
+        if make_csv and now - self._last_log >= HEADING_LOG_PERIOD:
+            self._last_log = now
+            try: make_csv.print('heading_error', err)
+            except Exception: pass
+        return self._trim
+
+    def report(self):
+        """走行終了時に追従誤差のまとめを記録する"""
+        if self._n == 0:
+            return
+        msg = (f"heading hold: target={self.target:.1f}deg, "
+               f"mean|err|={self._sum_abs / self._n:.2f}deg, max|err|={self._max_abs:.2f}deg, n={self._n}")
+        print(msg)
+        if make_csv:
+            try: make_csv.print('msg', msg)
+            except Exception: pass
+
 # ---------------------------------------------------------
 # 動作関数
 # ---------------------------------------------------------
 def stop():
     """徐々に減速して停止"""
+    start = time.monotonic()
+    if _ramp_down():
+        _log_command(start, 'stop', 0.0, STOP_RAMP_PROFILE, 0, (0.0, 0.0))
+
+def _ramp_down():
+    """徐々に減速して停止する（記録はしない）。既に停止していれば False"""
     global motor_right, motor_left
     if not (motor_right and motor_left):
-        return
+        return False
 
     # valueがNoneになる可能性を考慮して安全に取得
     current_power_r = motor_right.value or 0.0
@@ -122,7 +537,7 @@ def stop():
 
     # 既に停止していれば何もしない
     if current_power_r == 0 and current_power_l == 0:
-        return
+        return False
 
     # ステップ数が0にならないよう max(1, ...) で保護
     steps = max(1, int(max(abs(current_power_r), abs(current_power_l)) / delta_power))
@@ -132,19 +547,16 @@ def stop():
         target_l = current_power_l * (1 - i / steps)
         motor_right.value = target_r
         motor_left.value = target_l
+        _log_setpoint(target_r, target_l)
         time.sleep(0.05)
 
     motor_right.value = 0.0
     motor_left.value = 0.0
-    
-    # ★ 停止完了をCSVに記録
-    if make_csv:
-        try: make_csv.print('motor', (0.0, 0.0))
-        except Exception: pass
-        
     time.sleep(0.1)
+    return True
 
-def move(direction, power, duration, is_inverted=False, enable_stack_check=True):
+@profiler.timed("motor.move")
+def move(direction, power, duration, is_inverted=False, enable_stack_check=True, heading_hold=False):
     """
     指定方向に移動する
     
@@ -154,8 +566,10 @@ def move(direction, power, duration, is_inverted=False, enable_stack_check=True)
         duration: 秒数
         is_inverted: Trueなら操作を反転 (逆さま走行用)
         enable_stack_check: Trueならスタック検知を行う (解除動作中はFalseにする)
+        heading_hold: Trueなら前進('w')中に開始時の方位を保つよう左右の出力を補正する
     """
     global motor_right, motor_left, bno
+    heartbeat.beat(expect=duration + 1.0)  # 加速・減速の分も含めて戻ってこない
     
     # バリデーション
     max_input = 1.0 / MAX_POWER_LIMIT #上限を約1.4まで許容するように
@@ -174,36 +588,26 @@ def move(direction, power, duration, is_inverted=False, enable_stack_check=True)
 
 
 # 1. 逆さ判定による方向反転
-    if is_inverted:
-        mapping = {'w': 's', 's': 'w', 'a': 'q', 'd': 'e', 'q': 'd', 'e': 'a'}
-        direction = mapping.get(direction, direction)
+    commanded_direction = direction
+    direction = _invert_direction(direction, is_inverted)
 
     # 2. モーター値の設定関数 (内部ヘルパー)
     def set_values(d, unsafe_p):
-        p = unsafe_p * MAX_POWER_LIMIT #ここで引数(0.0~1.0)を安全な値(0~0.71)に自動変換
-        p = min(1.0 , p) #浮動小数点の誤差で1.0を超えないように
-        if d == 'w':   mr, ml = p, p
-        elif d == 's': mr, ml = -p, -p
-        elif d == 'a': mr, ml = p*0.2, p  # 左前旋回
-        elif d == 'd': mr, ml = p, p*0.2  # 右前旋回
-        elif d == 'e': mr, ml = -p*0.2, -p   # 右後旋回
-        elif d == 'q': mr, ml = -p, -p*0.2   # 左後旋回
-        else: return False
+        values = _motor_values(d, unsafe_p)
+        if values is None:
+            return False
+        mr, ml = values
         
         motor_right.value = mr
         motor_left.value = ml
-        
-        # ★ CSVへの出力記録 (左右の出力をタプルで渡す)
-        if make_csv:
-            try: make_csv.print('motor', (ml, mr)) # 左, 右の順
-            except Exception: pass
-            
+        _log_setpoint(mr, ml)
         return True
 
     # 3. 加速フェーズ
     # power=0やdelta_power関係のゼロ除算防止
     steps = max(1, int(power / delta_power))
     accel_time = 0
+    start = time.monotonic()
     
     for i in range(steps + 1):
         curr_p = min(i * delta_power, power)
@@ -221,90 +625,689 @@ def move(direction, power, duration, is_inverted=False, enable_stack_check=True)
     if remaining_time > 0:
         set_values(direction, power) # 目標速度維持
 
+        # ★ 方位保持: 前進中だけ、BNO055のYawを開始時の方位に保つよう左右の出力を補正する
+        hold = None
+        if heading_hold and commanded_direction == 'w' and bno is not None:
+            hold = HeadingHold()
+            if not hold.reset():
+                hold = None
+
         # スタック検知条件: 2秒以上の移動 かつ センサーあり かつ 検知有効
-        if duration >= 2 and bno is not None and enable_stack_check:
+        do_stack_check = duration >= 2 and bno is not None and enable_stack_check
+
+        if do_stack_check or hold is not None:
             start_t = time.time()
-            stuck_start_time = None
-            STUCK_DURATION_THRESHOLD = 1.5 # 1.5秒間連続で動きがなければスタックと判定
+            monitor = StackMonitor(direction) if do_stack_check else None
+            base_values = _motor_values(direction, power)
+            period = HEADING_HOLD_PERIOD if hold is not None else STACK_CHECK_PERIOD
             
             while time.time() - start_t < remaining_time:
-                is_moving = False
-                
-                # ijochiの仕様に合わせて関数を渡し、自動リトライ＆取得を任せる
-                gyro = ijochi.abnormal_check("gyro", bno.gyroscope, ERROR_FLAG=False)
-                lin_accel = ijochi.abnormal_check("accel_line", bno.linear_acceleration, ERROR_FLAG=False)
-
-                if gyro is not None and lin_accel is not None:
-                    if direction in ['a', 'd', 'q', 'e']:
-                        # 旋回中: 土や草の抵抗でゆっくり回ることを考慮し、閾値を0.2に下げる
-                        if abs(gyro[2]) > 0.2: 
-                            is_moving = True
-                    else:
-                        # 直進・後退中: 線形加速度(実際の進行) または ジャイロ(機体の揺れ) を見る
-                        # 空転時は線形加速度が落ちるためスタックと判定しやすくなる
-                        if np.linalg.norm(lin_accel) > 0.5 or np.linalg.norm(gyro) > 0.6:
-                            is_moving = True
-
-                if is_moving:
-                    # 動いている（または揺れている）と判定されたので、スタック状態のカウントをリセット
-                    stuck_start_time = None
-                else:
-                    # 動きが検知できなかった場合、スタックのカウントを開始
-                    if stuck_start_time is None:
-                        stuck_start_time = time.time()
-                    elif time.time() - stuck_start_time >= STUCK_DURATION_THRESHOLD:
-                        # 指定時間、継続して動きが検知できなかったらスタック確定
-                        print("Stack Detected! (Off-road logic)")
-                        make_csv.print('warning', 'stacking detected')
-                        is_stacked = 1
-                        break 
-
-                time.sleep(0.05) # 0.05秒間隔で監視を継続
+                if hold is not None:
+                    trim = hold.update()
+                    mr, ml = _apply_trim(base_values, trim)
+                    motor_right.value = mr
+                    motor_left.value = ml
+                    _log_setpoint(mr, ml)
+
+                # スタック監視（IMUの窓統計でスタック確率を評価）
+                if monitor is not None and monitor.sample(time.monotonic()):
+                    print(f"Stack Detected! (p={monitor.probability:.2f})")
+                    make_csv.print('warning', f'stacking detected (p={monitor.probability:.2f})')
+                    is_stacked = 1
+                    break 
+
+                time.sleep(period) # 監視を継続
+
+            if hold is not None:
+                hold.report()
         else:
             # 監視なしの単純待機
             time.sleep(remaining_time)
 
-    stop()
+    _ramp_down()
+    ramp = MOVE_RAMP_PROFILE + ("+hold" if heading_hold and commanded_direction == 'w' else "")
+    _log_command(start, direction, power, ramp, is_stacked, _motor_values(direction, power))
     return is_stacked
 
-def check_stuck(is_stacked, is_inverted=False):
+# ---------------------------------------------------------
+# 連続旋回 (BNO055のYawを見ながら1回の動作で目標角度まで回る)
+# ---------------------------------------------------------
+TURN_PERIOD = 0.02   # 制御周期 [s] (50Hz)
+TURN_RATE_ALPHA = 0.3  # 旋回速度の学習率（指数移動平均）
+TURN_MAX_TIME = 12.0   # 1回の旋回の上限 [s]（従来の 4秒×3回 と同じ。見積もりがこれより長くても打ち切る）
+TURN_STALL_TIME = 2.0  # この時間 TURN_STALL_DEG 以上回らなければ中止 [s]（押さえつけられている・Yawが読めない）
+TURN_STALL_DEG = 1.0   # [deg]
+
+# 入力パワー1.0あたりの旋回速度 [deg/s]。初期値は従来の 4.5deg/s @0.7 相当
+# 旋回するたびに実測値で更新し、今いる地面での旋回速度を覚える
+turn_rate_per_power = (90.0 / 20) / 0.7
+
+def ground_yaw(is_inverted):
+    """地面基準のYaw[deg]（逆さ時は回転方向を反転）。読めなければ None（GPS誘導からも使う）"""
+    yaw = HeadingHold._read_yaw() if bno is not None else None
+    if yaw is None:
+        return None
+    return (360.0 - yaw) % 360.0 if is_inverted else yaw
+
+def turn(angle_deg, power=0.7, is_inverted=False, tolerance=5.0, taper_deg=30.0,
+         min_power=0.35, timeout=None):
+    """
+    現在の向きから angle_deg だけ旋回する（正: 右回り/Yaw増加, 負: 左回り）
+    Yawを50Hzで追いかけ、目標が近づいたら出力を絞り、許容誤差に入った時点で止める。
+    行き過ぎた場合はそのまま逆向きに戻す（停止→再計測のやり直しはしない）
+
+    Args:
+        tolerance: 許容誤差 [deg]
+        taper_deg: 残りがこの角度を切ったら出力を比例して下げる
+        min_power: 減速時の下限パワー（これ以下だと地面の抵抗で止まる）
+        timeout: 最大旋回時間 [s]（省略時は学習済みの旋回速度から見積もる。どちらでも TURN_MAX_TIME まで）
+    Return:
+        最終的な残り角度 [deg]（Yawが読めず時間で旋回した場合は None）
+    """
+    global turn_rate_per_power
+
+    setup_motors()
+    if not (motor_right and motor_left):
+        print("Motors not initialized")
+        return None
+
+    expected_rate = max(0.5, turn_rate_per_power * power)  # [deg/s]
+
+    start_yaw = ground_yaw(is_inverted)
+    if start_yaw is None:
+        # Yawが読めない場合は、学習済みの旋回速度から時間を決めて旋回する
+        turn_time = min(abs(angle_deg) / expected_rate, 5.0)
+        cmd = 'd' if angle_deg > 0 else 'a'
+        move(cmd, power=power, duration=turn_time, is_inverted=is_inverted, enable_stack_check=False)
+        return None
+
+    if timeout is None:
+        timeout = 2.0 * abs(angle_deg) / expected_rate + 2.0
+    timeout = min(timeout, TURN_MAX_TIME)
+    heartbeat.beat(expect=timeout + 1.0)
+
+    if _gpio_initialized:
+        GPIO.output(PIN_VM, 1)
+
+    ramp_step = 4.0 * MAX_POWER_LIMIT * TURN_PERIOD  # move() の加速と同じ速さ
+    travelled = 0.0          # 開始からの回転量（符号付き・折り返しなし）
+    prev_yaw = start_yaw
+    remaining = angle_deg
+    current = (0.0, 0.0)
+    full_time = 0.0          # 最大出力で回っていた時間（旋回速度の学習用）
+    full_travel = 0.0
+    start_t = time.time()
+    start = time.monotonic()
+    prev_t = start_t
+    progress_t = start_t     # 最後に TURN_STALL_DEG 以上回った時刻
+    progress_at = 0.0        # そのときの travelled
+
+    while True:
+        now = time.time()
+        dt = now - prev_t
+        prev_t = now
+
+        yaw = ground_yaw(is_inverted)
+        delta = 0.0
+        if yaw is not None:
+            delta = (yaw - prev_yaw + 180.0) % 360.0 - 180.0
+            travelled += delta
+            prev_yaw = yaw
+        remaining = angle_deg - travelled
+
+        if abs(remaining) <= tolerance:
+            break
+        if now - start_t > timeout:
+            print(f"Turn timeout (remaining {remaining:.1f}deg)")
+            if make_csv:
+                try: make_csv.print('warning', f"turn timeout (remaining {remaining:.1f}deg)")
+                except Exception: pass
+            break
+        if abs(travelled - progress_at) >= TURN_STALL_DEG:
+            progress_t, progress_at = now, travelled
+        elif now - progress_t > TURN_STALL_TIME:
+            print(f"Turn stalled (remaining {remaining:.1f}deg)")
+            if make_csv:
+                try: make_csv.print('warning', f"turn stalled: no rotation for {TURN_STALL_TIME:g}s (remaining {remaining:.1f}deg)")
+                except Exception: pass
+            break
+
+        # 学習: 前周期を最大出力で回っていたなら、その回転量を記録
+        if current == _motor_values(_invert_direction('d' if remaining > 0 else 'a', is_inverted), power):
+            full_time += dt
+            full_travel += abs(delta)
+
+        p = max(min_power, power * min(1.0, abs(remaining) / taper_deg))
+        p = min(p, power)
+        target = _motor_values(_invert_direction('d' if remaining > 0 else 'a', is_inverted), p)
+
+        # 急な出力変化（特に行き過ぎ時の反転）を避けるためランプで近づける
+        r = _ramp_toward(current[0], target[0], ramp_step)
+        l = _ramp_toward(current[1], target[1], ramp_step)
+        current = (r, l)
+        motor_right.value = r
+        motor_left.value = l
+        _log_setpoint(r, l)
+
+        time.sleep(TURN_PERIOD)
+
+    # 行き過ぎないよう、減速ランプなしで即停止
+    motor_right.value = 0.0
+    motor_left.value = 0.0
+    _log_command(start, f"turn{angle_deg:+.0f}", power, f"taper{taper_deg:g}deg/min{min_power:g}", 0,
+                 _motor_values(_invert_direction('d' if angle_deg > 0 else 'a', is_inverted), power))
+    time.sleep(0.2)
+
+    # 止まった後の最終誤差
+    yaw = ground_yaw(is_inverted)
+    if yaw is not None:
+        travelled += (yaw - prev_yaw + 180.0) % 360.0 - 180.0
+        remaining = angle_deg - travelled
+
+    # 旋回速度を学習（最大出力で0.3秒以上回れたときだけ）
+    if full_time >= 0.3 and power > 0:
+        measured = full_travel / full_time / power
+        turn_rate_per_power = (1 - TURN_RATE_ALPHA) * turn_rate_per_power + TURN_RATE_ALPHA * measured
+
+    msg = (f"turn: target={angle_deg:.1f}deg, remaining={remaining:.1f}deg, "
+           f"time={time.time() - start_t:.2f}s, rate={turn_rate_per_power * power:.1f}deg/s@{power}")
+    print(msg)
+    if make_csv:
+        try: make_csv.print('msg', msg)
+        except Exception: pass
+    return remaining
+
+# ---------------------------------------------------------
+# スタック脱出プランナー
+# 複数の脱出動作を用意し、1つ試すごとに前進して本当に抜けたかをIMUで確かめる。
+# 抜けた時点で終了し、どの動作が効いたかを覚えて次回はそれから試す（同じ地面なら同じ動作が効きやすい）
+# ---------------------------------------------------------
+# (方向, パワー, 秒数) の列。方向は地面基準（逆さ補正は move() が行う）
+ESCAPE_MANEUVERS = {
+    "back_turn":   [('s', 1.0, 3.0), ('d', 1.0, 1.0)],  # 従来の後退→右旋回
+    "rock":        [('s', 1.0, 0.6), ('w', 1.0, 0.6)] * 3,  # 前後に揺すって轍から出る
+    "pivot":       [('a', 1.0, 0.8), ('d', 1.0, 0.8)] * 2,  # 左右交互に旋回して掘り出す
+    "reverse_arc": [('q', 1.0, 2.0), ('e', 1.0, 1.0)],  # 後ろ向きに弧を描いて横へ逃げる
+}
+ESCAPE_PROBE = ('w', 1.0, 2.0)   # 脱出確認の前進（スタック検知あり）
+
+# 動作ごとの [成功回数, 試行回数]（この走行中の地面での実績）
+escape_stats = {name: [0, 0] for name in ESCAPE_MANEUVERS}
+
+def _escape_order():
+    """成功率の高い順（未試行は事前確率0.5、同率なら定義順）"""
+    names = list(ESCAPE_MANEUVERS)
+    return sorted(names, key=lambda n: (-(escape_stats[n][0] + 1) / (escape_stats[n][1] + 2), names.index(n)))
+
+def check_stuck(is_stacked, is_inverted=False, max_attempts=None):
     """
     スタック時の解除動作
-    注意: この関数内での move() は enable_stack_check=False にする (無限再帰防止)
+    Return:
+        True: 脱出を確認できた（IMUが無い場合は1動作実行後に True）, False: 全ての動作で脱出できなかった
+    注意: 脱出動作の move() は enable_stack_check=False にする（確認の前進だけ検知あり）
     """
-    if is_stacked == 1:
+    if is_stacked != 1:
+        return True
+    try:
+        print("Starting Stack Release Sequence...")
+        # LED点滅
+        for _ in range(2):
+            GPIO.output(PIN_LED, 1)
+            time.sleep(0.2)
+            GPIO.output(PIN_LED, 0)
+            time.sleep(0.2)
+
+        order = _escape_order()
+        if max_attempts is not None:
+            order = order[:max_attempts]
+
+        start_t = time.time()
+        for attempt, name in enumerate(order):
+            print(f"Escape {attempt + 1}/{len(order)}: {name}")
+            for d, p, t in ESCAPE_MANEUVERS[name]:
+                move(d, p, t, is_inverted=is_inverted, enable_stack_check=False)
+                time.sleep(0.3)
+
+            # 前進して、動けるかどうかを確かめる
+            if bno is None:
+                # IMUが無いと確認できないので、1動作で終わりにする（従来と同じ）
+                move(*ESCAPE_PROBE, is_inverted=is_inverted, enable_stack_check=False)
+                escaped = True
+            else:
+                escaped = move(*ESCAPE_PROBE, is_inverted=is_inverted, enable_stack_check=True) == 0
+
+            escape_stats[name][1] += 1
+            if escaped:
+                escape_stats[name][0] += 1
+                msg = f"stack escaped by {name} ({time.time() - start_t:.1f}s, attempt {attempt + 1})"
+                print(msg)
+                if make_csv:
+                    try: make_csv.print("msg", msg)
+                    except Exception: pass
+                stop()
+                return True
+
+        msg = f"stack escape failed ({time.time() - start_t:.1f}s, tried {', '.join(order)})"
+        print(msg)
+        if make_csv:
+            try: make_csv.print("warning", msg)
+            except Exception: pass
+        stop()
+        return False
+
+    except Exception as e:
+        print(f"Error in check_stuck: {e}")
+        if make_csv:
+            try: make_csv.print("error", f"check_stuck error: {e}")
+            except Exception: pass
+        return False
+
+# ---------------------------------------------------------
+# ノンブロッキング制御 (MotorController)
+# move() は走行時間ぶん呼び出し元を止めてしまうため、
+# 別スレッドが一定周期でランプ・監視を行い、呼び出し元は Future で完了を受け取る
+# ※ MotorController の動作中に move()/stop() を同時に呼ばないこと
+# ---------------------------------------------------------
+class MotorCommand:
+    def __init__(self, direction, power, duration=None, enable_stack_check=True):
+        self.direction = direction          # None なら停止指令
+        self.power = power
+        self.duration = duration            # None なら cancel()/次の指令まで継続
+        self.enable_stack_check = enable_stack_check
+        self.values = (0.0, 0.0) if direction is None else _motor_values(direction, power)
+        self.future = Future()
+        self.start_time = None
+        self.end_time = None
+        self.finishing = False              # 減速して停止中
+        self.preempted = False
+        self.is_stacked = 0
+        self.steering = False               # steer() の指令（目標値が途中で変わる）
+        self.is_inverted = False
+        self.ramped = False                 # 一度目標値に達した（加速完了）
+        self.guide = None                   # steer(guide=...) の操舵関数
+
+
+class MotorController:
+    def __init__(self, tick_hz=50.0, ramp_rate=4.0):
+        """
+        tick_hz: 制御周期 [Hz]
+        ramp_rate: 加減速の速さ [入力パワー/s]（move() の 0.1/0.025s と同じ 4.0 が既定）
+        """
+        self.tick_hz = float(tick_hz)
+        self.period = 1.0 / self.tick_hz
+        self.ramp_rate = ramp_rate
+        self.ramp_step = ramp_rate * MAX_POWER_LIMIT / self.tick_hz
+
+        self._commands = queue.Queue()
+        self._active = None
+        self._current = (0.0, 0.0)       # (右, 左) の現在値
+        self._thread = None
+        self._running = False
+        self._monitor = None
+
+        self.stacked = threading.Event()  # スタック検知時にセットされる
+
+    # ----------------------------
+    # スレッド制御
+    # ----------------------------
+    def start(self):
+        if self._thread is not None:
+            return
+        setup_motors()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="motor-controller", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=2.0):
+        """減速停止してからスレッドを止める"""
+        if self._thread is None:
+            return
         try:
-            print("Starting Stack Release Sequence...")
-            # LED点滅
-            for _ in range(2):
-                GPIO.output(PIN_LED, 1)
-                time.sleep(0.2)
-                GPIO.output(PIN_LED, 0)
-                time.sleep(0.2)
-
-            # もがき動作
-            # 1. 後退 (3秒)
-            move('s', 1.0, 3.0, is_inverted=is_inverted, enable_stack_check=False)
-            time.sleep(0.5)
-            
-            # 2. 右旋回 (1秒)
-            move('d', 1.0, 1.0, is_inverted=is_inverted, enable_stack_check=False)
-            time.sleep(0.5)
-            
-            # 3. 前進 (2秒) - トライ
-            move('w', 1.0, 2.0, is_inverted=is_inverted, enable_stack_check=False)
-            time.sleep(0.5)
-            
-            stop()
-            print("Stack Release Sequence Finished.")
-            
+            self.stop().result(timeout)
+        except Exception:
+            pass
+        self._running = False
+        self._thread.join(timeout)
+        self._thread = None
+
+    # ----------------------------
+    # 呼び出し側API（すぐに戻る）
+    # ----------------------------
+    def submit(self, direction, power, duration=None, is_inverted=False, enable_stack_check=True):
+        """
+        走行指令を出す。実行中の指令は新しい指令で上書きされる
+        Return:
+            Future: result() は is_stacked (0/1)。上書きされた指令は 0
+        """
+        direction = _invert_direction(direction, is_inverted)
+        return self._enqueue(MotorCommand(direction, power, duration, enable_stack_check))
+
+    def _enqueue(self, cmd):
+        max_input = 1.0 / MAX_POWER_LIMIT
+        if cmd.values is None or not (0.0 <= cmd.power <= max_input) or not (motor_right and motor_left):
+            print("Error: invalid motor command or motors not initialized")
+            cmd.future.set_result(0)
+            return cmd.future
+        self.start()
+        self._commands.put(cmd)
+        return cmd.future
+
+    def steer(self, power, turn, is_inverted=False, enable_stack_check=True, guide=None):
+        """
+        前進しながら左右の出力差で曲がる（カメラ誘導・GPS誘導の連続操舵用）
+        継続中の steer 指令があれば、指令を出し直さずに目標値だけ差し替える（スタック監視も継続）
+        turn: 左右差 [モーター値]。正で地面基準の右旋回
+        guide: 制御周期ごとに呼ばれ (power, turn) を返す関数（指定時は power/turn は初期値）
+        Return:
+            Future: submit() と同じ
+        """
+        direction = _invert_direction('w', is_inverted)
+        base = _motor_values(direction, power)
+        # 逆さ時はYawの向きが地面基準と逆になるので符号を反転
+        values = _apply_trim(base, -turn if is_inverted else turn)
+
+        cmd = self._active
+        if (cmd is not None and cmd.steering and not cmd.finishing and not cmd.future.done()
+                and cmd.is_inverted == is_inverted and self._commands.empty()):
+            cmd.values = values
+            cmd.power = power
+            cmd.guide = guide
+            return cmd.future
+
+        cmd = MotorCommand(direction, power, None, enable_stack_check)
+        cmd.steering = True
+        cmd.is_inverted = is_inverted
+        cmd.values = values
+        cmd.guide = guide
+        return self._enqueue(cmd)
+
+    def stop(self):
+        """減速して停止する。Future は停止完了で 0 を返す"""
+        cmd = MotorCommand(None, 0.0, 0.0, enable_stack_check=False)
+        self.start()
+        self._commands.put(cmd)
+        return cmd.future
+
+    def cancel(self):
+        """継続中の指令(duration=None)を終わらせる"""
+        return self.stop()
+
+    @property
+    def busy(self):
+        return self._active is not None or not self._commands.empty()
+
+    # ----------------------------
+    # 制御ループ
+    # ----------------------------
+    def _resolve(self, cmd):
+        if not cmd.future.done():
+            if cmd.start_time is not None:
+                ramp = f"{self.ramp_rate:g}/s" + ("+preempted" if cmd.preempted else "")
+                _log_command(cmd.start_time, cmd.direction or 'stop', cmd.power, ramp,
+                             cmd.is_stacked, cmd.values)
+            cmd.future.set_result(cmd.is_stacked)
+
+    def _poll_commands(self, now):
+        latest = None
+        while True:
+            try:
+                cmd = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if latest is not None:
+                latest.preempted = True
+                self._resolve(latest)
+            latest = cmd
+        if latest is None:
+            return
+
+        if self._active is not None:
+            self._active.preempted = True
+            self._resolve(self._active)
+
+        latest.start_time = now
+        if latest.duration is not None:
+            latest.end_time = now + latest.duration
+        self._active = latest
+        self._monitor = StackMonitor(latest.direction) if latest.direction is not None else None
+        self.stacked.clear()
+
+        if latest.direction is not None and _gpio_initialized:
+            GPIO.output(PIN_VM, 1)
+
+    def _tick(self, now):
+        cmd = self._active
+        if cmd is not None and not cmd.finishing and cmd.end_time is not None and now >= cmd.end_time:
+            cmd.finishing = True
+        if cmd is not None and cmd.guide is not None and not cmd.finishing:
+            self._apply_guide(cmd)
+        target = (0.0, 0.0) if (cmd is None or cmd.finishing) else cmd.values
+
+        # 目標値へ一定の刻みで近づける（ランプ）
+        r = _ramp_toward(self._current[0], target[0], self.ramp_step)
+        l = _ramp_toward(self._current[1], target[1], self.ramp_step)
+        if (r, l) != self._current and motor_right and motor_left:
+            motor_right.value = r
+            motor_left.value = l
+            _log_setpoint(r, l)
+        self._current = (r, l)
+
+        if cmd is None:
+            return
+
+        # スタック監視（加速が終わってから。steer() で目標値が動いても一度達していれば継続）
+        if self._current == cmd.values:
+            cmd.ramped = True
+        if (not cmd.finishing and cmd.enable_stack_check and bno is not None
+                and cmd.ramped
+                and (cmd.duration is None or cmd.duration >= 2)):
+            if self._monitor is not None and self._monitor.sample(now):
+                print(f"Stack Detected! (MotorController, p={self._monitor.probability:.2f})")
+                if make_csv:
+                    try: make_csv.print('warning', f'stacking detected (p={self._monitor.probability:.2f})')
+                    except Exception: pass
+                cmd.is_stacked = 1
+                cmd.finishing = True
+                self.stacked.set()
+
+        if cmd.finishing and self._current == (0.0, 0.0):
+            self._active = None
+            self._resolve(cmd)
+
+    @staticmethod
+    def _apply_guide(cmd):
+        """操舵関数から今周期の目標値を決める（失敗したら前回の目標値のまま）"""
+        try:
+            power, turn = cmd.guide()
+        except Exception as e:
+            print(f"Steering guide error: {e}")
+            cmd.guide = None
+            return
+        base = _motor_values(cmd.direction, min(power, 1.0 / MAX_POWER_LIMIT))
+        if base is None:
+            return
+        cmd.power = power
+        cmd.values = _apply_trim(base, -turn if cmd.is_inverted else turn)
+
+    def _step(self, now):
+        """制御周期1回分（シミュレーターは仮想時計からこれを直接呼ぶ）"""
+        try:
+            self._poll_commands(now)
+            self._tick(now)
         except Exception as e:
-            print(f"Error in check_stuck: {e}")
+            print(f"MotorController Error: {e}")
             if make_csv:
-                try: make_csv.print("error", f"check_stuck error: {e}")
+                try: make_csv.print('error', f"MotorController Error: {e}")
                 except Exception: pass
 
+    def _run(self):
+        next_t = time.monotonic()
+        while self._running:
+            self._step(time.monotonic())
+            next_t += self.period
+            delay = next_t - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_t = time.monotonic()  # 遅れた分は追いかけない
+        self._finish()
+
+    def _finish(self):
+        """終了時は必ず止める"""
+        if motor_right and motor_left:
+            motor_right.value = 0.0
+            motor_left.value = 0.0
+        self._current = (0.0, 0.0)
+        for cmd in [self._active] + list(self._commands.queue):
+            if cmd is not None:
+                self._resolve(cmd)
+        self._active = None
+
+
+# シングルトンインスタンス
+_controller = None
+
+def get_controller():
+    """共有の MotorController を返す（初回呼び出しでスレッド起動）"""
+    global _controller
+    if _controller is None:
+        _controller = MotorController()
+    _controller.start()
+    return _controller
+
+
+# ---------------------------------------------------------
+# PWMベンチ（モーター電源 PIN_VM はOFFのまま、ピンの出力だけを測る）
+# - 実際に設定されたデューティ（量子化後）と、pigpioのエッジ監視で測ったデューティ・周波数・周期のばらつき
+# - ランプ相当の周期で value を書き換えたときの、書き込み時間と周期のずれ
+# ---------------------------------------------------------
+def _measure_pin(pin, hold):
+    """
+    pigpioのエッジ監視で hold 秒間の波形を測る。測れなければ None
+    ※ 監視のサンプル周期は5usなので、20kHzのハードウェアPWMでは1割程度の誤差がある（目安として見る）
+    """
+    if _pi is None:
+        return None
+    edges = []
+    cb = _pi.callback(pin, 2, lambda g, level, tick: edges.append((level, tick)))  # 2: EITHER_EDGE
+    time.sleep(hold)
+    cb.cancel()
+
+    rises = [t for lv, t in edges if lv == 1]
+    if len(rises) < 3:
+        return None
+    periods = np.diff(np.array(rises, dtype=np.int64)) & 0xFFFFFFFF  # tick は32bitで一周する
+    highs = []
+    rise_t = None
+    for lv, t in edges:
+        if lv == 1:
+            rise_t = t
+        elif lv == 0 and rise_t is not None:
+            highs.append((t - rise_t) & 0xFFFFFFFF)
+            rise_t = None
+    if not highs:
+        return None
+    return {
+        "duty": float(np.mean(highs) / np.mean(periods)),
+        "freq": float(1e6 / np.mean(periods)),
+        "jitter_us": float(np.std(periods)),
+    }
+
+def bench_pwm(duties=(0.1, 0.25, 0.5, 0.75, 1.0), hold=0.5, ramp_period=0.025, ramp_steps=200):
+    """
+    PWMの出力と書き込みタイミングを測り、表示とCSV記録を行う
+    Return: 結果dictのリスト
+    """
+    setup_motors()
+    if not (motor_right and motor_left):
+        print("Bench: motors not available")
+        return []
+    GPIO.output(PIN_VM, 0)  # モーターは回さない
+
+    backend = "pigpio" if isinstance(motor_right, PwmMotor) else "gpiozero"
+    results = []
+    for name, motor, pin in (("right", motor_right, PIN_RIGHT_FORWARD), ("left", motor_left, PIN_LEFT_FORWARD)):
+        for d in duties:
+            motor.value = d * MAX_POWER_LIMIT
+            time.sleep(0.05)
+            r = {"backend": backend, "motor": name, "pin": pin,
+                 "target": d * MAX_POWER_LIMIT, "achieved": float(motor.value or 0.0)}
+            m = _measure_pin(pin, hold)
+            if m:
+                r.update({"measured": m["duty"], "freq": m["freq"], "jitter_us": m["jitter_us"]})
+            results.append(r)
+        motor.value = 0.0
+
+    # ランプ相当の書き込み（0→最大→0 を ramp_steps 回に分けて、ramp_period ごと）
+    latency = []
+    lateness = []
+    next_t = time.perf_counter()
+    for i in range(ramp_steps):
+        x = 1.0 - abs(2.0 * i / max(1, ramp_steps - 1) - 1.0)
+        t0 = time.perf_counter()
+        motor_right.value = x * MAX_POWER_LIMIT
+        motor_left.value = x * MAX_POWER_LIMIT
+        t1 = time.perf_counter()
+        latency.append(t1 - t0)
+        lateness.append(t0 - next_t)
+        next_t += ramp_period
+        time.sleep(max(0.0, next_t - time.perf_counter()))
+    motor_right.value = 0.0
+    motor_left.value = 0.0
+    latency = np.array(latency) * 1e6
+    lateness = np.array(lateness) * 1e3
+
+    print(f"--- PWM bench ({backend}) ---")
+    if backend == "pigpio":
+        print(f"right: {motor_right.describe()}")
+        print(f"left : {motor_left.describe()}")
+    for r in results:
+        line = f"{r['motor']:5s} GPIO{r['pin']:<2d} target={r['target']:.3f} achieved={r['achieved']:.3f}"
+        if "measured" in r:
+            line += f" measured={r['measured']:.3f} freq={r['freq']:.0f}Hz jitter={r['jitter_us']:.1f}us"
+        print(line)
+    ramp = (f"ramp write: mean={latency.mean():.0f}us p95={np.percentile(latency, 95):.0f}us "
+            f"max={latency.max():.0f}us / period error: p95={np.percentile(lateness, 95):.2f}ms "
+            f"max={lateness.max():.2f}ms")
+    if backend == "pigpio":
+        writes = motor_right.writes + motor_left.writes
+        skipped = motor_right.skipped + motor_left.skipped
+        ramp += f" / writes={writes} skipped={skipped}"
+    print(ramp)
+
+    if make_csv:
+        try:
+            for r in results:
+                make_csv.print('msg', "pwm bench " + ", ".join(
+                    f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in r.items()))
+            make_csv.print('msg', f"pwm bench ({backend}) {ramp}")
+        except Exception:
+            pass
+    return results
+
+
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="motordrive test")
+    parser.add_argument("--bench", action="store_true", help="measure PWM output and write timing (motor power stays off)")
+    parser.add_argument("--backend", choices=["pigpio", "gpiozero"], help="PWM backend (default: MOTOR_PWM_BACKEND)")
+    parser.add_argument("--freq", type=int, help="hardware PWM frequency [Hz]")
+    parser.add_argument("--soft-freq", type=int, help="software PWM frequency [Hz]")
+    args = parser.parse_args()
+    if args.backend:
+        MOTOR_PWM_BACKEND = args.backend
+    if args.freq:
+        MOTOR_PWM_FREQUENCY = args.freq
+    if args.soft_freq:
+        MOTOR_SOFT_PWM_FREQUENCY = args.soft_freq
+
+    if args.bench:
+        try:
+            bench_pwm()
+        finally:
+            cleanup()
+        raise SystemExit
+
     # 単体テスト用
     try:
         print("--- Motor Test Start ---")
@@ -0,0 +1,194 @@
+# Child processes for the multi-process mode of FM.py (CanSat SC-28)
+# - センサー(sensor_proc.py)とカメラ(vision_proc.py)を別プロセスで動かし、shm_ring のリングでやり取りする
+#   → YOLO・JPEG・I2C が制御ループ（FM.py のメインと motordrive の制御スレッド）と GIL を取り合わない
+# - 子は subprocess で `python3 <script> --child ...` として起動する
+#   （multiprocessing の spawn は FM.py 自体を読み直し、make_csv のログファイルが増えてしまうため）
+# - リングは親が作って親が消す。子は繋いで書くだけ。起動結果は子が status リングに1回書く
+# - リング名には親の pid を入れる。前回の異常終了で残った古いリングは cleanup() で消す
+
+import os
+import sys
+import time
+import signal
+import subprocess
+
+import numpy as np
+
+import shm_ring
+import heartbeat
+
+PREFIX = "sc28_"
+SHM_DIR = "/dev/shm"
+STATUS_DTYPE = np.dtype([("pid", "<i4"), ("ok", "u1", (4,))])
+KILL_WAIT = 2.0
+
+
+def ring_name(kind, pid=None):
+    return f"{PREFIX}{kind}_{pid or os.getpid()}"
+
+
+def cleanup():
+    """死んだプロセスの残したリングを消す"""
+    try:
+        names = os.listdir(SHM_DIR)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(PREFIX):
+            continue
+        try:
+            pid = int(name.rsplit("_", 1)[1])
+        except (IndexError, ValueError):
+            continue
+        if pid == os.getpid() or _alive(pid):
+            continue
+        try:
+            os.remove(os.path.join(SHM_DIR, name))
+        except OSError:
+            pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class ChildProcess:
+    """
+    子プロセス1つ分。rings は {名前: (dtype, shape, slots)}（親が作る）
+    start() は子が status を書くまで待ち、status の ok フラグ(4個)を返す
+    （spawn() で起こしておいて、後で wait_ready() で待つこともできる）
+    """
+    def __init__(self, script, kind, rings, args=(), log_tag=None):
+        self.script = script
+        self.kind = kind
+        self.args = list(args)
+        self.log_tag = log_tag or kind
+        self.proc = None
+        self.rings = {}
+        self.restarts = 0
+        self._status_seq = 0
+        self.closed = False
+        cleanup()
+        for key, (dtype, shape, slots) in rings.items():
+            self.rings[key] = shm_ring.Ring.create(ring_name(f"{kind}_{key}"), dtype, shape, slots)
+        self.status = shm_ring.Ring.create(ring_name(f"{kind}_status"), STATUS_DTYPE, slots=2)
+
+    def ring_args(self):
+        return [f"--ring={key}:{ring_name(f'{self.kind}_{key}')}" for key in self.rings] + \
+               [f"--status={ring_name(f'{self.kind}_status')}"]
+
+    def spawn(self):
+        self._status_seq = self.status.seq
+        env = dict(os.environ)
+        env["SC28_LOG_TAG"] = self.log_tag
+        env.pop(heartbeat.ENV_PATH, None)   # 心拍は親（メインのループ）だけが打つ
+        here = os.path.dirname(os.path.abspath(__file__))
+        cmd = [sys.executable, os.path.join(here, self.script), "--child"] + self.ring_args() + self.args
+        self.proc = subprocess.Popen(cmd, cwd=here, env=env)
+
+    def wait_ready(self, timeout=30.0):
+        """子が status を書くまで待つ（子が先に死んだらすぐ諦める）"""
+        t_end = time.monotonic() + timeout
+        while True:
+            got = self.status.wait(self._status_seq, 0.2)
+            if got is not None:
+                return [bool(x) for x in got[1]["ok"]]
+            if not self.alive:
+                print(f"{self.kind} process exited before reporting")
+                return None
+            if time.monotonic() >= t_end:
+                print(f"{self.kind} process did not report within {timeout:.0f}s")
+                return None
+
+    def start(self, timeout=30.0):
+        self.spawn()
+        return self.wait_ready(timeout)
+
+    def restart(self, timeout=30.0):
+        """子が死んでいたら起こし直して start() の結果を返す。生きていれば None"""
+        if self.alive:
+            return None
+        self.restarts += 1
+        return self.start(timeout)
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        proc = self.proc
+        if proc is None or proc.poll() is not None:
+            return
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(KILL_WAIT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            try:
+                proc.wait(KILL_WAIT)
+            except subprocess.TimeoutExpired:
+                pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.stop()
+        for ring in list(self.rings.values()) + [self.status]:
+            ring.close()
+            ring.unlink()
+        self.rings = {}
+        self.closed = True
+
+
+# ==========================================
+# 子の側
+# ==========================================
+class ChildArgs:
+    """子の --ring=キー:名前 / --status=名前 を読んでリングに繋ぐ（layouts は {キー: (dtype, shape, slots)}）"""
+    def __init__(self, argv, layouts):
+        self.rings = {}
+        self.status = None
+        self.extra = []
+        for a in argv:
+            if a.startswith("--ring="):
+                key, name = a.split("=", 1)[1].split(":", 1)
+                dtype, shape, slots = layouts[key]
+                self.rings[key] = shm_ring.Ring.attach(name, dtype, shape, slots, track=False)
+            elif a.startswith("--status="):
+                self.status = shm_ring.Ring.attach(a.split("=", 1)[1], STATUS_DTYPE, slots=2, track=False)
+            elif a != "--child":
+                self.extra.append(a)
+
+        self.stopped = False
+        self._ppid = os.getppid()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl+C は親が受けて、親が止める
+
+    def _stop(self, *_):
+        self.stopped = True
+
+    def report(self, *ok):
+        rec = np.zeros((), dtype=STATUS_DTYPE)
+        rec["pid"] = os.getpid()
+        rec["ok"][:len(ok)] = [1 if x else 0 for x in ok]
+        self.status.write(rec)
+
+    def parent_gone(self):
+        """親が死んだら（再起動された等）子も止まる"""
+        return os.getppid() != self._ppid
+
+    def close(self):
+        for ring in list(self.rings.values()) + ([self.status] if self.status else []):
+            ring.close()
+
+
+def sleep_until(t):
+    dt = t - time.monotonic()
+    if dt > 0:
+        time.sleep(dt)
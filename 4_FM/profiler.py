@@ -0,0 +1,221 @@
+# Lightweight profiler for CanSat SC-28
+# - with span("name"): / @timed("name") / mark()+record() で区間の時間を計る（time.monotonic_ns）
+# - 区間ごとに HDR 風のヒストグラム（2倍ごとに16分割した対数バケット、誤差3%程度）に溜める
+#   → 件数・合計・p50/p90/p99・最大を、フェーズごとに出せる
+# - 無効のとき(既定)は span() が何もしない共通オブジェクトを返すだけなので、飛行コードに入れたままでよい
+# - 集計はミッションのフェーズ（set_phase()）ごとに分ける。dump() でCSVの msg 行に書き出す
+#
+# 使い方:
+#   import profiler
+#   profiler.enable()
+#   with profiler.span("gps.read"):
+#       ...
+#   @profiler.timed("motor.move")
+#   def move(...): ...
+#   t0 = profiler.mark(); ...; profiler.record("camera.color", t0)   # インデントを変えたくないとき
+
+import time
+import threading
+import functools
+
+SUB_BITS = 4                 # 2倍ごとの分割数 = 2**SUB_BITS
+_SUB = 1 << SUB_BITS
+
+_enabled = False
+_phase = None
+_hists = {}                  # (phase, name) -> Histogram
+_lock = threading.Lock()
+
+
+# ==========================================
+# ヒストグラム
+# ==========================================
+class Histogram:
+    """HDR 風の対数バケットのヒストグラム（値は整数 [ns]）"""
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(v):
+        s = max(0, v.bit_length() - (SUB_BITS + 1))
+        return (s << SUB_BITS) + (v >> s)
+
+    @staticmethod
+    def _bounds(index):
+        s = max(0, (index >> SUB_BITS) - 1)
+        m = index - (s << SUB_BITS)
+        return m << s, ((m + 1) << s) - 1
+
+    def record(self, v):
+        v = max(0, int(v))
+        i = self._index(v)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.count += 1
+        self.total += v
+        if v > self.max:
+            self.max = v
+
+    def merge(self, other):
+        for i, c in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + c
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """q (0~1) のパーセンタイル（バケットの中央の値）"""
+        if self.count == 0:
+            return 0
+        need = max(1, int(round(q * self.count)))
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= need:
+                lo, hi = self._bounds(i)
+                return min((lo + hi) // 2, self.max)
+        return self.max
+
+    def summary(self):
+        ms = 1e-6
+        return (f"n={self.count} total={self.total * ms:.0f}ms p50={self.percentile(0.5) * ms:.2f}ms "
+                f"p90={self.percentile(0.9) * ms:.2f}ms p99={self.percentile(0.99) * ms:.2f}ms "
+                f"max={self.max * ms:.2f}ms")
+
+
+# ==========================================
+# 計測
+# ==========================================
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+
+def enabled():
+    return _enabled
+
+
+def set_phase(phase):
+    """これ以降の計測をこのフェーズの分として集計する"""
+    global _phase
+    _phase = phase
+
+
+def reset():
+    with _lock:
+        _hists.clear()
+
+
+def _add(name, dt):
+    key = (_phase, name)
+    with _lock:
+        h = _hists.get(key)
+        if h is None:
+            h = _hists[key] = Histogram()
+        h.record(dt)
+
+
+def mark():
+    """計測の開始時刻（無効なら None）"""
+    return time.monotonic_ns() if _enabled else None
+
+
+def record(name, t0):
+    """mark() からの経過時間を name に加える"""
+    if t0 is not None:
+        _add(name, time.monotonic_ns() - t0)
+
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _add(self.name, time.monotonic_ns() - self.t0)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSpan()
+
+
+def span(name):
+    """with span("name"): の区間を計る"""
+    return _Span(name) if _enabled else _NULL
+
+
+def timed(name=None):
+    """関数全体を計るデコレータ（name を省略すると モジュール名.関数名）"""
+    def deco(fn):
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            t0 = time.monotonic_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _add(label, time.monotonic_ns() - t0)
+        return wrapper
+    return deco
+
+
+# ==========================================
+# 集計の出力
+# ==========================================
+def histograms(phase=None):
+    """{name: Histogram}。phase=None なら全フェーズを合算する"""
+    out = {}
+    with _lock:
+        for (p, name), h in _hists.items():
+            if phase is not None and p != phase:
+                continue
+            acc = out.get(name)
+            if acc is None:
+                acc = out[name] = Histogram()
+            acc.merge(h)
+    return out
+
+
+def report(phase=None):
+    """区間ごとの集計行のリスト（合計時間の長い順）"""
+    hists = histograms(phase)
+    head = "all phases" if phase is None else f"phase {phase}"
+    return [f"profile [{head}] {name}: {h.summary()}"
+            for name, h in sorted(hists.items(), key=lambda kv: -kv[1].total)]
+
+
+def dump(phase=None):
+    """集計を表示してCSVの msg 行に書く"""
+    if not _enabled:
+        return []
+    lines = report(phase)
+    try:
+        import make_csv
+    except ImportError:
+        make_csv = None
+    for line in lines:
+        print(line)
+        if make_csv:
+            try: make_csv.print("msg", line)
+            except Exception: pass
+    return lines
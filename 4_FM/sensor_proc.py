@@ -0,0 +1,244 @@
+# Sensor process for the multi-process mode of FM.py (CanSat SC-28)
+# - BNO055 と BME280 を別プロセスで一定周期で読み、shm_ring のリングに書く
+#   → I2C の読み取り（1回 1~3 ms、バスが乱れると数十 ms）がメインの制御ループやカメラと GIL を取り合わない
+# - 親（FM.py）は SharedBNO / SharedBME を BNO055 / BME280Sensor の代わりに使う。読み取りはリングの最新値を返すだけ
+#   古い（STALE_TIME を超えた）・読めなかった値は None を返すので、ijochi.abnormal_check のリトライはそのまま効く
+#
+# 使い方（親の側）:
+#   sp = sensor_proc.SensorProcess()
+#   bno_ok, bme_ok = sp.start()
+#   bno = sensor_proc.SharedBNO(sp); bme = sensor_proc.SharedBME(sp)
+#   ...
+#   sp.close()
+
+import sys
+import time
+
+import numpy as np
+
+import procs
+
+IMU_PERIOD = 0.02            # 姿勢の読み取り周期 [s]（50 Hz）
+BARO_PERIOD = 0.05           # 気圧の読み取り周期 [s]（20 Hz。FM.ALT_FILTER_PERIOD と同じ）
+IMU_SLOTS = 64               # 約 1.3 秒分
+BARO_SLOTS = 128             # 約 6 秒分（基準気圧の平均に使う）
+STALE_TIME = 0.5             # これより古い値は使わない [s]
+START_TIMEOUT = 30.0         # センサーの初期化（リトライ込み）を待つ時間 [s]
+BASELINE_SAMPLES = 20        # 基準気圧に平均するサンプル数（リングに溜まっている分も使う）
+
+# 姿勢レコード。valid は euler / grav / gyro / accel_line が読めたかどうか
+IMU_DTYPE = np.dtype([
+    ("t", "<f8"),
+    ("euler", "<f8", (3,)),
+    ("grav", "<f8", (3,)),
+    ("gyro", "<f8", (3,)),
+    ("accel_line", "<f8", (3,)),
+    ("valid", "u1", (4,)),
+])
+_IMU_FIELDS = ("euler", "grav", "gyro", "accel_line")
+
+BARO_DTYPE = np.dtype([
+    ("t", "<f8"),
+    ("press", "<f8"),
+    ("temp", "<f8"),
+])
+
+LAYOUTS = {
+    "imu": (IMU_DTYPE, (), IMU_SLOTS),
+    "baro": (BARO_DTYPE, (), BARO_SLOTS),
+}
+
+
+# ==========================================
+# 親の側
+# ==========================================
+class SensorProcess(procs.ChildProcess):
+    def __init__(self):
+        super().__init__("sensor_proc.py", "sensor", LAYOUTS, log_tag="sensor")
+        self.bno_ok = False
+        self.bme_ok = False
+
+    def start(self, timeout=START_TIMEOUT):
+        ok = super().start(timeout)
+        if ok is None:
+            self.stop()
+            return False, False
+        self.bno_ok, self.bme_ok = ok[0], ok[1]
+        return self.bno_ok, self.bme_ok
+
+    def restart(self, timeout=START_TIMEOUT):
+        ok = super().restart(timeout)
+        if ok is not None:
+            self.bno_ok, self.bme_ok = ok[0], ok[1]
+        return ok
+
+    def latest(self, key):
+        """最新のレコード。無い・古ければ None"""
+        got = self.rings[key].latest()
+        if got is None or time.monotonic() - float(got[1]["t"]) > STALE_TIME:
+            return None
+        return got[1]
+
+
+class SharedBNO:
+    """BNO055 の代わり（読み取りだけ）。値は子が最後に読んだもの"""
+    def __init__(self, sp):
+        self.sp = sp
+
+    def begin(self):
+        return self.sp.bno_ok
+
+    def _field(self, i):
+        rec = self.sp.latest("imu")
+        if rec is None or not rec["valid"][i]:
+            return None
+        return tuple(float(x) for x in rec[_IMU_FIELDS[i]])
+
+    def euler(self):
+        return self._field(0)
+
+    def gravity(self):
+        return self._field(1)
+
+    def gyroscope(self):
+        return self._field(2)
+
+    def linear_acceleration(self):
+        return self._field(3)
+
+    def close(self):
+        pass        # センサーは子が閉じる
+
+
+class SharedBME:
+    """BME280Sensor の代わり（読み取りだけ）"""
+    def __init__(self, sp):
+        self.sp = sp
+
+    @property
+    def calib_ok(self):
+        return self.sp.bme_ok
+
+    def pressure(self):
+        rec = self.sp.latest("baro")
+        return None if rec is None else float(rec["press"])
+
+    def temperature(self):
+        rec = self.sp.latest("baro")
+        return None if rec is None else float(rec["temp"])
+
+    def read_all(self):
+        rec = self.sp.latest("baro")
+        if rec is None:
+            return None, None, None
+        return float(rec["temp"]), float(rec["press"]), None
+
+    def altitude(self, pressure, qnh=1013.25):
+        from bme280 import BME280Sensor
+        return BME280Sensor.altitude(self, pressure, qnh)
+
+    def baseline(self):
+        """直近の BASELINE_SAMPLES 個を平均する（子は読み続けているのでウォームアップ分は捨てなくてよい）"""
+        if not self.calib_ok:
+            return 1013.25
+        ring = self.sp.rings["baro"]
+        seq = max(0, ring.seq - BASELINE_SAMPLES)
+        values = []
+        t_end = time.monotonic() + BASELINE_SAMPLES * BARO_PERIOD * 2 + 1.0
+        while len(values) < BASELINE_SAMPLES and time.monotonic() < t_end:
+            for seq, rec in ring.since(seq):
+                values.append(float(rec["press"]))
+            time.sleep(BARO_PERIOD)
+        if not values:
+            return 1013.25
+        return sum(values) / len(values)
+
+    def close(self):
+        pass
+
+
+# ==========================================
+# 子の側
+# ==========================================
+def _open_sensors():
+    """FM.setup_sensors と同じく 10回までリトライする"""
+    from bno055 import BNO055
+    from bme280 import BME280Sensor
+
+    bme = None
+    for attempt in range(10):
+        try:
+            dev = BME280Sensor(debug=False)
+            if dev.calib_ok:
+                bme = dev
+                break
+        except Exception as e:
+            print(f"[sensor] BME280 Setup Error: {e} ({attempt + 1}/10)")
+        time.sleep(0.5)
+
+    bno = None
+    for attempt in range(10):
+        try:
+            dev = BNO055()
+            if dev.begin():
+                bno = dev
+                break
+        except Exception as e:
+            print(f"[sensor] BNO055 Setup Error: {e} ({attempt + 1}/10)")
+        time.sleep(0.5)
+    return bno, bme
+
+
+def _read_imu(bno, rec):
+    rec["t"] = time.monotonic()
+    for i, (name, fn) in enumerate(zip(_IMU_FIELDS, (bno.euler, bno.gravity, bno.gyroscope, bno.linear_acceleration))):
+        try:
+            v = fn()
+        except Exception:
+            v = None
+        if v is None or len(v) != 3:
+            rec["valid"][i] = 0
+        else:
+            rec[name] = v
+            rec["valid"][i] = 1
+
+
+def child_main(argv):
+    args = procs.ChildArgs(argv, LAYOUTS)
+    bno, bme = _open_sensors()
+    args.report(bno is not None, bme is not None)
+
+    imu = np.zeros((), dtype=IMU_DTYPE)
+    baro = np.zeros((), dtype=BARO_DTYPE)
+    next_imu = next_baro = time.monotonic()
+    try:
+        while not args.stopped and not args.parent_gone():
+            now = time.monotonic()
+            if bno is not None and now >= next_imu:
+                _read_imu(bno, imu)
+                args.rings["imu"].write(imu)
+                next_imu = max(next_imu + IMU_PERIOD, now)
+            if bme is not None and now >= next_baro:
+                try:
+                    t, p, _ = bme.read_all()
+                except Exception:
+                    t = p = None
+                if p is not None:
+                    baro["t"] = time.monotonic()
+                    baro["press"] = p
+                    baro["temp"] = t
+                    args.rings["baro"].write(baro)
+                next_baro = max(next_baro + BARO_PERIOD, now)
+            targets = [x for x, dev in ((next_imu, bno), (next_baro, bme)) if dev is not None]
+            procs.sleep_until(min(targets) if targets else now + 0.5)
+    finally:
+        for dev in (bno, bme):
+            if dev is not None:
+                try: dev.close()
+                except Exception: pass
+        args.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(child_main(sys.argv[1:]))
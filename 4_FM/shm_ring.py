@@ -0,0 +1,179 @@
+# Shared-memory ring buffer for CanSat SC-28
+# - multiprocessing.shared_memory 上に固定長レコード（numpy の dtype / shape）のリングを置き、
+#   1つの書き手プロセスと何個でもの読み手プロセスでやり取りする（pickle もコピー用のキューも通さない）
+# - レコードごとに通し番号(seq)を持つ。書き手は「seq を 0 にする → 中身を書く → seq を書く → 先頭の最新番号を更新」
+#   の順に書き、読み手は 読む前後で seq が変わっていなければ採用する（seqlock）。書き込み中に読んだら読み直す
+# - 読み手は latest() で最新だけを取るか、since(seq) で取りこぼし無く順番に取る（リングを一周されたら古いものは失う）
+#
+# 使い方:
+#   ring = shm_ring.Ring.create("sc28_imu", IMU_DTYPE, slots=64)     # 書き手
+#   ring.write(rec)
+#   ring = shm_ring.Ring.attach("sc28_imu", IMU_DTYPE, slots=64)     # 読み手（別プロセス）
+#   seq, rec = ring.latest()
+#
+# ※ unlink は作った側が1回だけ行う。subprocess で起こした別の Python から繋ぐときは attach(track=False)
+#    （3.11 の resource_tracker は、繋いだだけのプロセスが終わるときにも共有メモリを消してしまうため）
+
+import time
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+_HEADER = struct.Struct("<IIQQ")     # magic, slots, record_size, 最新の seq
+_MAGIC = 0x5C28_0001
+_HEADER_SIZE = 64                    # キャッシュラインに揃える
+READ_RETRIES = 8
+
+
+class RingError(Exception):
+    pass
+
+
+class Ring:
+    def __init__(self, shm, dtype, shape, slots, owner):
+        self.shm = shm
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.slots = int(slots)
+        self.owner = owner
+        self.record_size = int(self.dtype.itemsize * int(np.prod(self.shape, dtype=np.int64)))
+
+        self._slot_dtype = np.dtype([("seq", "<u8"), ("data", self.dtype, self.shape)])
+        need = _HEADER_SIZE + self._slot_dtype.itemsize * self.slots
+        if shm.size < need:
+            raise RingError(f"shared memory '{shm.name}' is too small ({shm.size} < {need})")
+        self._head = np.ndarray((1,), dtype="<u8", buffer=shm.buf, offset=_HEADER.size - 8)
+        ring = np.ndarray((self.slots,), dtype=self._slot_dtype, buffer=shm.buf, offset=_HEADER_SIZE)
+        self._seqs = ring["seq"]
+        self._data = ring["data"]
+
+    # ----------------------------
+    # 作成・接続
+    # ----------------------------
+    @classmethod
+    def create(cls, name, dtype, shape=(), slots=8):
+        """書き手がリングを作る（同じ名前の古いものが残っていれば作り直す）"""
+        dtype = np.dtype(dtype)
+        size = _HEADER_SIZE + np.dtype([("seq", "<u8"), ("data", dtype, tuple(shape))]).itemsize * slots
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        ring = cls(shm, dtype, shape, slots, owner=True)
+        ring._seqs[:] = 0
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, slots, ring.record_size, 0)
+        return ring
+
+    @classmethod
+    def attach(cls, name, dtype, shape=(), slots=8, timeout=0.0, track=True):
+        """
+        既存のリングに繋ぐ（timeout 秒まで作られるのを待つ）
+        track=False: このプロセスの resource_tracker に登録しない（multiprocessing の子でない別プロセス用）
+        """
+        t_end = time.monotonic() + timeout
+        while True:
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+                break
+            except FileNotFoundError:
+                if time.monotonic() >= t_end:
+                    raise
+                time.sleep(0.05)
+        if not track:
+            try:
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+        magic, n, size, _ = _HEADER.unpack_from(shm.buf, 0)
+        ring = cls(shm, dtype, shape, slots, owner=False)
+        if magic != _MAGIC or n != slots or size != ring.record_size:
+            ring.close()
+            raise RingError(f"ring '{name}' layout mismatch (slots={n}, record_size={size})")
+        return ring
+
+    # ----------------------------
+    # 書き込み（書き手は1プロセス・1スレッドだけ）
+    # ----------------------------
+    def write(self, value):
+        """1レコード書いて、その seq を返す"""
+        seq = int(self._head[0]) + 1
+        i = seq % self.slots
+        self._seqs[i] = 0            # 書き込み中
+        self._data[i] = value
+        self._seqs[i] = seq
+        self._head[0] = seq
+        return seq
+
+    # ----------------------------
+    # 読み込み
+    # ----------------------------
+    @property
+    def seq(self):
+        """最新の seq（まだ何も書かれていなければ 0）"""
+        return int(self._head[0])
+
+    def _read(self, seq):
+        """seq のレコードのコピー。書き込み中なら読み直し、上書き済みなら None"""
+        i = seq % self.slots
+        for _ in range(READ_RETRIES):
+            if int(self._seqs[i]) != seq:
+                if int(self._head[0]) - seq >= self.slots:
+                    return None      # 一周されて上書きされた
+                time.sleep(0)
+                continue
+            data = np.array(self._data[i], copy=True)
+            if int(self._seqs[i]) == seq:
+                return data
+        return None
+
+    def latest(self):
+        """(seq, レコード) の最新。まだ無ければ None"""
+        for _ in range(READ_RETRIES):
+            seq = self.seq
+            if seq == 0:
+                return None
+            data = self._read(seq)
+            if data is not None:
+                return seq, data
+        return None
+
+    def since(self, seq):
+        """seq より後のレコードを古い順に [(seq, レコード), ...]（リングに残っている分だけ）"""
+        head = self.seq
+        out = []
+        for s in range(max(seq + 1, head - self.slots + 1, 1), head + 1):
+            data = self._read(s)
+            if data is not None:
+                out.append((s, data))
+        return out
+
+    def wait(self, after, timeout):
+        """seq が after より大きくなるまで待つ。来なければ None"""
+        t_end = time.monotonic() + timeout
+        while self.seq <= after:
+            if time.monotonic() >= t_end:
+                return None
+            time.sleep(0.002)
+        return self.latest()
+
+    # ----------------------------
+    # 後始末
+    # ----------------------------
+    def close(self):
+        # numpy のビューが残っていると close できないので先に外す
+        self._head = self._seqs = self._data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+    def unlink(self):
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,142 @@
+# Stack detector for CanSat SC-28
+# - IMU(ジャイロ・線形加速度)のサンプルをリングバッファに溜め、直近の窓で統計量をまとめて計算する
+#   * 低域(SLIP_MIN_HZ 未満)だけにした加速度・角速度のRMS（車体そのものがどれだけ動いているか）
+#   * 加速度のRMSジャーク（地面の凹凸を乗り越える時の衝撃。記録用で、判定には使わない）
+#   * 加速度のスペクトル: 低域(車体の揺れ) と 高域(空転したタイヤの細かい振動) のエネルギー比
+#   高域の振動は「動いている」には数えない。空転の振動が強いほどスタックしている確率を上げる
+# - 1サンプルのしきい値判定ではなく、窓全体から「スタックしている確率」を出す
+#   草や土の上で一瞬だけ静かになっても誤検知しにくく、空転が続けば早めに検知できる
+
+import math
+
+import numpy as np
+
+# 基準値: 従来の1サンプル判定のしきい値（|線形加速度|>0.5, |ジャイロ|>0.6, 旋回中|gyro z|>0.2）
+ACCEL_REF = 0.5      # [m/s^2]
+GYRO_REF = 0.6       # [rad/s]
+TURN_GYRO_REF = 0.2  # [rad/s]
+
+LOW_BAND = (0.3, 3.0)   # 車体の揺れ [Hz]
+SLIP_MIN_HZ = 3.0       # これより上は空転振動とみなす [Hz]
+
+
+class StackDetector:
+    def __init__(self, window=1.0, capacity=128, gain=4.0, slip_gain=3.0, min_fill=0.75):
+        """
+        window: 統計を取る時間幅 [s]
+        capacity: リングバッファの最大サンプル数
+        gain: 動きの大きさ(対数)に対する確率の感度
+        slip_gain: 空転振動の割合に対する確率の感度
+        min_fill: 窓の何割分の時間が溜まるまで判定しないか
+        """
+        self.window = float(window)
+        self.gain = float(gain)
+        self.slip_gain = float(slip_gain)
+        self.min_fill = float(min_fill)
+        self._buf = np.zeros((int(capacity), 7), dtype=np.float64)  # t, gx, gy, gz, ax, ay, az
+        self._idx = 0
+        self._count = 0
+
+    def reset(self):
+        self._idx = 0
+        self._count = 0
+
+    def add(self, t, gyro, lin_accel):
+        """1サンプル追加する（どちらかが None なら捨てる）"""
+        if gyro is None or lin_accel is None:
+            return
+        row = self._buf[self._idx]
+        row[0] = t
+        row[1:4] = gyro[:3]
+        row[4:7] = lin_accel[:3]
+        self._idx = (self._idx + 1) % len(self._buf)
+        self._count = min(self._count + 1, len(self._buf))
+
+    def _window(self):
+        """直近 window 秒のサンプルを古い順に返す"""
+        if self._count == 0:
+            return self._buf[:0]
+        if self._count < len(self._buf):
+            data = self._buf[:self._count]
+        else:
+            data = np.roll(self._buf, -self._idx, axis=0)
+        t_end = data[-1, 0]
+        return data[data[:, 0] >= t_end - self.window]
+
+    @staticmethod
+    def _lowpass(x, fs):
+        """各列から SLIP_MIN_HZ 以上の成分を取り除く（空転振動を車体の動きに数えないため）"""
+        if fs <= 2 * SLIP_MIN_HZ:
+            return x
+        spec = np.fft.rfft(x, axis=0)
+        spec[np.fft.rfftfreq(len(x), d=1.0 / fs) >= SLIP_MIN_HZ] = 0.0
+        return np.fft.irfft(spec, n=len(x), axis=0)
+
+    def features(self, turning=False):
+        """
+        窓内の統計量を返す。サンプル不足なら None
+        Return: dict(accel_rms, gyro_rms, jerk_rms, slip_ratio, motion)
+        accel_rms / gyro_rms は低域だけの値
+        """
+        data = self._window()
+        if len(data) < 4 or (data[-1, 0] - data[0, 0]) < self.window * self.min_fill:
+            return None
+
+        t = data[:, 0]
+        gyro = data[:, 1:4]
+        accel = data[:, 4:7]
+
+        dt = np.diff(t)
+        dt[dt <= 0] = np.nan
+        # サンプル間隔はほぼ一定とみなす
+        fs = 1.0 / float(np.nanmedian(dt)) if np.any(np.isfinite(dt)) else 0.0
+
+        a_norm = np.sqrt(np.sum(accel * accel, axis=1))
+        jerk = np.diff(a_norm) / dt
+        jerk_rms = float(np.sqrt(np.nanmean(jerk * jerk))) if np.any(np.isfinite(jerk)) else 0.0
+
+        # 車体の動き: 低域の加速度・角速度
+        accel_low = self._lowpass(accel, fs)
+        gyro_low = self._lowpass(gyro, fs)
+        accel_rms = float(np.sqrt(np.mean(np.sum(accel_low * accel_low, axis=1))))
+        if turning:
+            gyro_rms = float(np.sqrt(np.mean(gyro_low[:, 2] ** 2)))
+        else:
+            gyro_rms = float(np.sqrt(np.mean(np.sum(gyro_low * gyro_low, axis=1))))
+
+        # 空転振動: 高域のエネルギーの割合
+        slip_ratio = 0.5
+        if fs > 2 * SLIP_MIN_HZ:
+            x = a_norm - a_norm.mean()
+            power = np.abs(np.fft.rfft(x * np.hanning(len(x)))) ** 2
+            freqs = np.fft.rfftfreq(len(x), d=1.0 / fs)
+            e_low = float(power[(freqs >= LOW_BAND[0]) & (freqs < LOW_BAND[1])].sum())
+            e_high = float(power[freqs >= SLIP_MIN_HZ].sum())
+            if e_low + e_high > 1e-9:
+                slip_ratio = e_high / (e_low + e_high)
+
+        if turning:
+            motion = gyro_rms / TURN_GYRO_REF
+        else:
+            motion = max(accel_rms / ACCEL_REF, gyro_rms / GYRO_REF)
+
+        return {
+            "accel_rms": accel_rms,
+            "gyro_rms": gyro_rms,
+            "jerk_rms": jerk_rms,
+            "slip_ratio": slip_ratio,
+            "motion": motion,
+        }
+
+    def probability(self, turning=False):
+        """
+        スタックしている確率 (0.0~1.0) を返す。サンプル不足なら None
+        動きが基準値ちょうど・空転振動の割合が半々のとき 0.5
+        """
+        f = self.features(turning=turning)
+        if f is None:
+            return None
+        z = -self.gain * math.log(max(f["motion"], 1e-3))
+        if not turning:
+            z += self.slip_gain * (f["slip_ratio"] - 0.5)
+        return 1.0 / (1.0 + math.exp(-z))
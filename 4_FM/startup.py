@@ -0,0 +1,218 @@
+# 起動時間の短縮と計測 for CanSat SC-28
+# - 重いモジュール（cv2, camera, gps(pyproj), motordrive(numpy/gpiozero) など）を LazyModule にして、
+#   フェーズ1に要らないものは起動直後に読み込まない
+# - preload() で別スレッドに先読みさせる（センサーのセットアップ中の待ち時間に import が進む）
+# - install() 中の import を -X importtime と同じ形式（self / cumulative [us]）で記録し、起動ごとに書き出す
+# - milestone() でプロセス起動からの経過時間を記録する（電源投入→最初の気圧サンプルまで 2 秒以内が目標）
+#
+# 使い方:
+#   import startup
+#   startup.install()
+#   md = startup.lazy("motordrive")      # 属性に触れた時点で import（先読み中なら完了を待つ）
+#   startup.preload(["motordrive", "gps"], on_done=...)
+#   startup.milestone("first pressure sample")
+
+import os
+import sys
+import time
+import builtins
+import threading
+
+_t_import = time.perf_counter()  # このモジュールを読み込んだ時刻（/proc が読めないときの起点）
+
+_orig_import = builtins.__import__
+_installed = False
+_records = []                    # (順番, スレッド名, 深さ, モジュール名, self[us], cumulative[us])
+_local = threading.local()
+_lock = threading.Lock()
+
+_milestones = []                 # (名前, プロセス起動からの経過 [s])
+
+
+# ==========================================
+# プロセス起動からの経過時間
+# ==========================================
+def _process_age():
+    """プロセス起動からの経過時間 [s]（/proc が無ければ None）"""
+    try:
+        with open("/proc/self/stat") as f:
+            stat = f.read()
+        # comm に空白や括弧が入ることがあるので、最後の ')' より後ろを数える
+        fields = stat[stat.rindex(")") + 2:].split()
+        start_ticks = int(fields[19])            # 22番目の starttime
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+_age_offset = None
+
+
+def elapsed():
+    """プロセス起動からの経過時間 [s]（/proc が無ければこのモジュールの読み込みからの時間）"""
+    global _age_offset
+    if _age_offset is None:
+        age = _process_age()
+        # /proc の分解能は 10ms なので、一度だけ読んで以降は perf_counter で進める（シミュレータの仮想時計の影響も受けない）
+        _age_offset = (age - (time.perf_counter() - _t_import)) if age is not None else 0.0
+    return _age_offset + (time.perf_counter() - _t_import)
+
+
+def milestone(name):
+    """起動の節目を記録して表示・CSVに書く"""
+    t = elapsed()
+    _milestones.append((name, t))
+    _log("msg", f"startup: {name} at {t:.2f}s")
+    return t
+
+
+def milestones():
+    return list(_milestones)
+
+
+# ==========================================
+# import の記録（-X importtime 相当）
+# ==========================================
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _orig_import(name, globals, locals, fromlist, level)
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(0)                      # 子の import の合計時間
+    t0 = time.perf_counter_ns()
+    try:
+        return _orig_import(name, globals, locals, fromlist, level)
+    finally:
+        cum = (time.perf_counter_ns() - t0) // 1000
+        child = stack.pop()
+        if stack:
+            stack[-1] += cum
+        with _lock:
+            _records.append((len(_records), threading.current_thread().name, len(stack),
+                             name, cum - child, cum))
+
+
+def install():
+    """これ以降の import の時間を記録する"""
+    global _installed
+    if not _installed:
+        builtins.__import__ = _timed_import
+        _installed = True
+
+
+def uninstall():
+    """記録をやめる（飛行中の import に余計な処理を挟まない）"""
+    global _installed
+    if _installed:
+        if builtins.__import__ is _timed_import:
+            builtins.__import__ = _orig_import
+        _installed = False
+
+
+def records():
+    with _lock:
+        return list(_records)
+
+
+def report(top=None):
+    """
+    -X importtime と同じ形式の行のリスト（top を指定すると cumulative の大きい最上位の import だけ）
+    子の import は親より先に終わるので、スレッドごとに記録順のまま字下げして並べる
+    """
+    rows = records()
+    if top is not None:
+        roots = sorted((r for r in rows if r[2] == 0), key=lambda r: -r[5])[:top]
+        return [f"import {r[3]}: {r[5] / 1000:.0f}ms ({r[1]})" for r in roots]
+
+    lines = ["import time: self [us] | cumulative | imported package"]
+    for thread in dict.fromkeys(r[1] for r in rows):
+        lines.append(f"# thread {thread}")
+        for _, _, depth, name, self_us, cum_us in (r for r in rows if r[1] == thread):
+            lines.append(f"import time: {self_us:>9} | {cum_us:>10} | {'  ' * depth}{name}")
+    return lines
+
+
+def write_report(path):
+    """import の記録と起動の節目をファイルに書き出す"""
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            for name, t in _milestones:
+                f.write(f"# {name}: {t:.3f}s\n")
+            f.write("\n".join(report()) + "\n")
+        return path
+    except OSError as e:
+        print(f"Warning: import time report could not be written: {e}")
+        return None
+
+
+# ==========================================
+# 遅延読み込み
+# ==========================================
+class LazyModule:
+    """属性に初めて触れたときに import されるモジュールの代わり"""
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            # 先読みスレッドが読み込み中なら、import のモジュールロックで完了を待つことになる
+            __import__(self._name)
+            module = self.__dict__["_module"] = sys.modules[self._name]
+        return module
+
+    @property
+    def loaded(self):
+        return self.__dict__["_module"] is not None or self._name in sys.modules
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy(name):
+    return LazyModule(name)
+
+
+def preload(names, on_done=None):
+    """
+    names を順に別スレッドで import する（失敗しても続ける）
+    on_done(errors) は全部終わった後に先読みスレッドで呼ばれる。errors は {モジュール名: 例外}
+    """
+    def worker():
+        errors = {}
+        for name in names:
+            try:
+                __import__(name)
+            except Exception as e:
+                errors[name] = e
+                _log("error", f"モジュール読み込みエラー: {name}: {e}")
+        if on_done is not None:
+            try:
+                on_done(errors)
+            except Exception as e:
+                _log("error", f"startup: preload callback failed: {e}")
+
+    thread = threading.Thread(target=worker, name="preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def _log(kind, msg):
+    print(msg)
+    try:
+        import make_csv
+        make_csv.print(kind, msg)
+    except Exception:
+        pass
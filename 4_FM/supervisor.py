@@ -0,0 +1,296 @@
+# Supervisor for FM.py (CanSat SC-28)
+# - FM.py を子プロセスとして起動し、heartbeat.py の心拍（期限）を見張る
+# - 期限切れ（I2C で固まった・カメラがデッドロックした等）や異常終了なら、止めて（SIGTERM → SIGKILL）起動し直す
+#   → 再開は checkpoint.py のチェックポイントから。固まってから復帰までは 心拍の猶予 + 1~2 秒
+# - 殺した直後はモーター・ニクロム線のピンを pigpio で LOW にする（pigpio は子が死んでもPWMを出し続けるため）
+# - 再起動の理由を restarts.csv に残し、子にも環境変数で渡す（FM.py がCSVに記録する）
+# - --watchdog を付けると /dev/watchdog を撫で続ける。supervisor ごと固まれば、カーネルが Pi を再起動する
+#   短時間に再起動が続くとき（--max-restarts）は撫でるのをやめて Pi ごと再起動させる
+#
+# 使い方:
+#   python3 supervisor.py                                  # FM.py を見張る
+#   python3 supervisor.py --watchdog /dev/watchdog --timeout 8
+#   python3 supervisor.py -- python3 some_test.py          # 任意のコマンドを見張る
+
+import os
+import sys
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+import heartbeat
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HEARTBEAT_TIMEOUT = 8.0      # beat が来なくなってから再起動するまで [s]
+START_GRACE = 20.0           # 起動してから最初の beat までの猶予 [s]（import とセンサーのセットアップ）
+POLL_PERIOD = 0.2            # 見張りの周期 [s]
+KILL_WAIT = 2.0              # SIGTERM から SIGKILL までの待ち [s]
+RESTART_BACKOFF = (0.5, 1.0, 2.0, 5.0)   # 続けて落ちたときの再起動までの待ち [s]
+STABLE_TIME = 60.0           # これだけ動き続けたら、落ちても待ちを最初に戻す [s]
+MAX_RESTARTS = 5             # RESTART_WINDOW の間にこれを超えて再起動したら諦める
+RESTART_WINDOW = 300.0       # [s]
+
+WATCHDOG_TIMEOUT = 15        # ハードウェアウォッチドッグの時間 [s]（BCM2835 は最大 15 秒）
+WATCHDOG_PET_PERIOD = 1.0    # [s]
+
+# 子を殺した後に LOW にするピン（BCM番号）
+# FM.py の NICHROME_PIN / LED_PIN と、motordrive.py のモーター・VMピン
+SAFE_LOW_PINS = (16, 5, 18, 23, 13, 24, 4)
+
+LOG_DIR = '/home/sc28/SC-28/5_log'
+_HEARTBEAT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+HEARTBEAT_PATH = os.path.join(_HEARTBEAT_DIR, "sc28_heartbeat")   # SDカードに書かないよう RAM 上に置く
+
+WDIOC_SETTIMEOUT = 0xC0045706
+
+
+# ==========================================
+# ハードウェアウォッチドッグ
+# ==========================================
+class Watchdog:
+    """/dev/watchdog を開いている間、pet() しないと Pi が再起動する"""
+    def __init__(self, path, timeout=WATCHDOG_TIMEOUT):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY)
+        self.last_pet = 0.0
+        try:
+            import fcntl
+            import struct
+            fcntl.ioctl(self.fd, WDIOC_SETTIMEOUT, struct.pack("I", int(timeout)))
+        except (ImportError, OSError) as e:
+            print(f"Warning: watchdog timeout not set: {e}")
+
+    def pet(self):
+        now = time.monotonic()
+        if now - self.last_pet >= WATCHDOG_PET_PERIOD:
+            os.write(self.fd, b"\0")
+            self.last_pet = now
+
+    def close(self):
+        """'V' を書いてから閉じると止まる（magic close）"""
+        try:
+            os.write(self.fd, b"V")
+        except OSError:
+            pass
+        os.close(self.fd)
+
+
+# ==========================================
+# 見張り
+# ==========================================
+class Supervisor:
+    def __init__(self, cmd, cwd=HERE, timeout=HEARTBEAT_TIMEOUT, start_grace=START_GRACE,
+                 heartbeat_path=HEARTBEAT_PATH, log_path=None, watchdog=None,
+                 max_restarts=MAX_RESTARTS, restart_window=RESTART_WINDOW):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.timeout = timeout
+        self.start_grace = start_grace
+        self.heartbeat_path = heartbeat_path
+        self.log_path = log_path
+        self.watchdog = watchdog
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+
+        self.proc = None
+        self.started_at = None
+        self.restarts = 0
+        self.restart_times = []
+        self.cause = None
+        self.backoff = 0
+        self.giving_up = False
+        self._stop = False
+
+    # ----------------------------
+    # 子プロセス
+    # ----------------------------
+    def _start(self):
+        try:
+            os.remove(self.heartbeat_path)
+        except FileNotFoundError:
+            pass
+        env = dict(os.environ)
+        env[heartbeat.ENV_PATH] = self.heartbeat_path
+        env[heartbeat.ENV_TIMEOUT] = str(self.timeout)
+        if self.cause:
+            env[heartbeat.ENV_CAUSE] = self.cause
+            env[heartbeat.ENV_RESTARTS] = str(self.restarts)
+        self.proc = subprocess.Popen(self.cmd, cwd=self.cwd, env=env)
+        self.started_at = time.monotonic()
+        print(f"[supervisor] started pid={self.proc.pid}: {' '.join(self.cmd)}")
+
+    def _kill(self):
+        """SIGTERM、だめなら SIGKILL（I2C の中で固まっていると SIGTERM では死なないことがある）"""
+        proc = self.proc
+        if proc is None or proc.poll() is not None:
+            return
+        proc.terminate()
+        try:
+            proc.wait(KILL_WAIT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            try:
+                proc.wait(KILL_WAIT)
+            except subprocess.TimeoutExpired:
+                print(f"[supervisor] pid={proc.pid} did not exit after SIGKILL")
+
+    def _check(self):
+        """子の様子を見て、再起動が必要なら理由を返す"""
+        code = self.proc.poll()
+        if code is not None:
+            if code == 0:
+                return None
+            if code < 0:
+                return f"killed by signal {-code}"
+            return f"exited with code {code}"
+
+        now = time.monotonic()
+        hb = heartbeat.read(self.heartbeat_path)
+        if hb is None or hb[0] != self.proc.pid:
+            if now - self.started_at > self.start_grace:
+                return f"no heartbeat {self.start_grace:.0f}s after start"
+            return None
+        _, deadline, phase = hb
+        if now > deadline:
+            return f"heartbeat missed by {now - deadline:.1f}s (phase {phase})"
+        return None
+
+    # ----------------------------
+    # 記録・安全化
+    # ----------------------------
+    def _record(self, cause, phase, uptime):
+        msg = f"[supervisor] restart #{self.restarts}: {cause} (uptime {uptime:.1f}s)"
+        print(msg)
+        if not self.log_path:
+            return
+        try:
+            new = not os.path.exists(self.log_path)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                if new:
+                    f.write("date,restart,cause,phase,uptime\n")
+                f.write(f"{datetime.now().isoformat()},{self.restarts},\"{cause}\",{phase or ''},{uptime:.1f}\n")
+        except OSError as e:
+            print(f"Warning: restart log could not be written: {e}")
+
+    @staticmethod
+    def _safe_outputs():
+        """モーターとニクロム線を止める（pigpio のPWMは接続していたプロセスが死んでも止まらない）"""
+        try:
+            import pigpio
+            pi = pigpio.pi()
+            if not pi.connected:
+                return
+            try:
+                for pin in SAFE_LOW_PINS:
+                    pi.write(pin, 0)
+            finally:
+                pi.stop()
+        except Exception as e:
+            print(f"Warning: outputs could not be made safe: {e}")
+
+    def _next_wait(self, uptime):
+        if uptime >= STABLE_TIME:
+            self.backoff = 0
+        wait = RESTART_BACKOFF[min(self.backoff, len(RESTART_BACKOFF) - 1)]
+        self.backoff += 1
+        return wait
+
+    def _too_many(self, now):
+        self.restart_times = [t for t in self.restart_times if now - t <= self.restart_window]
+        return len(self.restart_times) > self.max_restarts
+
+    # ----------------------------
+    # メインループ
+    # ----------------------------
+    def stop(self, *_):
+        self._stop = True
+
+    def run(self):
+        self._start()
+        try:
+            while not self._stop:
+                if self.watchdog is not None and not self.giving_up:
+                    self.watchdog.pet()
+
+                cause = self._check()
+                if cause is None:
+                    if self.proc.poll() == 0:
+                        print("[supervisor] mission finished (exit 0)")
+                        return 0
+                    time.sleep(POLL_PERIOD)
+                    continue
+
+                hb = heartbeat.read(self.heartbeat_path)
+                phase = hb[2] if hb and hb[0] == self.proc.pid else None
+                uptime = time.monotonic() - self.started_at
+                self._kill()
+                self._safe_outputs()
+
+                self.restarts += 1
+                self.cause = cause
+                now = time.monotonic()
+                self.restart_times.append(now)
+                self._record(cause, phase, uptime)
+
+                if self._too_many(now) and self.watchdog is not None and not self.giving_up:
+                    # 何度やり直しても固まる（I2Cバスが戻らない等）: 撫でるのをやめて Pi ごと再起動させる
+                    self.giving_up = True
+                    self._record(f"{len(self.restart_times)} restarts in {self.restart_window:.0f}s; "
+                                 f"letting the watchdog reboot", phase, uptime)
+
+                wait = self._next_wait(uptime)
+                t_end = time.monotonic() + wait
+                while time.monotonic() < t_end and not self._stop:
+                    if self.watchdog is not None and not self.giving_up:
+                        self.watchdog.pet()
+                    time.sleep(min(POLL_PERIOD, wait))
+                if not self._stop:
+                    self._start()
+            return 0
+        finally:
+            self._kill()
+            if self.watchdog is not None and not self.giving_up:
+                self.watchdog.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run FM.py under a heartbeat supervisor")
+    parser.add_argument("--timeout", type=float, default=HEARTBEAT_TIMEOUT, help="heartbeat timeout [s]")
+    parser.add_argument("--start-grace", type=float, default=START_GRACE, help="time allowed before the first heartbeat [s]")
+    parser.add_argument("--heartbeat", default=HEARTBEAT_PATH, help="heartbeat file (put it on tmpfs)")
+    parser.add_argument("--log", default=os.path.join(LOG_DIR, "restarts.csv"), help="restart cause log")
+    parser.add_argument("--watchdog", metavar="DEV", help="pet this hardware watchdog device, e.g. /dev/watchdog")
+    parser.add_argument("--watchdog-timeout", type=int, default=WATCHDOG_TIMEOUT, help="[s]")
+    parser.add_argument("--max-restarts", type=int, default=MAX_RESTARTS,
+                        help="restarts within --restart-window before letting the watchdog reboot the Pi")
+    parser.add_argument("--restart-window", type=float, default=RESTART_WINDOW, help="[s]")
+    parser.add_argument("cmd", nargs=argparse.REMAINDER, help="command to supervise (default: FM.py)")
+    args = parser.parse_args()
+
+    cmd = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+    if not cmd:
+        cmd = [sys.executable, os.path.join(HERE, "FM.py")]
+    if args.log:
+        os.makedirs(os.path.dirname(os.path.abspath(args.log)), exist_ok=True)
+
+    watchdog = None
+    if args.watchdog:
+        try:
+            watchdog = Watchdog(args.watchdog, args.watchdog_timeout)
+        except OSError as e:
+            print(f"Warning: watchdog {args.watchdog} unavailable: {e}")
+
+    sup = Supervisor(cmd, timeout=args.timeout, start_grace=args.start_grace, heartbeat_path=args.heartbeat,
+                     log_path=args.log, watchdog=watchdog, max_restarts=args.max_restarts,
+                     restart_window=args.restart_window)
+    signal.signal(signal.SIGTERM, sup.stop)
+    signal.signal(signal.SIGINT, sup.stop)
+    sys.exit(sup.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Cone tracker for CanSat SC-28
+# - 前回確定したコーンの矩形をフレーム間で引き継ぐ軽量トラッカー
+# - テンプレート相関 (cv2.matchTemplate / TM_CCOEFF_NORMED) を探索窓内だけで実行
+# - 相関値を信頼度として返し、低下したらフル検出(色検出+YOLO)に戻す
+# - 赤が画面から消えたフレームが max_empty 回続いたら、相関値に関わらずロスト扱い（いないコーンへ向かわない）
+
+import cv2
+import numpy as np
+
+
+class ConeTracker:
+    def __init__(
+        self,
+        conf_min=0.55,        # これ未満の相関値ならロスト扱い
+        search_scale=2.0,     # 探索窓 = 矩形サイズ × search_scale
+        refresh_conf=0.75,    # これ以上の相関値ならテンプレートを更新（接近による見え方の変化に追従）
+        max_frames=30,        # フル検出なしで追跡を続ける最大フレーム数
+        max_empty=3,          # 赤の面積が0のフレームがこの回数続いたらロスト扱い
+        min_size=8,           # これより小さい矩形は追跡しない [px]
+    ):
+        self.conf_min = float(conf_min)
+        self.search_scale = max(1.0, float(search_scale))
+        self.refresh_conf = float(refresh_conf)
+        self.max_frames = max(1, int(max_frames))
+        self.max_empty = max(1, int(max_empty))
+        self.min_size = int(min_size)
+
+        self.template = None
+        self.box = None        # (x, y, w, h)
+        self.confidence = 0.0
+        self.frames = 0        # 最後の確定からの追跡フレーム数
+        self.empty = 0         # 赤の面積が0のフレームが続いた回数
+
+    @staticmethod
+    def _to_gray(frame):
+        if frame.ndim == 2:
+            return frame
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    @property
+    def active(self):
+        return self.template is not None
+
+    def reset(self):
+        """追跡対象を破棄する"""
+        self.template = None
+        self.box = None
+        self.confidence = 0.0
+        self.frames = 0
+        self.empty = 0
+
+    def init(self, frame, box):
+        """
+        検出で確定した矩形から追跡を開始する
+        Args:
+            frame: BGR画像（注釈描画前のもの）
+            box: (x, y, w, h)
+        Return:
+            True: 追跡開始, False: 矩形が小さすぎる/画像外
+        """
+        x, y, w, h = [int(v) for v in box]
+        height, width = frame.shape[:2]
+        x = max(0, min(x, width - 1))
+        y = max(0, min(y, height - 1))
+        w = min(w, width - x)
+        h = min(h, height - y)
+
+        if w < self.min_size or h < self.min_size:
+            self.reset()
+            return False
+
+        gray = self._to_gray(frame)
+        self.template = gray[y:y + h, x:x + w].copy()
+        self.box = (x, y, w, h)
+        self.confidence = 1.0
+        self.frames = 0
+        self.empty = 0
+        return True
+
+    def update(self, frame, red_area=None):
+        """
+        前回位置の周辺を探索して矩形を更新する
+        Args:
+            red_area: このフレームの赤の面積（None なら見ない）
+        Return:
+            box, confidence （ロスト時は None, 信頼度）
+        """
+        if not self.active:
+            return None, 0.0
+
+        self.frames += 1
+        if self.frames > self.max_frames:
+            # 長時間フル検出していないので、信頼度に関わらず再検出させる
+            self.reset()
+            return None, 0.0
+
+        if red_area is not None:
+            self.empty = self.empty + 1 if red_area <= 0 else 0
+            if self.empty >= self.max_empty:
+                # 赤が消えたまま: テンプレートが背景に合っているだけなので追跡をやめる
+                self.reset()
+                return None, 0.0
+
+        gray = self._to_gray(frame)
+        height, width = gray.shape[:2]
+        x, y, w, h = self.box
+
+        # 探索窓（前回の中心から search_scale 倍の範囲）
+        cx, cy = x + w // 2, y + h // 2
+        sw = int(w * self.search_scale)
+        sh = int(h * self.search_scale)
+        x0 = max(0, cx - sw // 2)
+        y0 = max(0, cy - sh // 2)
+        x1 = min(width, x0 + max(sw, w))
+        y1 = min(height, y0 + max(sh, h))
+        x0 = max(0, x1 - max(sw, w))
+        y0 = max(0, y1 - max(sh, h))
+
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < h or window.shape[1] < w:
+            self.reset()
+            return None, 0.0
+
+        result = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        conf = float(max_val) if np.isfinite(max_val) else 0.0
+        self.confidence = conf
+
+        if conf < self.conf_min:
+            self.reset()
+            self.confidence = conf
+            return None, conf
+
+        nx, ny = x0 + max_loc[0], y0 + max_loc[1]
+        self.box = (nx, ny, w, h)
+
+        if conf >= self.refresh_conf:
+            self.template = gray[ny:ny + h, nx:nx + w].copy()
+
+        return self.box, conf
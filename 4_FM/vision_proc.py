@@ -0,0 +1,192 @@
+# Vision process for the multi-process mode of FM.py (CanSat SC-28)
+# - camera.Camera（撮影・色検出・YOLO・トラッカー）を別プロセスで回し続け、判定結果と画像を shm_ring のリングに書く
+#   → YOLO の推論が別のコアで動き、メインの制御ループ（motordrive の制御スレッド）の周期を乱さない
+# - 画像（注釈付きと注釈前の2枚）はリングの中にそのまま置く。pickle もキューも通さない
+# - 親は RemoteCamera を Camera の代わりに使う。capture_and_detect() は「呼んだ後に撮った」まだ返していないフレームを待って返す
+#   逆さ走行の向き(is_inverted)は親が ctrl リングで子に伝える
+#
+# 使い方（親の側）:
+#   vp = vision_proc.VisionProcess(model_path, hsv_profile)
+#   vp.spawn()                       # YOLO の読み込みを早めに始める
+#   cam = vision_proc.RemoteCamera(vp)
+#   if cam.ready():
+#       frame, x_pct, order, area = cam.capture_and_detect(is_inverted=False)
+
+import sys
+import time
+
+import numpy as np
+
+import procs
+import heartbeat
+
+try:
+    import make_csv
+except ImportError:
+    make_csv = None
+
+FRAME_H, FRAME_W = 480, 640
+FRAME_SLOTS = 3              # 書き込み中・最新・読み手がコピー中 の3つあれば足りる
+START_TIMEOUT = 60.0         # YOLO の読み込みを含めた起動を待つ時間 [s]（camera.MODEL_LOAD_EXPECT と同じ）
+FRAME_TIMEOUT = 2.0          # フレームを待つ時間 [s]
+FRAME_SLACK = 0.1            # 呼ぶ少し前に撮り始めたフレームも使う [s]
+
+FRAME_DTYPE = np.dtype([
+    ("t_capture", "<f8"),
+    ("x_pct", "<f8"),
+    ("order", "<i4"),
+    ("area", "<f8"),
+    ("center", "<i4", (2,)),
+    ("frame_size", "<i4", (2,)),
+    ("track_conf", "<f8"),
+    ("inverted", "u1"),
+    ("frame", "u1", (FRAME_H, FRAME_W, 3)),
+    ("raw", "u1", (FRAME_H, FRAME_W, 3)),
+])
+CTRL_DTYPE = np.dtype([("inverted", "u1")])
+
+LAYOUTS = {
+    "frame": (FRAME_DTYPE, (), FRAME_SLOTS),
+    "ctrl": (CTRL_DTYPE, (), 2),
+}
+
+
+# ==========================================
+# 親の側
+# ==========================================
+class VisionProcess(procs.ChildProcess):
+    def __init__(self, model_path=None, hsv_profile=None):
+        args = []
+        if model_path:
+            args.append(f"--model={model_path}")
+        if hsv_profile:
+            args.append(f"--hsv={hsv_profile}")
+        super().__init__("vision_proc.py", "vision", LAYOUTS, args=args, log_tag="vision")
+
+
+class RemoteCamera:
+    """Camera の代わり。判定は子が行い、ここではリングから受け取って Camera と同じ列をCSVに書く"""
+    def __init__(self, vp):
+        self.vp = vp
+        self.last_raw = None
+        self.last_center = (0, 0)
+        self.track_conf = 0.0
+        self._inverted = None
+        self._last_seq = 0
+
+    def ready(self, timeout=START_TIMEOUT):
+        """子が起動を終えるまで待つ。カメラが開けなければ False"""
+        if self.vp.proc is None:
+            self.vp.spawn()
+        heartbeat.beat(expect=timeout)
+        ok = self.vp.wait_ready(timeout)
+        return bool(ok and ok[0])
+
+    def _set_inverted(self, is_inverted):
+        if self._inverted != bool(is_inverted):
+            rec = np.zeros((), dtype=CTRL_DTYPE)
+            rec["inverted"] = 1 if is_inverted else 0
+            self.vp.rings["ctrl"].write(rec)
+            self._inverted = bool(is_inverted)
+
+    def capture_and_detect(self, is_inverted=False):
+        """Camera.capture_and_detect と同じ (frame, target_x_percent, order, red_area) を返す"""
+        blank = (np.zeros((FRAME_H, FRAME_W, 3), dtype=np.uint8), 0.0, 0, 0)
+        if not self.vp.alive:
+            print("Vision process is not running!")
+            heartbeat.beat(expect=START_TIMEOUT)
+            if self.vp.restart(START_TIMEOUT) is None:
+                return blank
+            self._inverted = None
+            self._last_seq = 0
+        self._set_inverted(is_inverted)
+
+        ring = self.vp.rings["frame"]
+        t_call = time.monotonic() - FRAME_SLACK
+        t_end = time.monotonic() + FRAME_TIMEOUT
+        seq = self._last_seq
+        while True:
+            got = ring.latest()
+            if got is not None and got[0] > seq:
+                seq, rec = got
+                if float(rec["t_capture"]) >= t_call and bool(rec["inverted"]) == bool(is_inverted):
+                    self._last_seq = seq
+                    break
+            if time.monotonic() >= t_end:
+                print("Camera Process Error: no frame from the vision process")
+                return blank
+            time.sleep(0.005)
+
+        order = int(rec["order"])
+        area = float(rec["area"])
+        center = (int(rec["center"][0]), int(rec["center"][1]))
+        size = (int(rec["frame_size"][0]), int(rec["frame_size"][1]))
+        self.last_center = center
+        self.track_conf = float(rec["track_conf"])
+        self.last_raw = rec["raw"]
+        if make_csv:
+            try:
+                make_csv.print('camera_order', order)
+                make_csv.print('camera_area', area)
+                make_csv.print('camera_center', center)
+                make_csv.print('camera_frame_size', size)
+                make_csv.print('camera_track_conf', self.track_conf)
+            except Exception:
+                pass
+        return rec["frame"], float(rec["x_pct"]), order, area
+
+    def close(self):
+        self.vp.close()
+
+
+# ==========================================
+# 子の側
+# ==========================================
+def _fit(img):
+    """リングの大きさ(480x640x3)に合わせる"""
+    if img is None:
+        return None
+    if img.shape[:2] != (FRAME_H, FRAME_W):
+        import cv2
+        img = cv2.resize(img, (FRAME_W, FRAME_H))
+    return img[:, :, :3]
+
+
+def child_main(argv):
+    args = procs.ChildArgs(argv, LAYOUTS)
+    opts = dict(a[2:].split("=", 1) for a in args.extra if a.startswith("--") and "=" in a)
+
+    import camera
+    cam = camera.Camera(model_path=opts.get("model"), keep_raw=True, log_csv=False, hsv_profile=opts.get("hsv"))
+    args.report(cam.picam2 is not None, cam.model is not None)
+
+    rec = np.zeros((), dtype=FRAME_DTYPE)
+    try:
+        while not args.stopped and not args.parent_gone():
+            if cam.picam2 is None:
+                time.sleep(0.5)
+                continue
+            ctrl = args.rings["ctrl"].latest()
+            inverted = bool(ctrl[1]["inverted"]) if ctrl else False
+            t = time.monotonic()
+            frame, x_pct, order, area = cam.capture_and_detect(is_inverted=inverted)
+            rec["t_capture"] = t
+            rec["x_pct"] = x_pct
+            rec["order"] = order
+            rec["area"] = area
+            rec["center"] = cam.last_center
+            rec["frame_size"] = (frame.shape[1], frame.shape[0])
+            rec["track_conf"] = cam.track_conf
+            rec["inverted"] = 1 if inverted else 0
+            rec["frame"] = _fit(frame)
+            raw = _fit(cam.last_raw)
+            rec["raw"] = raw if raw is not None else rec["frame"]
+            args.rings["frame"].write(rec)
+    finally:
+        cam.close()
+        args.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(child_main(sys.argv[1:]))